@@ -8,13 +8,20 @@ Noms et numéros étudiants:
 
 import argparse
 import getpass
-import json
 import socket
 import sys
 
+import glocodec
 import glosocket
 import gloutils
 
+RECIPIENT_STATUS_DISPLAY = {
+    gloutils.RECIPIENT_DELIVERED: "livré",
+    gloutils.RECIPIENT_QUEUED: "en attente d'envoi",
+    gloutils.RECIPIENT_UNKNOWN: "destinataire inexistant",
+    gloutils.RECIPIENT_FAILED: "échec de l'envoi",
+}
+
 
 class Client:
     """Client pour le serveur mail @glo2000.ca."""
@@ -26,33 +33,57 @@ class Client:
         return username, password
 
     def _send_server_message(self, payload: gloutils.GloMessage):
-        raw = json.dumps(payload)
-        glosocket.send_msg(self._socket, raw)
+        raw = self._codec.encode(payload)
+        glosocket.send_data(self._socket, raw, self._compress_threshold)
 
     def _receive_server_message(self) -> gloutils.GloMessage:
-        raw = glosocket.recv_msg(self._socket)
-        return json.loads(raw)
+        raw = glosocket.recv_data(self._socket)
+        return self._codec.decode(raw)
     
     def _exchange_to_server(self, message: gloutils.GloMessage):
         self._send_server_message(payload=message)
         return self._receive_server_message()
 
-
     def __init__(self, destination: str) -> None:
         """
         Prépare et connecte le socket du client `_socket`.
 
         Prépare un attribut `_username` pour stocker le nom d'utilisateur
         courant. Laissé vide quand l'utilisateur n'est pas connecté.
+
+        Négocie ensuite le format de sérialisation `_codec` avec le serveur,
+        et la compression des trames envoyées (`_compress_threshold`).
         """
         try:
             self._username = None
+            self._codec = glocodec.DEFAULT_CODEC
+            self._compress_threshold = None
 
             self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self._socket.connect((destination, gloutils.APP_PORT))
         except:
             sys.exit(-1)
 
+        self._negotiate()
+
+    def _negotiate(self) -> None:
+        """
+        Propose au serveur les formats disponibles et la compression avec
+        l'entête `HELLO`.
+
+        Un serveur qui ne connaît pas HELLO ne répond pas OK : le client
+        reste alors en JSON, sans compression.
+        """
+        payload = gloutils.HelloPayload(codecs=list(glocodec.CODECS),
+                                        compression=[glosocket.COMPRESSION])
+        message = gloutils.GloMessage(header=gloutils.Headers.HELLO, payload=payload)
+        message_rec = self._exchange_to_server(message)
+
+        if message_rec and self._message_is_ok(message_rec):
+            self._codec = glocodec.choose([message_rec["payload"]["codec"]])
+            if message_rec["payload"].get("compression") == glosocket.COMPRESSION:
+                self._compress_threshold = glosocket.COMPRESSION_THRESHOLD
+
     def _message_contains_error(self, message: gloutils.GloMessage) -> bool:
         if message["header"] == gloutils.Headers.ERROR:
             print(message["payload"]["error_message"])
@@ -121,72 +152,177 @@ class Client:
 
     def _read_email(self) -> None:
         """
-        Demande au serveur la liste de ses courriels avec l'entête
-        `INBOX_READING_REQUEST`.
+        Demande au serveur la liste de ses courriels, page par page, avec
+        l'entête `INBOX_PAGE_REQUEST`.
 
-        Affiche la liste des courriels puis transmet le choix de l'utilisateur
-        avec l'entête `INBOX_READING_CHOICE`.
+        Affiche chaque page au besoin puis transmet les choix de l'utilisateur
+        avec l'entête `INBOX_READING_STREAM`. Plusieurs courriels peuvent
+        être demandés d'un coup : les requêtes, sans `request_id`, sont
+        envoyées à la suite et le serveur y répond dans l'ordre, un courriel
+        après l'autre.
 
-        Affiche le courriel à l'aide du gabarit `EMAIL_DISPLAY`.
+        Affiche les courriels à l'aide du gabarit `EMAIL_DISPLAY`, le corps
+        au fur et à mesure de sa réception.
 
         S'il n'y a pas de courriel à lire, l'utilisateur est averti avant de
         retourner au menu principal.
         """
-        message = gloutils.GloMessage(header=gloutils.Headers.INBOX_READING_REQUEST, payload=None)
-        message_rec = self._exchange_to_server(message)
+        offset = 0
 
-        if self._message_contains_error(message_rec):
-            return
+        while True:
+            page = self._get_email_page(offset)
+            if page is None:
+                return
 
-        email_subjects_string = message_rec["payload"]["email_list"]
+            total = page["total"]
+            if total == 0:
+                print("Aucun email dans la boîte. Retour au menu principal.")
+                return
 
-        email_subjects = json.loads(email_subjects_string)
+            for subject in page["email_list"]:
+                print(subject)
 
-        if len(email_subjects) == 0:
-            print("Aucun email dans la boîte. Retour au menu principal.")
-            return
+            offset += len(page["email_list"])
+            if offset >= total:
+                choices = self._get_input_numbers_between(1, total)
+                break
 
-        else:
-            for subject in email_subjects:
-                print(subject)
-        
-        choice = self._get_input_number_between(1, len(email_subjects))
+            print("Entrer 0 pour afficher la page suivante.")
+            choices = self._get_input_numbers_between(0, total)
+            if choices != [0]:
+                break
 
-        payload = gloutils.EmailChoicePayload(choice=choice)
-        message = gloutils.GloMessage(header=gloutils.Headers.INBOX_READING_CHOICE, payload=payload)
+        for choice in choices:
+            self._send_server_message(gloutils.GloMessage(
+                header=gloutils.Headers.INBOX_READING_STREAM,
+                payload=gloutils.EmailChoicePayload(choice=choice)))
 
-        message_rec = self._exchange_to_server(message=message)
+        for _ in choices:
+            self._print_streamed_email()
 
+    def _print_streamed_email(self) -> None:
+        """
+        Reçoit un courriel en trames EMAIL_BODY_BEGIN, EMAIL_BODY_CHUNK et
+        EMAIL_BODY_END et l'affiche sans le garder en entier en mémoire.
+        """
+        message_rec = self._receive_server_message()
         if self._message_contains_error(message_rec):
             return
 
         payload = message_rec["payload"]
-        sender = payload["sender"]
         to = payload["destination"]
-        subject = payload["subject"] 
-        date = payload["date"]
-        body = payload["content"]
+        if payload.get("cc"):
+            to += f" (cc : {payload['cc']})"
+        display = gloutils.EMAIL_DISPLAY.format(sender=payload["sender"],
+                                                to=to,
+                                                subject=payload["subject"],
+                                                date=payload["date"], body="")
+        # Le gabarit se termine par le corps suivi d'un saut de ligne.
+        print(display.removesuffix("\n"), end="")
+        while True:
+            message_rec = self._receive_server_message()
+            if message_rec["header"] != gloutils.Headers.EMAIL_BODY_CHUNK:
+                break
+            sys.stdout.write(message_rec["payload"]["data"])
+        print("\n")
 
-        print(gloutils.EMAIL_DISPLAY.format(sender=sender, to=to, subject=subject, date=date, body=body))
 
+    def _search_email(self) -> None:
+        """
+        Demande les critères de recherche (une réponse vide ignore le
+        critère) et les envoie avec l'entête `INBOX_SEARCH`.
+
+        Affiche les résultats page par page, puis les courriels choisis
+        parmi ceux-ci, comme `_read_email`.
+        """
+        criteria = gloutils.EmailSearchPayload()
+        for key, prompt in (("sender", "Expéditeur (mots) :"),
+                            ("subject", "Sujet (mots) :"),
+                            ("text", "Corps (mots) :"),
+                            ("since", "Depuis le (AAAA-MM-JJ) :"),
+                            ("until", "Avant le (AAAA-MM-JJ) :")):
+            value = input(prompt).strip()
+            if value:
+                criteria[key] = value
+
+        offset = 0
+        found = set()
+        while True:
+            message = gloutils.GloMessage(
+                header=gloutils.Headers.INBOX_SEARCH,
+                payload=gloutils.EmailSearchPayload(
+                    criteria, offset=offset, limit=gloutils.INBOX_PAGE_SIZE))
+            message_rec = self._exchange_to_server(message)
+            if self._message_contains_error(message_rec):
+                return
+            page = message_rec["payload"]
+            if page["total"] == 0:
+                print("Aucun courriel trouvé. Retour au menu principal.")
+                return
+
+            for subject in page["email_list"]:
+                print(subject)
+            found.update(page["choices"])
+
+            offset += len(page["email_list"])
+            more = offset < page["total"]
+            if more:
+                print("Entrer 0 pour afficher la page suivante.")
+            choices = self._get_input_choices(found | {0} if more else found)
+            if choices != [0]:
+                break
+
+        for choice in choices:
+            self._send_server_message(gloutils.GloMessage(
+                header=gloutils.Headers.INBOX_READING_STREAM,
+                payload=gloutils.EmailChoicePayload(choice=choice)))
+
+        for _ in choices:
+            self._print_streamed_email()
+
+    def _get_email_page(self, offset: int) -> "gloutils.EmailPagePayload | None":
+        payload = gloutils.EmailPageRequestPayload(offset=offset,
+                                                   limit=gloutils.INBOX_PAGE_SIZE)
+        message = gloutils.GloMessage(header=gloutils.Headers.INBOX_PAGE_REQUEST, payload=payload)
+        message_rec = self._exchange_to_server(message)
+
+        if self._message_contains_error(message_rec):
+            return None
+        return message_rec["payload"]
 
     def _send_email(self) -> None:
         """
         Demande à l'utilisateur respectivement:
-        - l'adresse email du destinataire,
+        - l'adresse email du destinataire, ou plusieurs séparées par des
+        virgules,
+        - les adresses en copie (cc) et en copie cachée (cci), optionnelles,
         - le sujet du message,
         - le corps du message.
 
         La saisie du corps se termine par un point seul sur une ligne.
 
-        Transmet ces informations avec l'entête `EMAIL_SENDING`.
+        Transmet ces informations avec l'entête `EMAIL_SENDING`. Un corps
+        plus long que `BODY_CHUNK_SIZE` est plutôt transmis au fur et à
+        mesure de la saisie, avec les entêtes `EMAIL_BODY_BEGIN`,
+        `EMAIL_BODY_CHUNK` et `EMAIL_BODY_END`.
+
+        Pour plusieurs destinataires, affiche l'état de la livraison à
+        chacun.
         """
 
         email = input("Veuillez entrer l'adresse courriel du destintaire:")
+        copies = {}
+        cc = input("Adresses en copie (optionnel):")
+        if cc:
+            copies["cc"] = cc
+        bcc = input("Adresses en copie cachée (optionnel):")
+        if bcc:
+            copies["bcc"] = bcc
         subject = input("Veuillez entrer le sujet du message:")
         
         print("Veuillez tapper le corps du message. Pour arrêter, simplement insérer un point solitaire (.) dans la console:")
         body = ""
+        streaming = False
 
         while True:
             line = input()
@@ -194,20 +330,49 @@ class Client:
                 break
             else:
                 body += line + "\n"
-        
-        payload = gloutils.EmailContentPayload(
-            sender=self._username+"@glo2000.ca",
-            destination=email,
-            subject=subject,
-            date=gloutils.get_current_utc_time(),
-            content=body)
-
-        message = gloutils.GloMessage(header=gloutils.Headers.EMAIL_SENDING, payload=payload)
+
+            if len(body) >= gloutils.BODY_CHUNK_SIZE:
+                if not streaming:
+                    header = gloutils.EmailHeaderPayload(
+                        sender=self._username+"@glo2000.ca",
+                        destination=email,
+                        subject=subject,
+                        date=gloutils.get_current_utc_time(),
+                        **copies)
+                    self._send_server_message(gloutils.GloMessage(
+                        header=gloutils.Headers.EMAIL_BODY_BEGIN, payload=header))
+                    streaming = True
+                self._send_server_message(gloutils.GloMessage(
+                    header=gloutils.Headers.EMAIL_BODY_CHUNK,
+                    payload=gloutils.EmailChunkPayload(data=body)))
+                body = ""
+
+        if streaming:
+            if body:
+                self._send_server_message(gloutils.GloMessage(
+                    header=gloutils.Headers.EMAIL_BODY_CHUNK,
+                    payload=gloutils.EmailChunkPayload(data=body)))
+            message = gloutils.GloMessage(header=gloutils.Headers.EMAIL_BODY_END,
+                                          payload=None)
+        else:
+            payload = gloutils.EmailContentPayload(
+                sender=self._username+"@glo2000.ca",
+                destination=email,
+                subject=subject,
+                date=gloutils.get_current_utc_time(),
+                content=body,
+                **copies)
+
+            message = gloutils.GloMessage(header=gloutils.Headers.EMAIL_SENDING, payload=payload)
         message_rec = self._exchange_to_server(message=message)
 
         header = message_rec["header"]
 
-        if header == gloutils.Headers.OK:
+        if header == gloutils.Headers.OK and message_rec.get("payload"):
+            for recipient in message_rec["payload"]["recipients"]:
+                print(f"{recipient['address']} : "
+                      f"{RECIPIENT_STATUS_DISPLAY[recipient['status']]}")
+        elif header == gloutils.Headers.OK:
             print("Envoi du message réussit!")
         elif header == gloutils.Headers.ERROR:
             print(message_rec["payload"]["error_message"])
@@ -255,6 +420,30 @@ class Client:
                 print(f"Le choix doît être un nombre de {min} à {max}.")
         return choice
 
+    def _get_input_numbers_between(self, min: int, max: int) -> "list[int]":
+        """Comme `_get_input_number_between`, mais accepte plusieurs nombres séparés par des espaces."""
+        while True:
+            try:
+                choices = [int(x) for x in input("Entrer votre choix.").split()]
+                if not choices or any(choice not in range(min, max+1) for choice in choices):
+                    raise ValueError()
+                break
+            except:
+                print(f"Les choix doivent être des nombres de {min} à {max}, séparés par des espaces.")
+        return choices
+
+    def _get_input_choices(self, allowed: "set[int]") -> "list[int]":
+        """Comme `_get_input_numbers_between`, mais parmi les nombres `allowed`."""
+        while True:
+            try:
+                choices = [int(x) for x in input("Entrer votre choix.").split()]
+                if not choices or any(choice not in allowed for choice in choices):
+                    raise ValueError()
+                break
+            except ValueError:
+                print("Les choix doivent être des numéros affichés, séparés par des espaces.")
+        return choices
+
     def _authentication_menu(self) -> bool:
         """Returns true if the program should quit."""
         print(20*"-")
@@ -281,7 +470,7 @@ class Client:
         print(gloutils.CLIENT_USE_CHOICE)
         print()
 
-        choice = self._get_input_number_between(1, 4)
+        choice = self._get_input_number_between(1, 5)
         
         if (choice == 1):
             self._read_email()
@@ -291,6 +480,8 @@ class Client:
             self._check_stats()
         if (choice == 4):
             self._logout()
+        if (choice == 5):
+            self._search_email()
 
 
     def run(self) -> None:
@@ -0,0 +1,290 @@
+"""\
+GLO-2000 Travail pratique 4 - Générateur de charge
+
+Simule des utilisateurs concurrents qui utilisent le vrai protocole
+(glosocket et gabarits de gloutils) : création de compte, connexion,
+envoi de courriels internes, consultation de la boîte, lecture de
+courriels, statistiques et reconnexions avec reprise de session.
+
+Affiche le débit et les latences p50/p99 par entête et écrit les
+résultats en JSON pour suivre les régressions du serveur.
+
+Utilisation : python TP4_load.py -d 127.0.0.1 -u 50 -t 30 -o resultats.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import time
+import uuid
+
+import glocodec
+import glosocket
+import gloutils
+
+PASSWORD = "Chargement123"
+
+# Opérations simulées et leur poids relatif.
+OPERATIONS = {"send": 40, "page": 25, "read": 20, "stats": 10, "relogin": 5,
+              "resume": 5}
+
+
+class Recorder:
+    """Accumule les latences et les erreurs par entête."""
+
+    def __init__(self) -> None:
+        self._latencies = {}
+        self._errors = {}
+
+    def record(self, header: gloutils.Headers, latency: float, ok: bool) -> None:
+        self._latencies.setdefault(header.name, []).append(latency)
+        if not ok:
+            self._errors[header.name] = self._errors.get(header.name, 0) + 1
+
+    def merge(self, other: "Recorder") -> None:
+        """Ajoute les mesures d'un autre processus de charge."""
+        for name, latencies in other._latencies.items():
+            self._latencies.setdefault(name, []).extend(latencies)
+        for name, errors in other._errors.items():
+            self._errors[name] = self._errors.get(name, 0) + errors
+
+    def report(self, duration: float) -> dict:
+        """Retourne un résumé par entête, en millisecondes."""
+        headers = {}
+        for name, latencies in sorted(self._latencies.items()):
+            latencies.sort()
+            headers[name] = {
+                "count": len(latencies),
+                "errors": self._errors.get(name, 0),
+                "throughput": len(latencies) / duration,
+                "mean_ms": sum(latencies) / len(latencies) * 1000,
+                "p50_ms": _percentile(latencies, 50) * 1000,
+                "p99_ms": _percentile(latencies, 99) * 1000,
+            }
+        total = sum(header["count"] for header in headers.values())
+        return {"duration": duration, "requests": total,
+                "throughput": total / duration, "headers": headers}
+
+
+def _percentile(values: "list[float]", percent: float) -> float:
+    """Centile par rang le plus proche d'une liste triée."""
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class LoadUser:
+    """Un utilisateur simulé, avec sa propre connexion au serveur."""
+
+    def __init__(self, username: str, recorder: Recorder, codec: str,
+                 compress: bool = False) -> None:
+        self._username = username
+        self._recorder = recorder
+        self._codec_name = codec
+        self._codec = glocodec.DEFAULT_CODEC
+        self._compress = compress
+        self._compress_threshold = None
+        self._reader = None
+        self._writer = None
+        self._total = 0
+        self._destination = None
+        self._token = None
+
+    async def _send(self, message: gloutils.GloMessage) -> None:
+        await glosocket.async_send_data(self._writer, self._codec.encode(message),
+                                        self._compress_threshold)
+
+    async def _exchange(self, header: gloutils.Headers,
+                        payload=None) -> gloutils.GloMessage:
+        start = time.perf_counter()
+        await self._send(gloutils.GloMessage(header=header, payload=payload))
+        response = self._codec.decode(await glosocket.async_recv_data(self._reader))
+        self._recorder.record(header, time.perf_counter() - start,
+                              response["header"] == gloutils.Headers.OK)
+        return response
+
+    async def _open(self) -> None:
+        """Ouvre la connexion et négocie le format."""
+        self._reader, self._writer = await asyncio.open_connection(
+            self._destination, gloutils.APP_PORT)
+        self._codec = glocodec.DEFAULT_CODEC
+        self._compress_threshold = None
+        compression = [glosocket.COMPRESSION] if self._compress else []
+        response = await self._exchange(
+            gloutils.Headers.HELLO,
+            gloutils.HelloPayload(codecs=[self._codec_name],
+                                  compression=compression))
+        self._codec = glocodec.choose([response["payload"]["codec"]])
+        if response["payload"].get("compression") == glosocket.COMPRESSION:
+            self._compress_threshold = glosocket.COMPRESSION_THRESHOLD
+
+    async def connect(self, destination: str) -> None:
+        """Ouvre la connexion, négocie le format puis crée le compte."""
+        self._destination = destination
+        await self._open()
+        response = await self._exchange(
+            gloutils.Headers.AUTH_REGISTER,
+            gloutils.AuthPayload(username=self._username, password=PASSWORD))
+        self._token = response["payload"]["token"]
+
+    async def run(self, usernames: "list[str]", deadline: float) -> None:
+        """Exécute des opérations aléatoires jusqu'à `deadline`."""
+        operations = list(OPERATIONS)
+        weights = list(OPERATIONS.values())
+        while time.monotonic() < deadline:
+            operation = random.choices(operations, weights)[0]
+            await getattr(self, f"_op_{operation}")(usernames)
+
+    async def close(self) -> None:
+        await self._send(gloutils.GloMessage(header=gloutils.Headers.BYE,
+                                             payload=None))
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    async def _op_send(self, usernames: "list[str]") -> None:
+        destination = random.choice(usernames)
+        payload = gloutils.EmailContentPayload(
+            sender=f"{self._username}@{gloutils.SERVER_DOMAIN}",
+            destination=f"{destination}@{gloutils.SERVER_DOMAIN}",
+            subject=f"Charge {uuid.uuid4().hex[:8]}",
+            date=gloutils.get_current_utc_time(),
+            content="Courriel de test de charge.\n" * random.randint(1, 40))
+        await self._exchange(gloutils.Headers.EMAIL_SENDING, payload)
+
+    async def _op_page(self, usernames: "list[str]") -> None:
+        offset = random.randrange(0, max(self._total, 1))
+        response = await self._exchange(
+            gloutils.Headers.INBOX_PAGE_REQUEST,
+            gloutils.EmailPageRequestPayload(offset=offset,
+                                             limit=gloutils.INBOX_PAGE_SIZE))
+        if response["header"] == gloutils.Headers.OK:
+            self._total = response["payload"]["total"]
+
+    async def _op_read(self, usernames: "list[str]") -> None:
+        if self._total == 0:
+            await self._op_page(usernames)
+            return
+        # Les lectures visent surtout les courriels récents.
+        choice = min(int(random.expovariate(0.2)) + 1, self._total)
+        await self._exchange(gloutils.Headers.INBOX_READING_CHOICE,
+                             gloutils.EmailChoicePayload(choice=choice))
+
+    async def _op_stats(self, usernames: "list[str]") -> None:
+        await self._exchange(gloutils.Headers.STATS_REQUEST)
+
+    async def _op_relogin(self, usernames: "list[str]") -> None:
+        # AUTH_LOGOUT n'a pas de réponse.
+        await self._send(gloutils.GloMessage(header=gloutils.Headers.AUTH_LOGOUT,
+                                             payload=None))
+        response = await self._exchange(
+            gloutils.Headers.AUTH_LOGIN,
+            gloutils.AuthPayload(username=self._username, password=PASSWORD))
+        self._token = response["payload"]["token"]
+
+    async def _op_resume(self, usernames: "list[str]") -> None:
+        # Nouvelle connexion qui reprend la session sans mot de passe.
+        await self.close()
+        await self._open()
+        await self._exchange(gloutils.Headers.AUTH_RESUME,
+                             gloutils.SessionPayload(token=self._token))
+
+
+async def _run_load(args: argparse.Namespace, users: int
+                    ) -> "tuple[Recorder, float]":
+    recorder = Recorder()
+    prefix = f"load{uuid.uuid4().hex[:6]}"
+    usernames = [f"{prefix}_{i}" for i in range(users)]
+    users = [LoadUser(username, recorder, args.codec, args.compress)
+             for username in usernames]
+
+    # Tous les comptes existent avant la première livraison.
+    await asyncio.gather(*(user.connect(args.dest) for user in users))
+
+    start = time.monotonic()
+    deadline = start + args.duration
+    await asyncio.gather(*(user.run(usernames, deadline) for user in users))
+    duration = time.monotonic() - start
+
+    await asyncio.gather(*(user.close() for user in users))
+    return recorder, duration
+
+
+def _load_process(args: argparse.Namespace, users: int
+                  ) -> "tuple[Recorder, float]":
+    return asyncio.run(_run_load(args, users))
+
+
+def _run(args: argparse.Namespace) -> dict:
+    """
+    Répartit les utilisateurs entre `args.processes` processus, pour que
+    le générateur ne soit pas limité à un cœur, et fusionne leurs mesures.
+    """
+    processes = max(min(args.processes, args.users), 1)
+    shares = [args.users // processes + (i < args.users % processes)
+              for i in range(processes)]
+    if processes == 1:
+        results = [_load_process(args, args.users)]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(_load_process,
+                                   [(args, users) for users in shares])
+
+    recorder = Recorder()
+    for other, _ in results:
+        recorder.merge(other)
+    report = recorder.report(max(duration for _, duration in results))
+    report["config"] = {"users": args.users, "duration": args.duration,
+                        "codec": args.codec, "compress": args.compress,
+                        "processes": processes, "destination": args.dest}
+    return report
+
+
+def _print_report(report: dict) -> None:
+    print(f"{'entête':>22} {'requêtes':>9} {'erreurs':>8} {'req/s':>9}"
+          f" {'p50 (ms)':>9} {'p99 (ms)':>9}")
+    for name, stats in report["headers"].items():
+        print(f"{name:>22} {stats['count']:>9} {stats['errors']:>8}"
+              f" {stats['throughput']:>9.1f} {stats['p50_ms']:>9.3f}"
+              f" {stats['p99_ms']:>9.3f}")
+    print(f"Total : {report['requests']} requêtes en {report['duration']:.1f} s"
+          f" ({report['throughput']:.1f} req/s)")
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--destination", action="store",
+                        dest="dest", required=True,
+                        help="Adresse IP/URL du serveur.")
+    parser.add_argument("-u", "--users", action="store", type=int,
+                        dest="users", default=20,
+                        help="Nombre d'utilisateurs simulés.")
+    parser.add_argument("-t", "--duration", action="store", type=float,
+                        dest="duration", default=10.0,
+                        help="Durée de la mesure en secondes.")
+    parser.add_argument("-c", "--codec", action="store", dest="codec",
+                        default=glocodec.JsonCodec.name,
+                        choices=list(glocodec.CODECS),
+                        help="Format de sérialisation à négocier.")
+    parser.add_argument("-z", "--compress", action="store_true",
+                        dest="compress",
+                        help="Négocier la compression des trames.")
+    parser.add_argument("-p", "--processes", action="store", type=int,
+                        dest="processes", default=1,
+                        help="Nombre de processus qui se partagent les "
+                             "utilisateurs simulés.")
+    parser.add_argument("-o", "--output", action="store", dest="output",
+                        help="Fichier JSON où écrire les résultats.")
+    args = parser.parse_args(sys.argv[1:])
+
+    report = _run(args)
+    _print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
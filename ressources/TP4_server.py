@@ -6,52 +6,398 @@ Noms et numéros étudiants:
 - Zyed El Hidri 111 159 762
 """
 
-from email.message import EmailMessage
-import hashlib
-import hmac
+import argparse
+import asyncio
+import bisect
+import concurrent.futures
+import email.utils
+import inspect
 import json
+import multiprocessing
+import multiprocessing.connection
 import os
-import select
-import smtplib
+import signal
 import socket
 import sys
 import re
 import pathlib
-
+import struct
+import threading
+import time
+import traceback
+
+import glocache
+import glocodec
+import glomailbox
+import glometrics
+import glopassword
+import glosession
+import glorelay
+import glosearch
 import glosocket
 import gloutils
 
+MAX_PIPELINED_REQUESTS = 64
+USERNAME_PATTERN = re.compile(r"^[\w_\.-]+")
+RESERVED_USERNAMES = ("lost", "outbox", "sessions")
+# Seuils du tampon d'écriture de chaque connexion : au-dessus du seuil
+# haut, on attend qu'il redescende sous le seuil bas avant d'écrire ou de
+# lire la requête suivante.
+WRITE_HIGH_WATER = 256 * 1024
+WRITE_LOW_WATER = 64 * 1024
+# Délai sans aucune progression de l'écriture après lequel un client qui
+# ne lit plus ses réponses est déconnecté.
+SLOW_READER_TIMEOUT = 30.0
+# Taille visée (en caractères de contenu) d'une trame EMAIL_BATCH.
+BATCH_FRAME_SIZE = 256 * 1024
+# Taille (en caractères) à partir de laquelle le corps d'un courriel livré
+# à plusieurs boîtes est écrit une seule fois, puis lié dans chacune.
+SHARED_BODY_SIZE = 16 * 1024
+# Attente maximale d'un INBOX_CHANGES, et intervalle entre deux
+# vérifications quand d'autres processus peuvent livrer dans la boîte.
+MAX_CHANGES_WAIT = 60.0
+CHANGES_POLL_INTERVAL = 1.0
+# Entêtes qui dérivent un mot de passe, traités par `_auth_executor`.
+AUTH_HEADERS = (gloutils.Headers.AUTH_LOGIN, gloutils.Headers.AUTH_REGISTER)
+# Trames d'un envoi par morceaux, toujours traitées dans l'ordre de réception.
+BODY_HEADERS = (gloutils.Headers.EMAIL_BODY_BEGIN,
+                gloutils.Headers.EMAIL_BODY_CHUNK,
+                gloutils.Headers.EMAIL_BODY_END)
+
 
 class Server:
     """Serveur mail @glo2000.ca."""
 
-    def __init__(self) -> None:
+    def __init__(self, workers: int = 0,
+                 smtp_host: str = gloutils.SMTP_SERVER,
+                 smtp_port: int = gloutils.SMTP_PORT,
+                 max_frame_size: int = glosocket.MAX_FRAME_SIZE,
+                 metrics_port: "int | None" = None,
+                 hasher: "glopassword.PasswordHasher | None" = None,
+                 auth_workers: int = 2,
+                 credential_ttl: float = 300.0,
+                 session_ttl: float = glosession.SESSION_TTL,
+                 max_sessions: int = glosession.MAX_SESSIONS,
+                 compression_threshold: "int | None" = glosocket.COMPRESSION_THRESHOLD,
+                 write_high_water: int = WRITE_HIGH_WATER,
+                 write_low_water: int = WRITE_LOW_WATER,
+                 slow_reader_timeout: "float | None" = SLOW_READER_TIMEOUT,
+                 cache_size: int = glocache.DEFAULT_MAX_BYTES,
+                 shared: bool = False
+                 ) -> None:
         """
         Prépare le socket du serveur `_server_socket`
         et le met en mode écoute.
 
+        Si `shared` est vrai, le serveur est l'un des processus lancés par
+        `_supervise` : son socket est ouvert avec SO_REUSEPORT et les
+        sessions sont gardées sur disque, pour être reprises par n'importe
+        lequel des processus.
+
+        Si `workers` est positif, les requêtes sont traitées par un
+        bassin de `workers` fils d'exécution (`_executor`) et la boucle
+        asyncio ne fait que lire et écrire les trames. Sinon, elles sont
+        traitées directement dans la boucle.
+
         Prépare les attributs suivants:
-        - `_client_socs` une liste des sockets clients.
+        - `_client_socs` l'ensemble des flux d'écriture des clients.
         - `_logged_users` un dictionnaire associant chaque
             socket client à un nom d'utilisateur.
+        - `_sessions` les sessions ouvertes par LOGIN/REGISTER, reprises
+            avec AUTH_RESUME et expirées après `session_ttl` secondes
+            d'inactivité. `_client_sessions` associe chaque socket client
+            au jeton de sa session.
+        - `_client_bodies` un dictionnaire associant chaque socket client
+            au courriel qu'il envoie par morceaux (EMAIL_BODY_BEGIN) et
+            au `BodyWriter` qui reçoit son corps.
+        - `_store` le moteur de stockage des boîtes de courriels.
+        - `_change_waiters` les requêtes INBOX_CHANGES en attente, par
+            utilisateur : des futurs de la boucle `_loop`, réveillés par
+            `_notify_delivery`.
+        - `_searches` l'index de recherche de chaque boîte, alimenté à
+            chaque livraison et chargé à la première recherche, protégé
+            par `_searches_lock`. Il est oublié quand `_store` libère la
+            boîte (`_forget_search`), puis rechargé au besoin.
+        - `_cache` les courriels lus et les listes affichées récemment,
+            par utilisateur, dans au plus `cache_size` octets. Les listes
+            d'une boîte sont retirées à chaque livraison.
+        - `_users` le registre des comptes, associant chaque nom
+            d'utilisateur à l'empreinte de son mot de passe (chargée
+            au premier besoin), protégé par `_users_lock`. Les comptes
+            créés par un autre processus y sont ajoutés à leur première
+            mention (`_user_exists`).
+        - `_client_codecs` un dictionnaire associant chaque socket client
+            au format de sérialisation négocié avec l'entête HELLO.
+        - `_max_frame_size` la taille maximale d'une trame reçue ; un
+            client qui annonce une trame plus grande est déconnecté.
+        - `_client_compression` un dictionnaire associant chaque socket
+            client qui a annoncé la compression au seuil à partir duquel
+            ses trames sont compressées (`compression_threshold`, None
+            pour ne jamais compresser).
+        - `_write_limits` les seuils haut et bas du tampon d'écriture de
+            chaque connexion, et `_slow_reader_timeout` le délai sans
+            progression après lequel un client qui ne lit plus ses
+            réponses est déconnecté (None pour ne jamais le faire).
+            `_send_locks` associe à chaque socket client le verrou qui
+            sérialise ses envois : une trame n'est écrite qu'une fois le
+            tampon redescendu sous le seuil bas, même si plusieurs
+            requêtes pipelinées répondent en même temps. Le tampon ne
+            dépasse donc jamais le seuil haut de plus d'une trame ;
+            `_write_buffer_peak` garde le plus grand tampon observé.
+        - `_relay` la file d'envoi des courriels externes vers le
+            serveur SMTP `smtp_host`:`smtp_port`.
+        - `_metrics` les compteurs et histogrammes du serveur, exportés
+            par l'entête METRICS_REQUEST et, si `metrics_port` est donné,
+            en HTTP sur 127.0.0.1:`metrics_port` au format de Prometheus.
+        - `_hasher` la dérivation des mots de passe (scrypt par défaut).
+            Les connexions et créations de compte sont traitées par
+            `_auth_executor`, borné à `auth_workers` fils, pour qu'une
+            rafale de connexions n'occupe ni la boucle ni `_executor`.
+        - `_credentials` les identifiants vérifiés depuis moins de
+            `credential_ttl` secondes, acceptés sans nouvelle dérivation.
 
         S'assure que les dossiers de données du serveur existent.
         """
+        self._metrics = self._make_metrics()
+        self._metrics_port = metrics_port
         try:
-            self._server_socket = self._make_socket()
-            self._client_socs = []
+            self._server_socket = self._make_socket(shared)
+            self._client_socs = set()
+            self._client_codecs = {}
+            self._max_frame_size = max_frame_size
+            self._compression_threshold = compression_threshold
+            self._client_compression = {}
+            self._write_limits = (write_high_water, write_low_water)
+            self._slow_reader_timeout = slow_reader_timeout
+            self._send_locks = {}
+            self._write_buffer_peak = 0
             self._logged_users = {}
+            if shared:
+                self._sessions = glosession.FileSessionStore(
+                    pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR
+                    / gloutils.SERVER_SESSIONS_DIR, session_ttl, max_sessions)
+            else:
+                self._sessions = glosession.SessionStore(session_ttl, max_sessions)
+            self._client_sessions = {}
+            self._client_bodies = {}
+            self._executor = None
+            if workers > 0:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="glo-worker")
+            self._hasher = hasher or glopassword.PasswordHasher()
+            self._auth_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(auth_workers, 1), thread_name_prefix="glo-auth")
+            self._credentials = glopassword.CredentialCache(ttl=credential_ttl)
 
             path = pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR / gloutils.SERVER_LOST_DIR
             path.mkdir(parents=True, exist_ok=True)
-        except:
+
+            self._searches = {}
+            self._searches_lock = threading.Lock()
+            self._store = glomailbox.MailStore(
+                pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR,
+                observe=lambda operation, seconds: self._metrics.observe(
+                    "glo_storage_seconds", seconds, operation),
+                shared=shared, on_release=self._forget_search)
+            self._shared = shared
+            self._loop = None
+            self._change_waiters = {}
+            self._cache = glocache.LRUCache(cache_size)
+            self._users = self._load_users()
+            self._users_lock = threading.Lock()
+
+            self._relay = glorelay.RelayQueue(
+                pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR / gloutils.SERVER_OUTBOX_DIR,
+                host=smtp_host, port=smtp_port)
+        except OSError as error:
+            print(f"Impossible de démarrer le serveur : {error}", file=sys.stderr)
             sys.exit(-1)
+        self._metrics.add_collector(self._collect_metrics)
+
+    @staticmethod
+    def _make_metrics() -> glometrics.Metrics:
+        """Crée le registre des métriques et décrit ses séries."""
+        metrics = glometrics.Metrics()
+        for name, kind, text, label in (
+                ("glo_requests_total", "counter",
+                 "Requêtes traitées.", "header"),
+                ("glo_request_errors_total", "counter",
+                 "Requêtes répondues par ERROR.", "header"),
+                ("glo_request_exceptions_total", "counter",
+                 "Requêtes interrompues par une exception.", "header"),
+                ("glo_request_duration_seconds", "histogram",
+                 "Durée de traitement d'une requête.", "header"),
+                ("glo_requests_in_flight", "gauge",
+                 "Requêtes en cours de traitement.", "label"),
+                ("glo_connections_total", "counter",
+                 "Connexions acceptées.", "label"),
+                ("glo_connections_open", "gauge",
+                 "Connexions ouvertes.", "label"),
+                ("glo_protocol_errors_total", "counter",
+                 "Connexions fermées sur une trame invalide.", "label"),
+                ("glo_slow_readers_total", "counter",
+                 "Clients déconnectés parce qu'ils ne lisaient plus.", "label"),
+                ("glo_write_waits_total", "counter",
+                 "Lectures suspendues le temps de vider le tampon d'écriture.",
+                 "label"),
+                ("glo_bytes_received_total", "counter",
+                 "Octets reçus après décompression, longueur des trames "
+                 "comprise.", "label"),
+                ("glo_bytes_sent_total", "counter",
+                 "Octets écrits sur les sockets, longueur des trames comprise.",
+                 "label"),
+                ("glo_storage_seconds", "histogram",
+                 "Durée des opérations sur les boîtes de courriels.",
+                 "operation"),
+                ("glo_password_hash_seconds", "histogram",
+                 "Durée d'une dérivation de mot de passe.", "operation"),
+                ("glo_credential_cache_total", "counter",
+                 "Vérifications de connexion par le cache.", "result"),
+                ("glo_mail_cache_total", "counter",
+                 "Consultations et retraits du cache des courriels et des "
+                 "listes.", "result"),
+                ("glo_mail_cache_bytes", "gauge",
+                 "Taille estimée du cache des courriels et des listes.",
+                 "label"),
+                ("glo_mail_cache_entries", "gauge",
+                 "Entrées du cache des courriels et des listes.", "label"),
+                ("glo_sessions", "gauge",
+                 "Sessions ouvertes, connectées ou reprenables.", "label"),
+                ("glo_mailboxes_loaded", "gauge",
+                 "Boîtes de courriels chargées en mémoire.", "label"),
+                ("glo_relay_queue_depth", "gauge",
+                 "Courriels externes en attente d'envoi.", "label"),
+                ("glo_relay_sent_total", "counter",
+                 "Courriels externes relayés.", "label"),
+                ("glo_relay_failed_total", "counter",
+                 "Courriels externes abandonnés.", "label"),
+                ("glo_relay_retried_total", "counter",
+                 "Tentatives de relais reportées.", "label"),
+                ("glo_relay_average_latency_seconds", "gauge",
+                 "Durée moyenne d'un envoi SMTP.", "label"),
+                ("glo_write_buffer_peak_bytes", "gauge",
+                 "Plus grand tampon d'écriture d'une connexion, trame en "
+                 "cours comprise.", "label")):
+            metrics.describe(name, kind, text, label)
+        return metrics
+
+    def _collect_metrics(self, metrics: glometrics.Metrics) -> None:
+        """Recopie les compteurs tenus par le stockage, le cache et le relais."""
+        metrics.set("glo_sessions", len(self._sessions))
+        metrics.set("glo_mailboxes_loaded", len(self._store))
+        cache = self._cache.stats()
+        metrics.set("glo_mail_cache_total", cache["hits"], "hit")
+        metrics.set("glo_mail_cache_total", cache["misses"], "miss")
+        metrics.set("glo_mail_cache_total", cache["evictions"], "eviction")
+        metrics.set("glo_mail_cache_total", cache["invalidations"],
+                    "invalidation")
+        metrics.set("glo_mail_cache_bytes", cache["bytes"])
+        metrics.set("glo_mail_cache_entries", cache["entries"])
+        relay = self._relay.stats()
+        metrics.set("glo_relay_queue_depth", relay["depth"])
+        metrics.set("glo_relay_sent_total", relay["sent"])
+        metrics.set("glo_relay_failed_total", relay["failed"])
+        metrics.set("glo_relay_retried_total", relay["retried"])
+        metrics.set("glo_relay_average_latency_seconds", relay["average_latency"])
+        metrics.set("glo_write_buffer_peak_bytes", self._write_buffer_peak)
+
+    def _load_users(self) -> "dict[str, str | None]":
+        """Parcourt une seule fois le dossier de données pour lister les comptes."""
+        path = pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR
+        reserved = (gloutils.SERVER_LOST_DIR, gloutils.SERVER_OUTBOX_DIR,
+                    gloutils.SERVER_SESSIONS_DIR)
+        return {x.name: None for x in path.iterdir()
+                if x.is_dir() and x.name not in reserved}
+
+    def _user_exists(self, username: str) -> bool:
+        """
+        Indique si le compte existe. Un compte absent du registre a pu être
+        créé depuis par un autre processus : son fichier de mot de passe
+        est alors cherché sur disque.
+        """
+        if username in self._users:
+            return True
+        if not USERNAME_PATTERN.fullmatch(username):
+            return False
+        path = (pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR / username
+                / gloutils.PASSWORD_FILENAME)
+        if not path.is_file():
+            return False
+        self._users.setdefault(username, None)
+        return True
+
+    def _get_password_hash(self, username: str) -> "str | None":
+        """Retourne l'empreinte du mot de passe ou None si le compte n'existe pas."""
+        if not self._user_exists(username):
+            return None
+        if self._users[username] is None:
+            path = (pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR / username
+                    / gloutils.PASSWORD_FILENAME)
+            self._users[username] = path.read_text()
+        return self._users[username]
+
+    def _store_password_hash(self, username: str, password_hash: str,
+                             create: bool = False) -> bool:
+        """
+        Écrit l'empreinte du mot de passe de façon atomique et met à jour
+        le registre. Doit être appelée avec `_users_lock`.
+
+        Si `create` est vrai, retourne False sans rien écrire si le compte
+        existe déjà, même s'il vient d'être créé par un autre processus.
+        """
+        path = (pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR / username
+                / gloutils.PASSWORD_FILENAME)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(password_hash)
+        if create:
+            try:
+                os.link(tmp_path, path)
+            except FileExistsError:
+                return False
+            finally:
+                tmp_path.unlink()
+        else:
+            os.replace(tmp_path, path)
+        self._users[username] = password_hash
+        return True
 
-    def _make_socket(self):
+    def _hash_password(self, password: str) -> str:
+        with self._metrics.time("glo_password_hash_seconds", "hash"):
+            return self._hasher.hash(password)
+
+    def _verify_password(self, username: str, password: str, stored: str) -> bool:
+        """
+        Vérifie le mot de passe, par le cache si possible, et remplace
+        une empreinte qui n'utilise pas les paramètres actuels.
+        """
+        if self._credentials.check(username, password, stored):
+            self._metrics.inc("glo_credential_cache_total", "hit")
+            return True
+        self._metrics.inc("glo_credential_cache_total", "miss")
+
+        with self._metrics.time("glo_password_hash_seconds", "verify"):
+            valid = self._hasher.verify(password, stored)
+        if not valid:
+            return False
+
+        if self._hasher.needs_rehash(stored):
+            new_hash = self._hash_password(password)
+            with self._users_lock:
+                # Un autre fil a pu le faire entre-temps.
+                if self._users.get(username) == stored:
+                    self._store_password_hash(username, new_hash)
+                    stored = new_hash
+        self._credentials.remember(username, password, stored)
+        return True
+
+    def _make_socket(self, reuse_port: bool = False):
         soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         soc.bind(("127.0.0.1", gloutils.APP_PORT))
-        soc.listen(10)
+        soc.listen(socket.SOMAXCONN)
+        soc.setblocking(False)
         return soc
 
     def cleanup(self) -> None:
@@ -59,70 +405,107 @@ class Server:
         for client_soc in self._client_socs:
             client_soc.close()
         self._server_socket.close()
+        self._relay.close()
+        self._store.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._auth_executor.shutdown(wait=False, cancel_futures=True)
 
-    def _accept_client(self) -> None:
-        """Accepte un nouveau client."""
-        newsocket, _ = self._server_socket.accept()
-        
-        self._client_socs.append(newsocket)
-
-    def _remove_client(self, client_soc: socket.socket) -> None:
+    def _remove_client(self, client_soc: asyncio.StreamWriter) -> None:
         """Retire le client des structures de données et ferme sa connexion."""
 
-        self._client_socs.remove(client_soc)
+        self._client_socs.discard(client_soc)
         
-        if id(client_soc) in self._logged_users:
-            self._logged_users.pop(id(client_soc))
+        if client_soc in self._logged_users:
+            self._logged_users.pop(client_soc)
+        self._client_codecs.pop(client_soc, None)
+        self._client_compression.pop(client_soc, None)
+        self._send_locks.pop(client_soc, None)
+        token = self._client_sessions.pop(client_soc, None)
+        if token is not None:
+            # La session reste valide : son délai d'inactivité commence.
+            self._sessions.touch(token)
+        self._abort_body(client_soc)
         
         client_soc.close()
 
-    def _create_account(self, client_soc: socket.socket,
+    def _create_account(self, client_soc: asyncio.StreamWriter,
                         payload: gloutils.AuthPayload
                         ) -> gloutils.GloMessage:
         """
         Crée un compte à partir des données du payload.
 
         Si les identifiants sont valides, créee le dossier de l'utilisateur,
-        associe le socket au nouvel l'utilisateur et retourne un succès,
-        sinon retourne un message d'erreur.
+        associe le socket au nouvel l'utilisateur et retourne un succès
+        avec le jeton de sa session, sinon retourne un message d'erreur.
         """
         username = payload["username"]
         password = payload["password"]
 
-        username_pattern = re.compile(r"^[\w_\.-]+")
         password_pattern = re.compile(r"^(?=.*?[A-Z])(?=.*?[a-z])(?=.*?[0-9]).{10,}$")
 
-        if (not username_pattern.fullmatch(username)) or username.lower() == "lost":
+        if (not USERNAME_PATTERN.fullmatch(username)) or username.lower() in RESERVED_USERNAMES:
             return self._get_error_message("Le nom d'utilisateur doit être composé de caractères alpha numériques et ., - ou _.")
 
         if not password_pattern.fullmatch(password):
             return self._get_error_message("Le mot de passe doit contenir une lettre majuscule et une lettre minuscule. Doit aussi contenir au moins 10 caractères.")
         
-        #create folder if not exists
-        path = pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR
-
-        for x in path.iterdir(): 
-            if x.is_dir() and x.name == username.lower():
-                return self._get_error_message("Le nom d'utilisateur est déjà pris.")
-        
-        path = path / username.lower()
+        if self._user_exists(username.lower()):
+            return self._get_error_message("Le nom d'utilisateur est déjà pris.")
 
-        path.mkdir(parents=True, exist_ok=True)
+        encoded_pass = self._hash_password(password)
 
-        path = path / gloutils.PASSWORD_FILENAME
+        with self._users_lock:
+            if username.lower() in self._users:
+                return self._get_error_message("Le nom d'utilisateur est déjà pris.")
 
-        path.touch(exist_ok=True)
+            #create folder if not exists
+            path = pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR / username.lower()
 
-        hasher = hashlib.sha3_512()
+            path.mkdir(parents=True, exist_ok=True)
 
-        hasher.update(password.encode("utf-8"))
-        encoded_pass = hasher.hexdigest()
+            # Un autre processus a pu créer le même compte entre-temps.
+            if not self._store_password_hash(username.lower(), encoded_pass,
+                                             create=True):
+                return self._get_error_message("Le nom d'utilisateur est déjà pris.")
+        self._credentials.remember(username.lower(), password, encoded_pass)
 
-        path.write_text(encoded_pass)
-        self._logged_users[id(client_soc)] = username.lower()
+        return self._open_session(client_soc, username.lower())
 
-        header = gloutils.Headers.OK
-        return gloutils.GloMessage(header=header, payload=None)
+    def _open_session(self, client_soc: asyncio.StreamWriter, username: str
+                      ) -> gloutils.GloMessage:
+        """
+        Associe le socket à l'utilisateur, remplace la session précédente
+        du socket par une nouvelle et retourne un succès avec son jeton.
+        """
+        previous = self._client_sessions.get(client_soc)
+        if previous is not None:
+            self._sessions.revoke(previous)
+        token = self._sessions.create(username)
+        self._client_sessions[client_soc] = token
+        self._logged_users[client_soc] = username
+        payload = gloutils.SessionPayload(token=token)
+        return gloutils.GloMessage(header=gloutils.Headers.OK, payload=payload)
+
+    def _resume_session(self, client_soc: asyncio.StreamWriter,
+                        payload: gloutils.SessionPayload
+                        ) -> gloutils.GloMessage:
+        """
+        Reprend sur ce socket la session du jeton fourni, sans vérifier
+        de mot de passe. Retourne une erreur si la session a expiré.
+        """
+        token = payload["token"]
+        username = self._sessions.resume(token)
+        if username is None or not self._user_exists(username):
+            return self._get_error_message("La session a expiré.")
+
+        previous = self._client_sessions.get(client_soc)
+        if previous is not None and previous != token:
+            self._sessions.revoke(previous)
+        self._client_sessions[client_soc] = token
+        self._logged_users[client_soc] = username
+        return gloutils.GloMessage(header=gloutils.Headers.OK,
+                                   payload=gloutils.SessionPayload(token=token))
     
     def _get_error_message(self, message: str):
         payload = gloutils.ErrorPayload(error_message=message)
@@ -130,52 +513,42 @@ class Server:
         message = gloutils.GloMessage(payload=payload, header=header)
         return message
 
-    def _login(self, client_soc: socket.socket, payload: gloutils.AuthPayload
+    def _login(self, client_soc: asyncio.StreamWriter, payload: gloutils.AuthPayload
                ) -> gloutils.GloMessage:
         """
         Vérifie que les données fournies correspondent à un compte existant.
 
         Si les identifiants sont valides, associe le socket à l'utilisateur et
-        retourne un succès, sinon retourne un message d'erreur.
+        retourne un succès avec le jeton d'une nouvelle session, sinon
+        retourne un message d'erreur.
         """
-
-        path = pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR
-        
         username = payload["username"]
         password = payload["password"]
 
-        stored_password = None
+        stored_password = self._get_password_hash(username.lower())
 
-        for x in path.iterdir(): 
-            if x.is_dir() and x.name == username.lower():
-                with open(path / username.lower() / gloutils.PASSWORD_FILENAME, 'r') as password_file:
-                    stored_password = password_file.read()
-        
         if stored_password == None:
             return self._get_error_message("L'utilisateur n'existe pas.")
         
-        hasher = hashlib.sha3_512()
-        hasher.update(password.encode("utf-8"))
-        digest = hasher.hexdigest()
-
-        if hmac.compare_digest(digest, stored_password):
-            self._logged_users[id(client_soc)] = username.lower()
-            header = gloutils.Headers.OK
-            return gloutils.GloMessage(payload=None, header=header)
+        if self._verify_password(username.lower(), password, stored_password):
+            return self._open_session(client_soc, username.lower())
         else:
             return self._get_error_message("Mot de passe incorrecte.")
         
 
-    def _logout(self, client_soc: socket.socket) -> None:
-        """Déconnecte un utilisateur."""
+    def _logout(self, client_soc: asyncio.StreamWriter) -> None:
+        """Déconnecte un utilisateur et ferme sa session."""
 
-        if id(client_soc) not in self._logged_users:
+        if client_soc not in self._logged_users:
             return self._get_error_message("Aucun utilisateur connecté")
         else:
-            self._logged_users.pop(id(client_soc))
+            self._logged_users.pop(client_soc)
+            token = self._client_sessions.pop(client_soc, None)
+            if token is not None:
+                self._sessions.revoke(token)
             return gloutils.GloMessage(header=gloutils.Headers.OK, payload=None)
 
-    def _get_email_list(self, client_soc: socket.socket
+    def _get_email_list(self, client_soc: asyncio.StreamWriter
                         ) -> gloutils.GloMessage:
         """
         Récupère la liste des courriels de l'utilisateur associé au socket.
@@ -183,59 +556,301 @@ class Server:
         SUBJECT_DISPLAY et sont ordonnés du plus récent au plus ancien.
 
         Une absence de courriel n'est pas une erreur, mais une liste vide.
+        La liste encodée est gardée dans `_cache` jusqu'à la prochaine
+        livraison.
         """
 
         try:
-            username = self._logged_users[id(client_soc)]
-        except:
+            username = self._logged_users[client_soc]
+        except KeyError:
             return self._get_error_message("Utilisateur invalide")
         
-        email_list = self._get_client_emails_as_json_list(username=username)
-
-        subject_display_list = []
-
-        for i in range(0, len(email_list)):
-            subject = email_list[i]["subject"]
-            sender = email_list[i]["sender"]
-            date = email_list[i]["date"]
-            subject_display_list.append(gloutils.SUBJECT_DISPLAY.format(number=i+1, subject=subject, sender=sender, date=date))
+        entries = self._get_mailbox(username).entries()
+        key = ("page", *self._listing_version(entries))
+        email_list = self._cache.get(username, key)
+        if email_list is None:
+            subject_display_list = [self._format_subject(i + 1, entry)
+                                    for i, entry in enumerate(reversed(entries))]
+            email_list = json.dumps(subject_display_list)
+            self._cache.put(username, key, email_list)
 
         header = gloutils.Headers.OK
-        payload = gloutils.EmailListPayload(email_list=json.dumps(subject_display_list))
+        payload = gloutils.EmailListPayload(email_list=email_list)
         message = gloutils.GloMessage(header=header, payload=payload)
 
         return message
 
-    def _get_client_emails_as_json_list(self, username: str) -> list:
-        path = pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR / username.lower()
-        email_file_list = [f for f in path.iterdir() if f.name != gloutils.PASSWORD_FILENAME]
-        email_list = []
+    def _get_email_page(self, client_soc: asyncio.StreamWriter,
+                        payload: gloutils.EmailPageRequestPayload
+                        ) -> gloutils.GloMessage:
+        """
+        Récupère une page de la liste des courriels de l'utilisateur associé
+        au socket, du plus récent au plus ancien, ainsi que le nombre total
+        de courriels. Le coût est proportionnel à la taille de la page.
+        """
+        try:
+            username = self._logged_users[client_soc]
+        except KeyError:
+            return self._get_error_message("Utilisateur invalide")
 
-        for file in email_file_list:
-            with open(file, 'r') as email_file:
-                email_list.append(json.loads(email_file.read()))
-        
-        email_list.reverse()
-        return email_list
+        try:
+            offset = max(int(payload["offset"]), 0)
+            limit = min(max(int(payload["limit"]), 0), gloutils.INBOX_MAX_PAGE_SIZE)
+        except (KeyError, TypeError, ValueError):
+            return self._get_error_message("Requête de page invalide.")
+
+        mailbox = self._get_mailbox(username)
+        version = self._listing_version(mailbox.entries())
+        key = ("page", *version, offset, limit)
+        subject_display_list = self._cache.get(username, key)
+        if subject_display_list is None:
+            with self._metrics.time("glo_storage_seconds", "page"):
+                entries = mailbox.newest(offset, limit)
+            subject_display_list = [self._format_subject(offset + i + 1, entry)
+                                    for i, entry in enumerate(entries)]
+            self._cache.put(username, key, subject_display_list)
+
+        header = gloutils.Headers.OK
+        payload = gloutils.EmailPagePayload(email_list=subject_display_list,
+                                            total=version[0])
+        return gloutils.GloMessage(header=header, payload=payload)
+
+    @staticmethod
+    def _listing_version(entries: "list[glomailbox.IndexEntry]"
+                         ) -> "tuple[int, int]":
+        """
+        Identifie l'état d'une boîte pour les listes en cache : toute
+        livraison change le numéro du dernier courriel, toute suppression
+        le nombre de courriels, même si elle vient d'un autre processus.
+        """
+        return len(entries), entries[-1]["number"] if entries else 0
+
+    @staticmethod
+    def _format_subject(number: int, entry: glomailbox.IndexEntry) -> str:
+        return gloutils.SUBJECT_DISPLAY.format(number=number,
+                                               subject=entry["subject"],
+                                               sender=entry["sender"],
+                                               date=entry["date"])
+
+    def _negotiate(self, client_soc: asyncio.StreamWriter,
+                   payload: gloutils.HelloPayload) -> gloutils.GloMessage:
+        """
+        Choisit le format de sérialisation parmi ceux proposés par le client,
+        et active la compression des trames s'il l'a proposée.
+
+        La réponse est encore encodée avec l'ancien format ; le format
+        retenu s'applique aux trames suivantes.
+        """
+        codec = glocodec.choose(payload.get("codecs", []))
+        self._client_codecs[client_soc] = codec
+
+        compression = None
+        if (self._compression_threshold is not None
+                and glosocket.COMPRESSION in payload.get("compression", [])):
+            compression = glosocket.COMPRESSION
+            self._client_compression[client_soc] = self._compression_threshold
+
+        payload = gloutils.HelloReplyPayload(codec=codec.name,
+                                             compression=compression)
+        return gloutils.GloMessage(header=gloutils.Headers.OK, payload=payload)
+
+    def _get_mailbox(self, username: str) -> glomailbox.Mailbox:
+        """Retourne la boîte de courriels de l'utilisateur, chargée une seule fois."""
+        return self._store.get(username)
+
+    def _get_search(self, username: str) -> glosearch.MailboxSearch:
+        """Retourne l'index de recherche de la boîte de l'utilisateur."""
+        with self._searches_lock:
+            if username not in self._searches:
+                self._searches[username] = glosearch.MailboxSearch(
+                    self._get_mailbox(username),
+                    pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR / username)
+            return self._searches[username]
+
+    def _forget_search(self, username: str) -> None:
+        """Oublie l'index de recherche d'une boîte libérée par `_store`."""
+        with self._searches_lock:
+            self._searches.pop(username, None)
+
+    def _search_emails(self, client_soc: asyncio.StreamWriter,
+                       payload: gloutils.EmailSearchPayload
+                       ) -> gloutils.GloMessage:
+        """
+        Recherche dans la boîte de l'utilisateur associé au socket les
+        courriels qui satisfont tous les critères donnés, et retourne une
+        page de résultats, du plus récent au plus ancien, avec le choix
+        qui permet de lire chacun.
+
+        La recherche utilise l'index inversé de la boîte, sans lire les
+        fichiers des courriels (sauf ceux livrés depuis la dernière).
+        """
+        try:
+            username = self._logged_users[client_soc]
+        except KeyError:
+            return self._get_error_message("Utilisateur invalide")
 
-    def _get_email(self, client_soc: socket.socket,
+        try:
+            criteria = {key: str(payload.get(key, ""))
+                        for key in ("sender", "subject", "text")}
+            since = payload.get("since")
+            until = payload.get("until")
+            since = glosearch.parse_query_date(since) if since else None
+            until = glosearch.parse_query_date(until) if until else None
+            offset = max(int(payload.get("offset", 0)), 0)
+            limit = min(max(int(payload.get("limit", gloutils.INBOX_PAGE_SIZE)), 0),
+                        gloutils.INBOX_MAX_PAGE_SIZE)
+        except (AttributeError, TypeError, ValueError):
+            return self._get_error_message("Requête de recherche invalide.")
+        if not any(criteria.values()) and since is None and until is None:
+            return self._get_error_message("Aucun critère de recherche.")
+
+        mailbox = self._get_mailbox(username)
+        with self._metrics.time("glo_storage_seconds", "search"):
+            positions = self._get_search(username).search(
+                since=since, until=until, **criteria)
+        entries = mailbox.entries()
+        count = len(entries)
+
+        # Du plus récent au plus ancien ; le choix 1 est le plus récent.
+        stop = max(len(positions) - offset, 0)
+        page = positions[max(stop - limit, 0):stop][::-1]
+        choices = [count - position + 1 for position in page]
+        email_list = [self._format_subject(choice, entries[position - 1])
+                      for choice, position in zip(choices, page)]
+        payload = gloutils.EmailSearchResultPayload(
+            email_list=email_list, choices=choices, total=len(positions))
+        return gloutils.GloMessage(header=gloutils.Headers.OK, payload=payload)
+
+    def _get_changes(self, client_soc: asyncio.StreamWriter,
+                     payload: gloutils.EmailChangesRequestPayload):
+        """
+        Retourne les courriels livrés après le curseur `cursor` (un numéro
+        de courriel, 0 pour tous), au plus `limit`, du plus ancien au plus
+        récent, ainsi que le nouveau curseur. Le coût est proportionnel
+        au nombre de courriels retournés, pas à la taille de la boîte.
+
+        S'il n'y a rien de nouveau et que `wait` est positif, retourne une
+        coroutine qui attend une livraison (au plus `wait` secondes,
+        borné par MAX_CHANGES_WAIT) avant de répondre.
+        """
+        try:
+            username = self._logged_users[client_soc]
+        except KeyError:
+            return self._get_error_message("Utilisateur invalide")
+
+        try:
+            cursor = max(int(payload["cursor"]), 0)
+            limit = min(max(int(payload.get("limit", gloutils.INBOX_MAX_PAGE_SIZE)), 0),
+                        gloutils.INBOX_MAX_PAGE_SIZE)
+            wait = min(max(float(payload.get("wait", 0)), 0.0), MAX_CHANGES_WAIT)
+        except (KeyError, TypeError, ValueError):
+            return self._get_error_message("Requête de changements invalide.")
+
+        response = self._changes(username, cursor, limit)
+        if response["payload"]["total"] or not wait or self._loop is None:
+            return response
+        return self._wait_changes(username, cursor, limit, wait)
+
+    def _changes(self, username: str, cursor: int, limit: int
+                 ) -> gloutils.GloMessage:
+        entries = self._get_mailbox(username).entries()
+        count = len(entries)
+        start = bisect.bisect_right(entries, cursor,
+                                    key=lambda entry: entry["number"])
+        new = entries[start:start + limit]
+        choices = [count - start - i for i in range(len(new))]
+        email_list = [self._format_subject(choice, entry)
+                      for choice, entry in zip(choices, new)]
+        if new:
+            cursor = new[-1]["number"]
+        elif entries:
+            # Curseur trop grand (courriels supprimés) : ramené au dernier.
+            cursor = min(cursor, entries[-1]["number"])
+        payload = gloutils.EmailChangesPayload(
+            email_list=email_list, choices=choices, cursor=cursor,
+            total=count - start)
+        return gloutils.GloMessage(header=gloutils.Headers.OK, payload=payload)
+
+    async def _wait_changes(self, username: str, cursor: int, limit: int,
+                            wait: float) -> gloutils.GloMessage:
+        """
+        Attend une livraison dans la boîte de `username`, au plus `wait`
+        secondes, puis retourne les changements depuis `cursor`. Si
+        d'autres processus peuvent livrer, la boîte est aussi relue toutes
+        les CHANGES_POLL_INTERVAL secondes.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        while True:
+            waiter = loop.create_future()
+            self._change_waiters.setdefault(username, set()).add(waiter)
+            try:
+                # Relu après l'inscription : une livraison entre les deux
+                # n'est pas manquée.
+                response = await self._run(self._changes, username, cursor, limit)
+                remaining = deadline - loop.time()
+                if response["payload"]["total"] or remaining <= 0:
+                    return response
+                if self._shared:
+                    remaining = min(remaining, CHANGES_POLL_INTERVAL)
+                await asyncio.wait([waiter], timeout=remaining)
+            finally:
+                waiters = self._change_waiters.get(username)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._change_waiters[username]
+
+    def _notify_delivery(self, username: str) -> None:
+        """
+        Réveille les requêtes INBOX_CHANGES qui attendent une livraison
+        dans la boîte de `username`. Peut être appelée depuis n'importe
+        quel fil.
+        """
+        if self._loop is not None and username in self._change_waiters:
+            self._loop.call_soon_threadsafe(self._wake_waiters, username)
+
+    def _wake_waiters(self, username: str) -> None:
+        for waiter in self._change_waiters.get(username, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _get_email(self, client_soc: asyncio.StreamWriter,
                    payload: gloutils.EmailChoicePayload
                    ) -> gloutils.GloMessage:
         """
         Récupère le contenu de l'email dans le dossier de l'utilisateur associé
-        au socket.
+        au socket. Le courriel décodé est gardé dans `_cache`, sous son
+        numéro, qui ne change jamais.
         """
 
         try:
-            username = self._logged_users[id(client_soc)]
-        except:
+            username = self._logged_users[client_soc]
+        except KeyError:
             return self._get_error_message("Invalid socket.")
 
-        email_list = self._get_client_emails_as_json_list(username=username)
+        try:
+            choice = int(payload["choice"])
+        except (KeyError, TypeError, ValueError):
+            return self._get_error_message("Requête de lecture invalide.")
 
-        index = int(payload["choice"]) - 1
+        mailbox = self._get_mailbox(username)
+        entries = mailbox.entries()
 
-        email_to_send = email_list[index]
+        # Le choix 1 correspond au courriel le plus récent.
+        position = len(entries) - choice + 1
+        if not 1 <= position <= len(entries):
+            return self._get_error_message("Ce courriel n'existe pas.")
+        key = ("email", entries[position - 1]["number"])
+
+        email_to_send = self._cache.get(username, key)
+        if email_to_send is None:
+            try:
+                with self._metrics.time("glo_storage_seconds", "read"):
+                    email_to_send = mailbox.read(position)
+            except IndexError:
+                return self._get_error_message("Ce courriel n'existe pas.")
+            self._cache.put(username, key, email_to_send)
 
         payload = gloutils.EmailContentPayload(
             sender=email_to_send["sender"],
@@ -244,139 +859,834 @@ class Server:
             date=email_to_send["date"],
             content=email_to_send["content"]
         )
+        if "cc" in email_to_send:
+            payload["cc"] = email_to_send["cc"]
 
         header = gloutils.Headers.OK
 
         return gloutils.GloMessage(payload=payload, header=header)
 
-    def _get_stats(self, client_soc: socket.socket) -> gloutils.GloMessage:
+    def _stream_email(self, client_soc: asyncio.StreamWriter,
+                      payload: gloutils.EmailChoicePayload):
         """
-        Récupère le nombre de courriels et la taille du dossier et des fichiers
-        de l'utilisateur associé au socket.
+        Comme `_get_email`, mais retourne les trames EMAIL_BODY_BEGIN,
+        EMAIL_BODY_CHUNK et EMAIL_BODY_END : le corps est lu sur disque
+        au fur et à mesure de l'envoi, `BODY_CHUNK_SIZE` caractères à
+        la fois. Retourne un message d'erreur si le courriel n'existe pas.
         """
+        try:
+            username = self._logged_users[client_soc]
+        except KeyError:
+            return self._get_error_message("Invalid socket.")
 
         try:
-            username = self._logged_users[id(client_soc)]
-        except:
-            return self._get_error_message("Socket has no associated user.")
+            choice = int(payload["choice"])
+        except (KeyError, TypeError, ValueError):
+            return self._get_error_message("Requête de lecture invalide.")
+
+        mailbox = self._get_mailbox(username)
+        number = len(mailbox) - choice + 1
+
+        try:
+            with self._metrics.time("glo_storage_seconds", "read"):
+                email, body = mailbox.open_email(number)
+        except IndexError:
+            return self._get_error_message("Ce courriel n'existe pas.")
+        return self._body_frames(email, body)
+
+    def _get_email_batch(self, client_soc: asyncio.StreamWriter,
+                         payload: gloutils.EmailBatchRequestPayload):
+        """
+        Lit en une requête les courriels choisis (`choices`, ou de `first`
+        à `last`), chacun une seule fois, du plus ancien au plus récent.
+
+        Retourne un itérateur de trames : des EMAIL_BATCH qui regroupent
+        des courriels complets jusqu'à environ `BATCH_FRAME_SIZE`
+        caractères, un courriel au corps plus grand que BODY_CHUNK_SIZE
+        en trames EMAIL_BODY_BEGIN (avec son choix), EMAIL_BODY_CHUNK et
+        EMAIL_BODY_END, puis OK. Retourne un message d'erreur si un des
+        choix n'existe pas.
+        """
+        try:
+            username = self._logged_users[client_soc]
+        except KeyError:
+            return self._get_error_message("Utilisateur invalide")
 
-        path = pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR / username.lower()
+        mailbox = self._get_mailbox(username)
+        entries = mailbox.entries()
+        count = len(entries)
+        try:
+            if "choices" in payload:
+                choices = {int(choice) for choice in payload["choices"]}
+            else:
+                first, last = int(payload["first"]), int(payload["last"])
+                choices = range(first, last + 1)
+        except (KeyError, TypeError, ValueError):
+            return self._get_error_message("Requête de lecture invalide.")
+        if not choices or min(choices) < 1 or max(choices) > count:
+            return self._get_error_message("Ce courriel n'existe pas.")
+
+        # Le choix 1 correspond au courriel le plus récent.
+        wanted = {entries[count - choice]["number"]: choice for choice in choices}
+        return self._batch_frames(mailbox, wanted)
+
+    def _batch_frames(self, mailbox: glomailbox.Mailbox,
+                      wanted: "dict[int, int]"):
+        """Trames de `_get_email_batch` pour les courriels `wanted` (numéro -> choix)."""
+        emails, choices, size = [], [], 0
+        for entry, email, body in mailbox.scan(numbers=wanted):
+            choice = wanted[entry["number"]]
+            if entry.get("body_size", 0) > gloutils.BODY_CHUNK_SIZE:
+                if emails:
+                    yield self._batch_frame(emails, choices)
+                    emails, choices, size = [], [], 0
+                yield from self._body_frames(email, body, choice)
+                continue
+            emails.append(gloutils.EmailContentPayload(
+                sender=email["sender"], destination=email["destination"],
+                subject=email["subject"], date=email["date"],
+                content=body.read()))
+            if "cc" in email:
+                emails[-1]["cc"] = email["cc"]
+            choices.append(choice)
+            size += len(emails[-1]["content"])
+            if size >= BATCH_FRAME_SIZE:
+                yield self._batch_frame(emails, choices)
+                emails, choices, size = [], [], 0
+        if emails:
+            yield self._batch_frame(emails, choices)
+        yield gloutils.GloMessage(header=gloutils.Headers.OK, payload=None)
+
+    @staticmethod
+    def _batch_frame(emails: "list[gloutils.EmailContentPayload]",
+                     choices: "list[int]") -> gloutils.GloMessage:
+        return gloutils.GloMessage(
+            header=gloutils.Headers.EMAIL_BATCH,
+            payload=gloutils.EmailBatchPayload(emails=emails, choices=choices))
+
+    @staticmethod
+    def _body_frames(email: dict, body, choice: "int | None" = None):
+        with body:
+            payload = gloutils.EmailHeaderPayload(
+                sender=email["sender"], destination=email["destination"],
+                subject=email["subject"], date=email["date"])
+            if "cc" in email:
+                payload["cc"] = email["cc"]
+            if choice is not None:
+                payload["choice"] = choice
+            yield gloutils.GloMessage(header=gloutils.Headers.EMAIL_BODY_BEGIN,
+                                      payload=payload)
+            while data := body.read(gloutils.BODY_CHUNK_SIZE):
+                yield gloutils.GloMessage(header=gloutils.Headers.EMAIL_BODY_CHUNK,
+                                          payload=gloutils.EmailChunkPayload(data=data))
+            yield gloutils.GloMessage(header=gloutils.Headers.EMAIL_BODY_END,
+                                      payload=None)
+
+    def _get_stats(self, client_soc: asyncio.StreamWriter) -> gloutils.GloMessage:
+        """
+        Récupère le nombre de courriels et leur taille totale pour
+        l'utilisateur associé au socket. Ces compteurs sont tenus à jour
+        par la boîte de courriels : la requête ne parcourt aucun fichier.
+        """
 
-        number_of_mail = self._get_number_of_mail_for_user(username)
-        size = sum(file.stat().st_size for file in path.rglob('*'))
+        try:
+            username = self._logged_users[client_soc]
+        except KeyError:
+            return self._get_error_message("Socket has no associated user.")
+
+        with self._metrics.time("glo_storage_seconds", "stats"):
+            number_of_mail, size = self._get_mailbox(username).stats()
 
         header = gloutils.Headers.OK
         payload = gloutils.StatsPayload(count=number_of_mail, size=size)
 
         return gloutils.GloMessage(header=header, payload=payload)
 
-    def _send_email(self, payload: gloutils.EmailContentPayload
+    def _find_recipient(self, destination: str) -> "str | None":
+        """
+        Retourne le dossier du destinataire interne (SERVER_LOST_DIR s'il
+        n'existe pas), ou None si le destinataire est externe.
+        """
+        if not destination.endswith("@glo2000.ca"):
+            return None
+        local_part = destination.lower().removesuffix("@glo2000.ca")
+        if self._user_exists(local_part):
+            return local_part
+        return gloutils.SERVER_LOST_DIR
+
+    @staticmethod
+    def _recipients(payload: gloutils.EmailHeaderPayload) -> "list[str]":
+        """
+        Retourne les adresses de `destination`, `cc` puis `bcc`, chacune
+        une seule fois (sans égard à la casse).
+
+        Lève une ValueError s'il n'y en a aucune, ou plus que
+        MAX_RECIPIENTS.
+        """
+        fields = [payload.get(field, "") for field in ("destination", "cc", "bcc")]
+        if not all(isinstance(field, str) for field in fields):
+            raise ValueError("Destinataires invalides.")
+        recipients, seen = [], set()
+        for _, address in email.utils.getaddresses(fields):
+            if address and address.casefold() not in seen:
+                seen.add(address.casefold())
+                recipients.append(address)
+        if not recipients:
+            raise ValueError("Aucun destinataire.")
+        if len(recipients) > gloutils.MAX_RECIPIENTS:
+            raise ValueError(f"Plus de {gloutils.MAX_RECIPIENTS} destinataires.")
+        return recipients
+
+    @staticmethod
+    def _check_headers(payload: gloutils.EmailHeaderPayload) -> None:
+        """
+        Lève une ValueError si un champ repris dans les en-têtes du message
+        relayé n'est pas une chaîne ou contient un saut de ligne.
+        """
+        for field in ("sender", "destination", "cc", "bcc", "subject"):
+            value = payload.get(field, "")
+            if not isinstance(value, str) or "\r" in value or "\n" in value:
+                raise ValueError("En-têtes du courriel invalides.")
+
+    def _send_email(self, payload: gloutils.EmailContentPayload,
+                    body: "glomailbox.BodyWriter | None" = None
                     ) -> gloutils.GloMessage:
         """
-        Détermine si l'envoi est interne ou externe et:
+        Détermine pour chaque destinataire (`destination`, `cc` et `bcc`)
+        si l'envoi est interne ou externe et:
         - Si l'envoi est interne, écris le message tel quel dans le dossier
         du destinataire.
         - Si le destinataire n'existe pas, place le message dans le dossier
         SERVER_LOST_DIR et considère l'envoi comme un échec.
-        - Si le destinataire est externe, transforme le message en
-        EmailMessage et utilise le serveur SMTP pour le relayer.
-
-        Retourne un messange indiquant le succès ou l'échec de l'opération.
-        """
-        sender = payload["sender"]
-        destination = payload["destination"]
-        subject = payload["subject"]
-        date = payload["date"]
-        content = payload["content"]
-
-        if destination.endswith("@glo2000.ca"):
-            #interne
-            found_user = None
-            path = pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR
-            for x in path.iterdir(): 
-                if x.is_dir() and x.name + '@glo2000.ca' == destination.lower():
-                    found_user = x.name
-                    break
+        - Si le destinataire est externe, place le message dans la file
+        `_relay` qui le relaiera au serveur SMTP en arrière-plan.
 
-            if not found_user:
-                found_user = gloutils.SERVER_LOST_DIR
-            
+        Si `body` est donné, le corps a été reçu par morceaux et `payload`
+        n'a pas de `content`.
 
-            if found_user:
-                new_file_number = self._get_number_of_mail_for_user(found_user) + 1
-                path = path / found_user.lower() / str(new_file_number)
-                path.touch()
-                path.write_text(json.dumps(payload))
-                if found_user == gloutils.SERVER_LOST_DIR:
-                    return self._get_error_message("Le destinataire n'existe pas.")
-                return gloutils.GloMessage(header=gloutils.Headers.OK, payload=None)
+        Pour un seul destinataire, retourne un messange indiquant le succès
+        ou l'échec de l'opération. Pour plusieurs, retourne OK et l'état de
+        la livraison à chacun (`EmailDeliveryPayload`).
+        """
+        try:
+            self._check_headers(payload)
+            recipients = self._recipients(payload)
+        except ValueError as error:
+            if body is not None:
+                body.abort()
+            return self._get_error_message(str(error))
+
+        statuses = self._deliver(payload, recipients, body)
+        if len(recipients) > 1:
+            payload = gloutils.EmailDeliveryPayload(recipients=[
+                gloutils.RecipientStatusPayload(address=address, status=status)
+                for address, status in zip(recipients, statuses)])
+            return gloutils.GloMessage(header=gloutils.Headers.OK, payload=payload)
+        if statuses[0] == gloutils.RECIPIENT_UNKNOWN:
+            return self._get_error_message("Le destinataire n'existe pas.")
+        if statuses[0] == gloutils.RECIPIENT_FAILED:
+            return self._get_error_message("Échec de l'envoie du courriel.")
+        return gloutils.GloMessage(header=gloutils.Headers.OK, payload=None)
+
+    def _deliver(self, payload: gloutils.EmailContentPayload,
+                 recipients: "list[str]",
+                 body: "glomailbox.BodyWriter | None") -> "list[str]":
+        """
+        Livre le courriel à chacun des `recipients` et retourne l'état de
+        chaque livraison (`RECIPIENT_*`), dans le même ordre.
+
+        Chaque boîte reçoit une seule copie, sans `bcc`, même si
+        l'utilisateur est nommé plusieurs fois ; les destinataires
+        inexistants partagent celle de SERVER_LOST_DIR. Un corps reçu par
+        morceaux, ou un `content` d'au moins SHARED_BODY_SIZE caractères
+        livré à plusieurs boîtes, n'est écrit qu'une fois et lié dans
+        chacune. Les destinataires externes sont confiés ensemble à
+        `_relay`, pour une seule transaction SMTP.
+        """
+        email = {key: value for key, value in payload.items() if key != "bcc"}
+        content = email.get("content")
+        # Dossier interne -> positions de ses adresses dans `recipients`.
+        boxes: "dict[str, list[int]]" = {}
+        external = []
+        for i, address in enumerate(recipients):
+            found_user = self._find_recipient(address)
+            if found_user is None:
+                external.append(i)
+            else:
+                boxes.setdefault(found_user, []).append(i)
+
+        if (body is None and len(boxes) > 1 and content is not None
+                and len(content) >= SHARED_BODY_SIZE):
+            body = self._relay.open_body()
+            body.write(content)
+            del email["content"]
+        # Plusieurs destinations : le corps est lié dans chaque boîte, puis
+        # déplacé dans la file de relais ou supprimé.
+        shared = body is not None and len(boxes) + bool(external) > 1
+        # Termes indexés, calculés une seule fois pour toutes les boîtes.
+        terms = None
+        if content is not None and set(boxes) - {gloutils.SERVER_LOST_DIR}:
+            terms = glosearch.email_terms(email["sender"], email["subject"],
+                                          content[:glosearch.MAX_INDEXED_BODY])
+
+        statuses = [gloutils.RECIPIENT_FAILED] * len(recipients)
+        try:
+            for found_user, positions in boxes.items():
+                status = gloutils.RECIPIENT_DELIVERED
+                try:
+                    with self._metrics.time("glo_storage_seconds", "deliver"):
+                        entry = self._get_mailbox(found_user).deliver(
+                            email, body, shared)
+                except OSError:
+                    status = gloutils.RECIPIENT_FAILED
+                else:
+                    self._cache.invalidate(found_user, "page")
+                    if content is not None and found_user != gloutils.SERVER_LOST_DIR:
+                        # Un corps reçu par morceaux sera lu à la recherche suivante.
+                        with self._metrics.time("glo_storage_seconds", "index"):
+                            self._get_search(found_user).add(entry, content, terms)
+                    self._notify_delivery(found_user)
+                    if found_user == gloutils.SERVER_LOST_DIR:
+                        status = gloutils.RECIPIENT_UNKNOWN
+                for i in positions:
+                    statuses[i] = status
+
+            if external:
+                try:
+                    self._relay.enqueue(email, body,
+                                        [recipients[i] for i in external])
+                except OSError:
+                    pass
+                else:
+                    for i in external:
+                        statuses[i] = gloutils.RECIPIENT_QUEUED
+        finally:
+            if body is not None:
+                # Sans effet si le corps a été renommé dans une boîte ou
+                # dans la file de relais.
+                body.abort()
+        return statuses
+
+    def _begin_body(self, client_soc: asyncio.StreamWriter,
+                    payload: gloutils.EmailHeaderPayload) -> None:
+        """
+        Commence la réception par morceaux d'un courriel. Le corps est
+        écrit au fur et à mesure dans le dossier du destinataire ou de la
+        file de relais, sans jamais être gardé en entier en mémoire.
 
+        Seule la trame EMAIL_BODY_END reçoit une réponse.
+        """
+        self._abort_body(client_soc)
+        try:
+            recipients = self._recipients(payload)
+        except ValueError:
+            recipients = []  # l'erreur sera répondue à EMAIL_BODY_END
+        found_user = None
+        if len(recipients) == 1:
+            found_user = self._find_recipient(recipients[0])
+        if found_user is None:
+            # Destinataire externe, ou plusieurs : le corps attend dans la
+            # file de relais, d'où il sera lié dans chaque boîte.
+            body = self._relay.open_body()
         else:
-            #extrerne
-            message = EmailMessage()
-            message["From"] = sender
-            message["To"] = destination
-            message["Subject"] = subject
-            message.set_content(content)
-
-            try:
-                with smtplib.SMTP(host="smtp.ulaval.ca", timeout=10) as connection:
-                    connection.send_message(message)
-                    return gloutils.GloMessage(header=gloutils.Headers.OK, payload=None)
-            except:
-                return self._get_error_message("Échec de l'envoie du courriel.")
-    
-    def _get_number_of_mail_for_user(self, username: str) -> int:
-        path = pathlib.Path.cwd() / gloutils.SERVER_DATA_DIR / username.lower()
-        return len([f for f in path.iterdir() if f.name != gloutils.PASSWORD_FILENAME])
-
-    def _dispatch(self, message: gloutils.GloMessage, socket: glosocket.socket):
-        
+            body = self._get_mailbox(found_user).open_body()
+        self._client_bodies[client_soc] = (payload, body)
+
+    def _add_body_chunk(self, client_soc: asyncio.StreamWriter,
+                        payload: gloutils.EmailChunkPayload) -> None:
+        state = self._client_bodies.get(client_soc)
+        if state is not None:
+            with self._metrics.time("glo_storage_seconds", "body_chunk"):
+                state[1].write(payload["data"])
+
+    def _end_body(self, client_soc: asyncio.StreamWriter) -> gloutils.GloMessage:
+        """Livre le courriel reçu par morceaux, comme `_send_email`."""
+        state = self._client_bodies.pop(client_soc, None)
+        if state is None:
+            return self._get_error_message("Aucun courriel en cours d'envoi.")
+        email, body = state
+        return self._send_email(email, body)
+
+    def _abort_body(self, client_soc: asyncio.StreamWriter) -> None:
+        state = self._client_bodies.pop(client_soc, None)
+        if state is not None:
+            state[1].abort()
+
+    def _dispatch(self, message: gloutils.GloMessage,
+                  socket: asyncio.StreamWriter) -> "gloutils.GloMessage | None":
+        """
+        Appelle le traitement associé à l'entête du message et retourne
+        la réponse à transmettre au client, ou None s'il n'y en a pas.
+        La réponse à INBOX_READING_STREAM ou INBOX_READING_BATCH peut
+        être un itérateur de messages, à envoyer l'un après l'autre, et
+        celle à INBOX_CHANGES une coroutine qui attend la réponse. Une
+        entête inconnue reçoit une erreur.
+        """
         response = None
 
         if message["header"] == gloutils.Headers.AUTH_LOGIN:
             response = self._login(socket, message["payload"])
         elif message["header"] == gloutils.Headers.AUTH_LOGOUT:
-            return self._logout(socket)
+            # Le client n'attend pas de réponse à la déconnexion.
+            self._logout(socket)
+            return None
         elif message["header"] == gloutils.Headers.AUTH_REGISTER:
             response = self._create_account(socket, message["payload"])
+        elif message["header"] == gloutils.Headers.AUTH_RESUME:
+            response = self._resume_session(socket, message["payload"])
         elif message["header"] == gloutils.Headers.EMAIL_SENDING:
             response = self._send_email(message["payload"])
-        elif message["header"] == gloutils.Headers.BYE:
-            return self._remove_client(socket)
         elif message["header"] == gloutils.Headers.STATS_REQUEST:
             response = self._get_stats(client_soc=socket)
         elif message["header"] == gloutils.Headers.INBOX_READING_REQUEST:
-            response = self._get_email_list(socket)      
+            response = self._get_email_list(socket)
+        elif message["header"] == gloutils.Headers.INBOX_PAGE_REQUEST:
+            response = self._get_email_page(socket, message["payload"])
         elif message["header"] == gloutils.Headers.INBOX_READING_CHOICE:
             response = self._get_email(socket, message["payload"])
+        elif message["header"] == gloutils.Headers.HELLO:
+            response = self._negotiate(socket, message["payload"])
+        elif message["header"] == gloutils.Headers.METRICS_REQUEST:
+            response = self._get_metrics()
+        elif message["header"] == gloutils.Headers.EMAIL_BODY_BEGIN:
+            self._begin_body(socket, message["payload"])
+        elif message["header"] == gloutils.Headers.EMAIL_BODY_CHUNK:
+            self._add_body_chunk(socket, message["payload"])
+        elif message["header"] == gloutils.Headers.EMAIL_BODY_END:
+            response = self._end_body(socket)
+        elif message["header"] == gloutils.Headers.INBOX_READING_STREAM:
+            response = self._stream_email(socket, message["payload"])
+        elif message["header"] == gloutils.Headers.INBOX_SEARCH:
+            response = self._search_emails(socket, message["payload"])
+        elif message["header"] == gloutils.Headers.INBOX_READING_BATCH:
+            response = self._get_email_batch(socket, message["payload"])
+        elif message["header"] == gloutils.Headers.INBOX_CHANGES:
+            response = self._get_changes(socket, message["payload"])
+        else:
+            # Sans réponse, le client attendrait indéfiniment.
+            response = self._get_error_message("Entête inconnue.")
+
+        return response
 
-        raw = json.dumps(response)
-        glosocket.send_msg(socket, message=raw)
+    def _decode_frame(self, raw: bytes, socket: asyncio.StreamWriter
+                      ) -> "tuple[gloutils.GloMessage, type]":
+        """
+        Décode la trame reçue avec le format du client.
+
+        Retourne le message et le format à utiliser pour sa réponse.
+        """
+        codec = self._client_codecs.get(socket, glocodec.DEFAULT_CODEC)
+        return codec.decode(raw), codec
+
+    def _get_metrics(self) -> gloutils.GloMessage:
+        """
+        Retourne les métriques du serveur au format texte de Prometheus.
+
+        Le serveur n'écoute que sur 127.0.0.1 : seul un administrateur
+        de la machine peut les consulter.
+        """
+        payload = gloutils.MetricsPayload(metrics=self._metrics.render())
+        return gloutils.GloMessage(header=gloutils.Headers.OK, payload=payload)
+
+    def _process_message(self, message: gloutils.GloMessage,
+                         socket: asyncio.StreamWriter, codec: type):
+        """
+        Traite le message et retourne la réponse encodée, None, un
+        itérateur de réponses encodées, ou une coroutine qui retourne la
+        réponse encodée.
+
+        La réponse reprend le `request_id` de la requête, s'il y en a un.
+        Une exception du traitement est comptée et répondue par une
+        erreur plutôt que de fermer la connexion.
+        """
+        try:
+            header = gloutils.Headers(message["header"]).name
+        except (KeyError, ValueError):
+            header = "UNKNOWN"
+        start = time.perf_counter()
+        try:
+            response = self._dispatch(message, socket)
+        except Exception:
+            traceback.print_exc()
+            self._metrics.inc("glo_request_exceptions_total", header)
+            response = self._get_error_message("Erreur interne du serveur.")
+        self._metrics.observe("glo_request_duration_seconds",
+                              time.perf_counter() - start, header)
+        self._metrics.inc("glo_requests_total", header)
+        if response is None:
+            return None
+        if inspect.isawaitable(response):
+            return self._encode_later(response, message, codec)
+        if not isinstance(response, dict):
+            return (self._encode(frame, message, codec) for frame in response)
+        if response["header"] == gloutils.Headers.ERROR:
+            self._metrics.inc("glo_request_errors_total", header)
+        return self._encode(response, message, codec)
+
+    @staticmethod
+    def _encode(response: gloutils.GloMessage, message: gloutils.GloMessage,
+                codec: type) -> bytes:
+        if "request_id" in message:
+            response = gloutils.GloMessage(response, request_id=message["request_id"])
+        return codec.encode(response)
+
+    async def _encode_later(self, response, message: gloutils.GloMessage,
+                            codec: type) -> bytes:
+        return self._encode(await response, message, codec)
+
+    async def _run(self, function, *args, executor=None):
+        """
+        Exécute `function` dans `executor` (par défaut `_executor`), ou
+        directement s'il n'y en a pas.
+        """
+        executor = executor or self._executor
+        if executor is None:
+            return function(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, function, *args)
+
+    async def _answer(self, message: gloutils.GloMessage,
+                      writer: asyncio.StreamWriter, codec: type) -> None:
+        self._metrics.add("glo_requests_in_flight", 1)
+        try:
+            executor = None
+            if message["header"] in AUTH_HEADERS:
+                executor = self._auth_executor
+            response = await self._run(self._process_message, message,
+                                       writer, codec, executor=executor)
+            if inspect.isawaitable(response):
+                response = await response
+            if isinstance(response, bytes):
+                await self._send(writer, response)
+            elif response is not None:
+                await self._send_frames(writer, response)
+        finally:
+            self._metrics.add("glo_requests_in_flight", -1)
+
+    async def _send(self, writer: asyncio.StreamWriter, frame: bytes) -> None:
+        async with self._send_locks[writer]:
+            # Borne supérieure : la trame compressée peut être plus petite.
+            self._write_buffer_peak = max(
+                self._write_buffer_peak,
+                writer.transport.get_write_buffer_size()
+                + glosocket.LENGTH_SIZE + len(frame))
+            try:
+                sent = await glosocket.async_send_data(
+                    writer, frame, self._client_compression.get(writer),
+                    self._slow_reader_timeout)
+            except glosocket.GLOSocketTimeout:
+                self._drop_slow_reader(writer)
+                raise
+        self._metrics.inc("glo_bytes_sent_total", value=sent)
+
+    def _drop_slow_reader(self, writer: asyncio.StreamWriter) -> None:
+        """
+        Coupe la connexion sans attendre l'envoi des données en attente :
+        la lecture en cours dans `_handle_client` échoue et fait le ménage.
+        SO_LINGER à zéro fait aussi abandonner au noyau ce qu'il avait
+        encore à envoyer (la connexion est réinitialisée).
+        """
+        self._metrics.inc("glo_slow_readers_total")
+        writer.get_extra_info("socket").setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        writer.transport.abort()
+
+    async def _wait_writable(self, writer: asyncio.StreamWriter) -> None:
+        """
+        Suspend la lecture des requêtes d'un client tant que son tampon
+        d'écriture est au-dessus du seuil haut.
+        """
+        high_water = self._write_limits[0]
+        if writer.transport.get_write_buffer_size() <= high_water:
+            return
+        self._metrics.inc("glo_write_waits_total")
+        try:
+            await glosocket.async_drain(writer, self._slow_reader_timeout)
+        except glosocket.GLOSocketTimeout:
+            self._drop_slow_reader(writer)
+            raise
+
+    async def _send_frames(self, writer: asyncio.StreamWriter, frames) -> None:
+        """
+        Envoie les trames une à une : la suivante n'est produite (lue sur
+        disque) qu'une fois la précédente acceptée par le socket.
+        """
+        try:
+            while (frame := await self._run(next, frames, None)) is not None:
+                await self._send(writer, frame)
+        finally:
+            try:
+                frames.close()
+            except ValueError:
+                pass  # annulé pendant une lecture : fermé par le ramasse-miettes
+
+    async def _handle_client(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> None:
+        """
+        Coroutine propre à chaque connexion : lit les trames du client
+        au fur et à mesure et lui transmet les réponses.
+
+        Une requête sans `request_id` attend la fin des requêtes en cours
+        et la requête suivante n'est lue qu'une fois sa réponse envoyée,
+        ce qui préserve l'ordre des réponses même avec `_executor`.
+        Les requêtes avec `request_id` sont traitées en parallèle (au plus
+        `MAX_PIPELINED_REQUESTS` à la fois) et répondues dès qu'elles
+        sont prêtes, sauf les trames d'un envoi par morceaux (BODY_HEADERS)
+        qui doivent rester dans l'ordre.
+
+        Tant que le tampon d'écriture du client dépasse son seuil haut,
+        ses requêtes ne sont plus lues : un client qui ne lit pas ses
+        réponses n'accumule pas de travail ni de mémoire, et il est
+        déconnecté si son tampon ne se vide plus du tout.
+        """
+        self._client_socs.add(writer)
+        self._metrics.inc("glo_connections_total")
+        self._metrics.add("glo_connections_open", 1)
+        pending = set()
+        # Une trame est écrite en deux morceaux (longueur, données) :
+        # sans TCP_NODELAY, Nagle retarderait le second d'environ 40 ms.
+        writer.get_extra_info("socket").setsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        high_water, low_water = self._write_limits
+        writer.transport.set_write_buffer_limits(high=high_water, low=low_water)
+        self._send_locks[writer] = asyncio.Lock()
+
+        def forget(task: asyncio.Task) -> None:
+            # Une erreur d'envoi sera aussi vue par la lecture suivante.
+            pending.discard(task)
+            if not task.cancelled():
+                task.exception()
+
+        try:
+            while True:
+                await self._wait_writable(writer)
+                raw = await glosocket.async_recv_data(reader, self._max_frame_size)
+                self._metrics.inc("glo_bytes_received_total",
+                                  value=len(raw) + glosocket.LENGTH_SIZE)
+                message, codec = await self._run(self._decode_frame, raw, writer)
+
+                if ("request_id" in message and message["header"] != gloutils.Headers.BYE
+                        and message["header"] not in BODY_HEADERS):
+                    if len(pending) >= MAX_PIPELINED_REQUESTS:
+                        await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    task = asyncio.create_task(self._answer(message, writer, codec))
+                    pending.add(task)
+                    task.add_done_callback(forget)
+                    continue
+
+                if pending:
+                    await asyncio.wait(pending)
+                if message["header"] == gloutils.Headers.BYE:
+                    break
+                await self._answer(message, writer, codec)
+        except glocodec.CodecError:
+            self._metrics.inc("glo_protocol_errors_total")
+        except glosocket.GLOSocketError:
+            pass
+        finally:
+            self._metrics.add("glo_connections_open", -1)
+            for task in pending:
+                task.cancel()
+            if writer in self._client_socs:
+                self._remove_client(writer)
+
+    async def _serve_metrics(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> None:
+        """
+        Répond à une requête HTTP, quelle qu'elle soit, par les métriques
+        au format texte de Prometheus.
+        """
+        try:
+            while (await reader.readline()).strip():
+                pass
+            body = self._metrics.render().encode()
+            writer.write(b"HTTP/1.0 200 OK\r\n"
+                         b"Content-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: %d\r\n\r\n" % len(body) + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._handle_client,
+                                            sock=self._server_socket)
+        if self._metrics_port is not None:
+            await asyncio.start_server(self._serve_metrics, "127.0.0.1",
+                                       self._metrics_port)
+        async with server:
+            await server.serve_forever()
 
     def run(self):
         """Point d'entrée du serveur."""
-        while True:
-            # Select readable sockets
-            result = select.select([self._server_socket] + self._client_socs, [], [])
-            readable_sockets = result[0]
-            for waiter in readable_sockets:
-                if waiter == self._server_socket:
-                    self._accept_client()
-                else:
-                    raw = glosocket.recv_msg(waiter)
-                    message = json.loads(raw)
-                    self._dispatch(message, waiter)
+        asyncio.run(self._serve())
 
 
-def _main() -> int:
-    server = Server()
+def _interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def _run_server(options: dict) -> int:
+    """
+    Construit le serveur avec les arguments `options` et le fait tourner
+    jusqu'à la réception de SIGINT ou SIGTERM.
+    """
+    signal.signal(signal.SIGTERM, _interrupt)
+    server = Server(**options)
     try:
         server.run()
     except KeyboardInterrupt:
+        # Un second signal n'interrompt pas le ménage.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
         server.cleanup()
     return 0
 
 
+def _supervise(processes: int, options: dict) -> int:
+    """
+    Lance `processes` processus serveurs qui écoutent sur le même port
+    avec SO_REUSEPORT : le noyau répartit les connexions entre eux, et
+    chacun a sa boucle, ses fils et son propre GIL. Ils partagent le
+    dossier de données, protégé par des verrous de fichiers, et les
+    sessions. Le processus `i` sert ses métriques sur `metrics_port + i`.
+
+    Un processus tué par un signal est relancé. Si un processus s'arrête
+    de lui-même (échec au démarrage), ou à la réception de SIGINT ou
+    SIGTERM, tous les processus sont arrêtés.
+    """
+    signal.signal(signal.SIGTERM, _interrupt)
+    children = {}
+
+    def start(index: int) -> None:
+        metrics_port = options["metrics_port"]
+        if metrics_port is not None:
+            metrics_port += index
+        process = multiprocessing.Process(
+            target=_run_server, name=f"glo-server-{index}",
+            args=(dict(options, metrics_port=metrics_port, shared=True),))
+        process.start()
+        children[index] = process
+
+    try:
+        for index in range(processes):
+            start(index)
+        while True:
+            multiprocessing.connection.wait(
+                [process.sentinel for process in children.values()])
+            for index, process in list(children.items()):
+                if process.is_alive():
+                    continue
+                if process.exitcode >= 0:
+                    return process.exitcode
+                print(f"Processus {index} arrêté par le signal "
+                      f"{-process.exitcode}, relancé.", file=sys.stderr)
+                start(index)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for process in children.values():
+            if process.is_alive():
+                process.terminate()
+        for process in children.values():
+            process.join()
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-w", "--workers", action="store", type=int,
+                        dest="workers", default=os.cpu_count() or 1,
+                        help="Nombre de fils de traitement des requêtes "
+                             "(0 pour tout traiter dans la boucle).")
+    parser.add_argument("-p", "--processes", action="store", type=int,
+                        dest="processes", default=1,
+                        help="Nombre de processus serveurs qui se partagent "
+                             "le port (SO_REUSEPORT), par exemple un par cœur.")
+    parser.add_argument("--smtp-host", action="store", dest="smtp_host",
+                        default=gloutils.SMTP_SERVER,
+                        help="Serveur SMTP de relais des courriels externes.")
+    parser.add_argument("--smtp-port", action="store", type=int,
+                        dest="smtp_port", default=gloutils.SMTP_PORT,
+                        help="Port du serveur SMTP de relais.")
+    parser.add_argument("--max-frame-size", action="store", type=int,
+                        dest="max_frame_size", default=glosocket.MAX_FRAME_SIZE,
+                        help="Taille maximale (octets) d'une trame reçue.")
+    parser.add_argument("--metrics-port", action="store", type=int,
+                        dest="metrics_port", default=None,
+                        help="Port local où servir les métriques au format "
+                             "de Prometheus (le processus i utilise le port "
+                             "suivant + i).")
+    parser.add_argument("--kdf", action="store", dest="kdf",
+                        default="scrypt", choices=glopassword.ALGORITHMS,
+                        help="Fonction de dérivation des mots de passe.")
+    parser.add_argument("--kdf-cost", action="store", type=int,
+                        dest="kdf_cost", default=None,
+                        help="Coût de dérivation : log2(N) pour scrypt, "
+                             "nombre d'itérations pour pbkdf2.")
+    parser.add_argument("--auth-workers", action="store", type=int,
+                        dest="auth_workers", default=2,
+                        help="Nombre de fils dédiés aux dérivations.")
+    parser.add_argument("--credential-ttl", action="store", type=float,
+                        dest="credential_ttl", default=300.0,
+                        help="Durée (secondes) pendant laquelle une connexion "
+                             "réussie évite une nouvelle dérivation "
+                             "(0 pour désactiver).")
+    parser.add_argument("--session-ttl", action="store", type=float,
+                        dest="session_ttl", default=glosession.SESSION_TTL,
+                        help="Durée d'inactivité (secondes) après laquelle "
+                             "une session ne peut plus être reprise.")
+    parser.add_argument("--max-sessions", action="store", type=int,
+                        dest="max_sessions", default=glosession.MAX_SESSIONS,
+                        help="Nombre maximal de sessions gardées en mémoire.")
+    parser.add_argument("--compression-threshold", action="store", type=int,
+                        dest="compression_threshold",
+                        default=glosocket.COMPRESSION_THRESHOLD,
+                        help="Taille (octets) à partir de laquelle les trames "
+                             "sont compressées pour les clients qui l'acceptent.")
+    parser.add_argument("--no-compression", action="store_const", const=None,
+                        dest="compression_threshold",
+                        help="Ne jamais compresser les trames envoyées.")
+    parser.add_argument("--write-high-water", action="store", type=int,
+                        dest="write_high_water", default=WRITE_HIGH_WATER,
+                        help="Seuil haut (octets) du tampon d'écriture d'une "
+                             "connexion, au-delà duquel ses requêtes ne sont "
+                             "plus lues.")
+    parser.add_argument("--write-low-water", action="store", type=int,
+                        dest="write_low_water", default=WRITE_LOW_WATER,
+                        help="Seuil bas (octets) où la lecture reprend.")
+    parser.add_argument("--slow-reader-timeout", action="store", type=float,
+                        dest="slow_reader_timeout", default=SLOW_READER_TIMEOUT,
+                        help="Délai (secondes) sans progression de l'écriture "
+                             "après lequel un client est déconnecté.")
+    parser.add_argument("--cache-size", action="store", type=int,
+                        dest="cache_size", default=glocache.DEFAULT_MAX_BYTES,
+                        help="Mémoire (octets) du cache des courriels lus et "
+                             "des listes affichées (0 pour désactiver).")
+    args = parser.parse_args(sys.argv[1:])
+    if args.processes > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--processes demande SO_REUSEPORT (Linux, BSD, macOS).")
+    options = dict(workers=args.workers, smtp_host=args.smtp_host,
+                   smtp_port=args.smtp_port,
+                   max_frame_size=args.max_frame_size,
+                   metrics_port=args.metrics_port,
+                   hasher=glopassword.PasswordHasher(args.kdf, args.kdf_cost),
+                   auth_workers=args.auth_workers,
+                   credential_ttl=args.credential_ttl,
+                   session_ttl=args.session_ttl,
+                   max_sessions=args.max_sessions,
+                   compression_threshold=args.compression_threshold,
+                   write_high_water=args.write_high_water,
+                   write_low_water=args.write_low_water,
+                   slow_reader_timeout=args.slow_reader_timeout,
+                   cache_size=args.cache_size)
+    if args.processes > 1:
+        return _supervise(args.processes, options)
+    return _run_server(options)
+
+
 if __name__ == '__main__':
     sys.exit(_main())
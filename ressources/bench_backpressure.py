@@ -0,0 +1,192 @@
+"""\
+Démonstration de l'isolation des clients lents.
+
+Mesure la latence de STATS_REQUEST pour des clients normaux, d'abord
+seuls, puis pendant qu'un client « bloqué » demande en rafale de gros
+courriels sans jamais lire les réponses. Les latences doivent rester du
+même ordre, et le client bloqué doit être déconnecté une fois le délai
+`--slow-reader-timeout` du serveur écoulé.
+
+Le banc échoue (code de sortie 1) si le client bloqué est encore
+connecté, ou si le plus grand tampon d'écriture d'une connexion
+(glo_write_buffer_peak_bytes) dépasse le seuil haut `--high-water` du
+serveur de plus d'une réponse.
+
+Utilisation (serveur déjà lancé, par exemple avec
+`python TP4_server.py --slow-reader-timeout 3`) :
+    python bench_backpressure.py -d 127.0.0.1 -u 10 -t 5
+"""
+
+import argparse
+import asyncio
+import socket
+import sys
+import time
+import uuid
+
+import glocodec
+import glosocket
+import gloutils
+
+PASSWORD = "Contrepression123"
+# Entêtes et encodage d'une réponse, en plus du corps du courriel.
+FRAME_OVERHEAD = 64 * 1024
+
+
+def _percentile(values: "list[float]", percent: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+def _exchange(soc: socket.socket, header: gloutils.Headers,
+              payload=None) -> gloutils.GloMessage:
+    codec = glocodec.JsonCodec
+    glosocket.send_data(soc, codec.encode(
+        gloutils.GloMessage(header=header, payload=payload)))
+    return codec.decode(glosocket.recv_data(soc))
+
+
+def _register(soc: socket.socket, username: str) -> None:
+    _exchange(soc, gloutils.Headers.AUTH_REGISTER,
+              gloutils.AuthPayload(username=username, password=PASSWORD))
+
+
+def _stall(destination: str, emails: int, size: int) -> socket.socket:
+    """
+    Ouvre la connexion du client bloqué, remplit sa boîte, puis envoie
+    des lectures en rafale sans jamais lire les réponses.
+    """
+    soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    soc.connect((destination, gloutils.APP_PORT))
+    username = f"lent{uuid.uuid4().hex[:6]}"
+    _register(soc, username)
+    address = f"{username}@{gloutils.SERVER_DOMAIN}"
+    for i in range(emails):
+        _exchange(soc, gloutils.Headers.EMAIL_SENDING,
+                  gloutils.EmailContentPayload(
+                      sender=address, destination=address, subject=f"Gros {i}",
+                      date=gloutils.get_current_utc_time(),
+                      content="x" * size))
+
+    # Le client ne lit plus : sa fenêtre de réception se remplit vite.
+    soc.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    soc.settimeout(1.0)
+    requests = b""
+    for request_id in range(1, gloutils.INBOX_MAX_PAGE_SIZE + 1):
+        frame = glocodec.JsonCodec.encode(gloutils.GloMessage(
+            header=gloutils.Headers.INBOX_READING_CHOICE,
+            payload=gloutils.EmailChoicePayload(choice=request_id % emails + 1),
+            request_id=request_id))
+        requests += len(frame).to_bytes(glosocket.LENGTH_SIZE, "big") + frame
+    try:
+        soc.sendall(requests)
+    except socket.timeout:
+        pass  # le serveur a déjà cessé de lire ce client
+    return soc
+
+
+async def _measure(destination: str, users: int, duration: float) -> "list[float]":
+    """Latences de STATS_REQUEST pour `users` clients pendant `duration` s."""
+    latencies = []
+    codec = glocodec.JsonCodec
+
+    async def user() -> None:
+        reader, writer = await asyncio.open_connection(destination,
+                                                       gloutils.APP_PORT)
+        await glosocket.async_send_data(writer, codec.encode(gloutils.GloMessage(
+            header=gloutils.Headers.AUTH_REGISTER,
+            payload=gloutils.AuthPayload(username=f"normal{uuid.uuid4().hex[:6]}",
+                                         password=PASSWORD))))
+        await glosocket.async_recv_data(reader)
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            await glosocket.async_send_data(writer, codec.encode(
+                gloutils.GloMessage(header=gloutils.Headers.STATS_REQUEST,
+                                    payload=None)))
+            await glosocket.async_recv_data(reader)
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+        await writer.wait_closed()
+
+    await asyncio.gather(*(user() for _ in range(users)))
+    return latencies
+
+
+def _is_connected(soc: socket.socket) -> bool:
+    """Vide ce qui reste à lire ; retourne False si le serveur a coupé."""
+    soc.settimeout(2.0)
+    try:
+        while soc.recv(1024 * 1024):
+            pass
+        return False
+    except socket.timeout:
+        return True
+    except OSError:
+        return False
+
+
+def _report(label: str, latencies: "list[float]") -> None:
+    print(f"{label:>28} : {len(latencies):>6} requêtes,"
+          f" p50 {_percentile(latencies, 50) * 1000:7.3f} ms,"
+          f" p99 {_percentile(latencies, 99) * 1000:7.3f} ms")
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--destination", action="store",
+                        dest="dest", required=True,
+                        help="Adresse IP/URL du serveur.")
+    parser.add_argument("-u", "--users", type=int, default=10,
+                        help="Nombre de clients normaux.")
+    parser.add_argument("-t", "--duration", type=float, default=5.0,
+                        help="Durée de chaque mesure en secondes.")
+    parser.add_argument("-n", "--emails", type=int, default=8,
+                        help="Nombre de courriels du client bloqué.")
+    parser.add_argument("-s", "--size", type=int, default=2 * 1024 * 1024,
+                        help="Taille de chaque courriel du client bloqué.")
+    parser.add_argument("-w", "--wait", type=float, default=5.0,
+                        help="Attente (secondes) avant de vérifier si le client "
+                             "bloqué a été déconnecté ; à régler au-delà du "
+                             "--slow-reader-timeout du serveur.")
+    parser.add_argument("--high-water", type=int, default=256 * 1024,
+                        help="Seuil haut du tampon d'écriture du serveur "
+                             "(son --write-high-water).")
+    args = parser.parse_args(sys.argv[1:])
+
+    alone = asyncio.run(_measure(args.dest, args.users, args.duration))
+    stalled = _stall(args.dest, args.emails, args.size)
+    together = asyncio.run(_measure(args.dest, args.users, args.duration))
+
+    _report("sans client bloqué", alone)
+    _report("avec un client bloqué", together)
+    time.sleep(args.wait)
+    connected = _is_connected(stalled)
+    print("Client bloqué encore connecté :",
+          "oui" if connected else "non (déconnecté par le serveur)")
+    stalled.close()
+
+    with socket.create_connection((args.dest, gloutils.APP_PORT)) as soc:
+        metrics = _exchange(soc, gloutils.Headers.METRICS_REQUEST)
+    peak = 0
+    for line in metrics["payload"]["metrics"].splitlines():
+        if line.startswith(("glo_slow_readers_total", "glo_write_waits_total",
+                            "glo_write_buffer_peak_bytes")):
+            print(line)
+        if line.startswith("glo_write_buffer_peak_bytes "):
+            peak = float(line.split()[1])
+
+    failures = []
+    if connected:
+        failures.append("le client bloqué n'a pas été déconnecté")
+    limit = args.high_water + args.size + FRAME_OVERHEAD
+    if peak > limit:
+        failures.append(f"tampon d'écriture de {peak:.0f} octets,"
+                        f" au-delà de {limit} octets")
+    for failure in failures:
+        print(f"Échec : {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
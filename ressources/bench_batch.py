@@ -0,0 +1,141 @@
+"""\
+Banc d'essai du téléchargement d'une boîte complète.
+
+Remplit la boîte d'un nouvel utilisateur de `--emails` courriels, puis
+la télécharge deux fois : par `--emails` requêtes INBOX_READING_CHOICE
+successives, comme `_read_email`, puis par une seule requête
+INBOX_READING_BATCH. Vérifie que les deux téléchargements sont
+identiques et affiche le débit de chacun.
+
+Utilisation (serveur déjà lancé) :
+    python bench_batch.py -d 127.0.0.1 [-n 2000] [-s 2000] [-c glo-binary]
+"""
+
+import argparse
+import socket
+import sys
+import time
+import uuid
+
+import glocodec
+import glosocket
+import gloutils
+
+PASSWORD = "Telechargement123"
+
+
+class _Connection:
+    """Connexion bloquante au serveur, avec le format négocié."""
+
+    def __init__(self, destination: str, codec: str) -> None:
+        self._soc = socket.create_connection((destination, gloutils.APP_PORT))
+        self._codec = glocodec.JsonCodec
+        reply = self.exchange(gloutils.Headers.HELLO,
+                              gloutils.HelloPayload(codecs=[codec]))
+        self._codec = glocodec.CODECS[reply["payload"]["codec"]]
+
+    def send(self, header: gloutils.Headers, payload=None, **extra) -> None:
+        glosocket.send_data(self._soc, self._codec.encode(
+            gloutils.GloMessage(header=header, payload=payload, **extra)))
+
+    def receive(self) -> gloutils.GloMessage:
+        return self._codec.decode(glosocket.recv_data(self._soc))
+
+    def exchange(self, header: gloutils.Headers, payload=None) -> gloutils.GloMessage:
+        self.send(header, payload)
+        return self.receive()
+
+    def close(self) -> None:
+        self._soc.close()
+
+
+def _fill(connection: _Connection, address: str, count: int, size: int) -> None:
+    """Livre `count` courriels, en pipeline pour aller vite."""
+    for i in range(count):
+        connection.send(gloutils.Headers.EMAIL_SENDING,
+                        gloutils.EmailContentPayload(
+                            sender=address, destination=address,
+                            subject=f"Archive {i}",
+                            date=gloutils.get_current_utc_time(),
+                            content=f"{i:08d}" * (size // 8)),
+                        request_id=i)
+    for _ in range(count):
+        connection.receive()
+
+
+def _sequential(connection: _Connection, count: int) -> "dict[int, dict]":
+    emails = {}
+    for choice in range(1, count + 1):
+        reply = connection.exchange(gloutils.Headers.INBOX_READING_CHOICE,
+                                    gloutils.EmailChoicePayload(choice=choice))
+        emails[choice] = reply["payload"]
+    return emails
+
+
+def _batch(connection: _Connection, count: int) -> "dict[int, dict]":
+    emails = {}
+    connection.send(gloutils.Headers.INBOX_READING_BATCH,
+                    gloutils.EmailBatchRequestPayload(first=1, last=count))
+    while True:
+        message = connection.receive()
+        if message["header"] == gloutils.Headers.EMAIL_BATCH:
+            emails.update(zip(message["payload"]["choices"],
+                              message["payload"]["emails"]))
+        elif message["header"] == gloutils.Headers.EMAIL_BODY_BEGIN:
+            email = dict(message["payload"])
+            choice = email.pop("choice")
+            chunks = []
+            while (message := connection.receive())["header"] == \
+                    gloutils.Headers.EMAIL_BODY_CHUNK:
+                chunks.append(message["payload"]["data"])
+            emails[choice] = dict(email, content="".join(chunks))
+        else:
+            return emails
+
+
+def _report(label: str, count: int, elapsed: float) -> None:
+    print(f"{label:>12} : {count} courriels en {elapsed:.3f} s"
+          f" ({count / elapsed:.0f} courriels/s)")
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--destination", action="store",
+                        dest="dest", required=True,
+                        help="Adresse IP/URL du serveur.")
+    parser.add_argument("-n", "--emails", type=int, default=2000,
+                        help="Nombre de courriels dans la boîte.")
+    parser.add_argument("-s", "--size", type=int, default=2000,
+                        help="Taille du corps de chaque courriel.")
+    parser.add_argument("-c", "--codec", default="glo-binary",
+                        choices=list(glocodec.CODECS),
+                        help="Format de sérialisation à négocier.")
+    args = parser.parse_args(sys.argv[1:])
+
+    connection = _Connection(args.dest, args.codec)
+    username = f"archive{uuid.uuid4().hex[:6]}"
+    connection.exchange(gloutils.Headers.AUTH_REGISTER,
+                        gloutils.AuthPayload(username=username,
+                                             password=PASSWORD))
+    _fill(connection, f"{username}@{gloutils.SERVER_DOMAIN}", args.emails,
+          args.size)
+
+    start = time.perf_counter()
+    sequential = _sequential(connection, args.emails)
+    sequential_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = _batch(connection, args.emails)
+    batch_time = time.perf_counter() - start
+    connection.close()
+
+    _report("un par un", args.emails, sequential_time)
+    _report("en lot", args.emails, batch_time)
+    print(f"Accélération : x{sequential_time / batch_time:.1f}")
+    if batch != sequential:
+        print("Les deux téléchargements diffèrent.")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,78 @@
+"""\
+Banc d'essai du cache des courriels lus et des listes affichées.
+
+Remplit la boîte d'un nouvel utilisateur de `--emails` courriels, puis
+rejoue `--rounds` fois le parcours typique d'un client : lister la boîte
+(en entier, puis la première page) et ouvrir les `--open` courriels les
+plus récents. Affiche la durée moyenne de chaque requête et les
+compteurs du cache exportés par METRICS_REQUEST.
+
+Lancer le serveur avec et sans cache pour comparer :
+    python TP4_server.py [--cache-size 0]
+    python bench_cache.py -d 127.0.0.1 [-n 2000] [-r 50] [-o 5]
+"""
+
+import argparse
+import sys
+import time
+import uuid
+
+import gloutils
+from bench_batch import PASSWORD, _Connection, _fill
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--destination", action="store",
+                        dest="dest", required=True,
+                        help="Adresse IP/URL du serveur.")
+    parser.add_argument("-n", "--emails", type=int, default=2000,
+                        help="Nombre de courriels dans la boîte.")
+    parser.add_argument("-s", "--size", type=int, default=2000,
+                        help="Taille du corps de chaque courriel.")
+    parser.add_argument("-r", "--rounds", type=int, default=50,
+                        help="Nombre de parcours mesurés.")
+    parser.add_argument("-o", "--open", type=int, default=5,
+                        help="Nombre de courriels ouverts à chaque parcours.")
+    parser.add_argument("-c", "--codec", default="glo-binary",
+                        help="Format de sérialisation à négocier.")
+    args = parser.parse_args(sys.argv[1:])
+
+    connection = _Connection(args.dest, args.codec)
+    username = f"cache{uuid.uuid4().hex[:6]}"
+    connection.exchange(gloutils.Headers.AUTH_REGISTER,
+                        gloutils.AuthPayload(username=username,
+                                             password=PASSWORD))
+    _fill(connection, f"{username}@{gloutils.SERVER_DOMAIN}", args.emails,
+          args.size)
+
+    requests = {
+        "liste complète": [(gloutils.Headers.INBOX_READING_REQUEST, None)],
+        "première page": [(gloutils.Headers.INBOX_PAGE_REQUEST,
+                           gloutils.EmailPageRequestPayload(
+                               offset=0, limit=gloutils.INBOX_MAX_PAGE_SIZE))],
+        "lecture": [(gloutils.Headers.INBOX_READING_CHOICE,
+                     gloutils.EmailChoicePayload(choice=choice))
+                    for choice in range(1, args.open + 1)],
+    }
+    durations = dict.fromkeys(requests, 0.0)
+    for _ in range(args.rounds):
+        for label, messages in requests.items():
+            for header, payload in messages:
+                start = time.perf_counter()
+                connection.exchange(header, payload)
+                durations[label] += time.perf_counter() - start
+
+    for label, messages in requests.items():
+        average = durations[label] / (args.rounds * len(messages)) * 1000
+        print(f"{label:>16} : {average:8.3f} ms par requête")
+    metrics = connection.exchange(gloutils.Headers.METRICS_REQUEST)
+    connection.close()
+    for line in metrics["payload"]["metrics"].splitlines():
+        if line.startswith("glo_mail_cache"):
+            print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
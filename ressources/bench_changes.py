@@ -0,0 +1,102 @@
+"""\
+Banc d'essai de la synchronisation incrémentale (INBOX_CHANGES).
+
+Remplit la boîte d'un nouvel utilisateur de `--emails` courriels, puis
+compare le coût d'une vérification de nouveaux courriels par
+INBOX_READING_REQUEST (toute la liste) et par INBOX_CHANGES (seulement
+ce qui suit le curseur). Mesure ensuite le délai entre une livraison et
+le réveil d'un client en attente (`wait`).
+
+Utilisation (serveur déjà lancé) :
+    python bench_changes.py -d 127.0.0.1 [-n 10000] [-r 50]
+"""
+
+import argparse
+import sys
+import threading
+import time
+import uuid
+
+import gloutils
+from bench_batch import PASSWORD, _Connection, _fill
+
+
+def _average(function, repeat: int) -> float:
+    """Durée moyenne d'un appel, en ms."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def _send_later(destination: str, codec: str, address: str,
+                delay: float, sent: list) -> None:
+    connection = _Connection(destination, codec)
+    connection.exchange(gloutils.Headers.AUTH_LOGIN, gloutils.AuthPayload(
+        username=address.split("@")[0], password=PASSWORD))
+    time.sleep(delay)
+    sent.append(time.perf_counter())
+    connection.exchange(gloutils.Headers.EMAIL_SENDING,
+                        gloutils.EmailContentPayload(
+                            sender=address, destination=address,
+                            subject="Nouveau", content="Réveil",
+                            date=gloutils.get_current_utc_time()))
+    connection.close()
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--destination", action="store",
+                        dest="dest", required=True,
+                        help="Adresse IP/URL du serveur.")
+    parser.add_argument("-n", "--emails", type=int, default=10_000,
+                        help="Nombre de courriels dans la boîte.")
+    parser.add_argument("-r", "--repeat", type=int, default=50,
+                        help="Nombre de vérifications mesurées.")
+    parser.add_argument("-c", "--codec", default="glo-binary",
+                        help="Format de sérialisation à négocier.")
+    args = parser.parse_args(sys.argv[1:])
+
+    connection = _Connection(args.dest, args.codec)
+    username = f"synchro{uuid.uuid4().hex[:6]}"
+    address = f"{username}@{gloutils.SERVER_DOMAIN}"
+    connection.exchange(gloutils.Headers.AUTH_REGISTER,
+                        gloutils.AuthPayload(username=username,
+                                             password=PASSWORD))
+    _fill(connection, address, args.emails, 100)
+
+    cursor = 0
+    while True:
+        reply = connection.exchange(gloutils.Headers.INBOX_CHANGES,
+                                    gloutils.EmailChangesRequestPayload(
+                                        cursor=cursor))
+        if not reply["payload"]["email_list"]:
+            break
+        cursor = reply["payload"]["cursor"]
+    print(f"{args.emails} courriels, curseur {cursor}")
+
+    listing = _average(lambda: connection.exchange(
+        gloutils.Headers.INBOX_READING_REQUEST), args.repeat)
+    changes = _average(lambda: connection.exchange(
+        gloutils.Headers.INBOX_CHANGES,
+        gloutils.EmailChangesRequestPayload(cursor=cursor)), args.repeat)
+    print(f"{'liste complète':>16} : {listing:8.3f} ms par vérification")
+    print(f"{'changements':>16} : {changes:8.3f} ms par vérification")
+
+    sent = []
+    sender = threading.Thread(target=_send_later,
+                              args=(args.dest, args.codec, address, 0.5, sent))
+    sender.start()
+    reply = connection.exchange(gloutils.Headers.INBOX_CHANGES,
+                                gloutils.EmailChangesRequestPayload(
+                                    cursor=cursor, wait=10.0))
+    woken = time.perf_counter()
+    sender.join()
+    connection.close()
+    print(f"Réveil {(woken - sent[0]) * 1000:.1f} ms après l'envoi :"
+          f" {reply['payload']['email_list']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,87 @@
+"""\
+Banc d'essai des formats de sérialisation de glocodec.
+
+Pour des messages représentatifs du protocole, affiche la taille de
+la trame et le temps d'encodage et de décodage de chaque format.
+
+Utilisation : python bench_codec.py [-r 2000]
+"""
+
+import argparse
+import json
+import sys
+import timeit
+
+import glocodec
+import gloutils
+
+
+def _email(body_size: int) -> gloutils.GloMessage:
+    payload = gloutils.EmailContentPayload(
+        sender="alice@glo2000.ca", destination="bob@glo2000.ca",
+        subject="Rapport hebdomadaire « été »",
+        date=gloutils.get_current_utc_time(),
+        content=('Ligne de journal "quotidienne" à analyser\n'
+                 * (body_size // 42 + 1))[:body_size])
+    return gloutils.GloMessage(header=gloutils.Headers.OK, payload=payload)
+
+
+def _subjects(count: int) -> "list[str]":
+    return [gloutils.SUBJECT_DISPLAY.format(
+        number=i + 1, sender="alice@glo2000.ca", subject=f"Sujet n°{i}",
+        date=gloutils.get_current_utc_time()) for i in range(count)]
+
+
+def _messages() -> "dict[str, gloutils.GloMessage]":
+    return {
+        "auth": gloutils.GloMessage(
+            header=gloutils.Headers.AUTH_LOGIN,
+            payload=gloutils.AuthPayload(username="alice",
+                                         password="Motdepasse123")),
+        "stats": gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload=gloutils.StatsPayload(count=1234, size=5678901)),
+        "courriel 1 Ko": _email(1024),
+        "courriel 100 Ko": _email(100 * 1024),
+        "page de 10": gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload=gloutils.EmailPagePayload(email_list=_subjects(10),
+                                              total=5000)),
+        # Liste historique : du JSON imbriqué dans la trame JSON.
+        "liste de 1000": gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload=gloutils.EmailListPayload(
+                email_list=json.dumps(_subjects(1000)))),
+    }
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repeat", type=int, default=2000,
+                        help="Nombre d'encodages/décodages par mesure.")
+    args = parser.parse_args(sys.argv[1:])
+
+    print(f"{'message':>16} {'format':>11} {'octets':>9}"
+          f" {'encodage (µs)':>14} {'décodage (µs)':>14}")
+    for label, message in _messages().items():
+        for codec in glocodec.CODECS.values():
+            if label == "liste de 1000" and codec is not glocodec.JsonCodec:
+                # Les autres formats transportent la liste telle quelle.
+                message = gloutils.GloMessage(
+                    header=message["header"],
+                    payload=gloutils.EmailListPayload(
+                        email_list=json.loads(message["payload"]["email_list"])))
+            data = codec.encode(message)
+            assert codec.decode(data) == json.loads(json.dumps(message))
+            encode = timeit.timeit(lambda: codec.encode(message),
+                                   number=args.repeat)
+            decode = timeit.timeit(lambda: codec.decode(data),
+                                   number=args.repeat)
+            print(f"{label:>16} {codec.name:>11} {len(data):>9}"
+                  f" {encode / args.repeat * 1e6:>14.2f}"
+                  f" {decode / args.repeat * 1e6:>14.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,97 @@
+"""\
+Banc d'essai de la compression des trames de glosocket.
+
+Pour des trames représentatives du protocole (encodées en JSON), affiche
+les octets économisés par zlib à plusieurs niveaux, le temps de
+compression et de décompression, et le temps de transmission gagné sur
+un lien de `--bandwidth` Mbit/s. Une compression est rentable quand ce
+gain dépasse le temps de compression et de décompression.
+
+Utilisation : python bench_compression.py [-r 200] [-b 10]
+"""
+
+import argparse
+import json
+import sys
+import timeit
+import zlib
+
+import glocodec
+import glosocket
+import gloutils
+
+LEVELS = (1, 6, 9)
+
+
+def _email(body_size: int) -> gloutils.GloMessage:
+    payload = gloutils.EmailContentPayload(
+        sender="alice@glo2000.ca", destination="bob@glo2000.ca",
+        subject="Journal du serveur",
+        date=gloutils.get_current_utc_time(),
+        content="".join(f"2024-03-{i % 28 + 1:02d} 12:{i % 60:02d}:07 INFO "
+                        f"glo-worker-{i % 8} requête {i} traitée en "
+                        f"{(i * 37) % 900 / 100:.2f} ms\n"
+                        for i in range(body_size // 70 + 1))[:body_size])
+    return gloutils.GloMessage(header=gloutils.Headers.OK, payload=payload)
+
+
+def _subjects(count: int) -> "list[str]":
+    return [gloutils.SUBJECT_DISPLAY.format(
+        number=i + 1, sender=f"user{i % 13}@glo2000.ca",
+        subject=f"Re: Sujet n°{i}", date=gloutils.get_current_utc_time())
+        for i in range(count)]
+
+
+def _frames() -> "dict[str, bytes]":
+    encode = glocodec.JsonCodec.encode
+    return {
+        "stats": encode(gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload=gloutils.StatsPayload(count=1234, size=5678901))),
+        "page de 10": encode(gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload=gloutils.EmailPagePayload(email_list=_subjects(10),
+                                              total=5000))),
+        "courriel 1 Ko": encode(_email(1024)),
+        "courriel 64 Ko": encode(_email(64 * 1024)),
+        "courriel 1 Mo": encode(_email(1024 * 1024)),
+        "liste de 1000": encode(gloutils.GloMessage(
+            header=gloutils.Headers.OK,
+            payload=gloutils.EmailListPayload(
+                email_list=json.dumps(_subjects(1000))))),
+    }
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repeat", type=int, default=200,
+                        help="Nombre de compressions/décompressions par mesure.")
+    parser.add_argument("-b", "--bandwidth", type=float, default=10.0,
+                        help="Débit du lien (Mbit/s) pour estimer le gain.")
+    args = parser.parse_args(sys.argv[1:])
+    bytes_per_us = args.bandwidth * 1e6 / 8 / 1e6
+
+    print(f"Seuil actuel : {glosocket.COMPRESSION_THRESHOLD} octets,"
+          f" niveau {glosocket.COMPRESSION_LEVEL}")
+    print(f"{'trame':>15} {'niveau':>6} {'octets':>9} {'compressés':>10}"
+          f" {'ratio':>6} {'compr. (µs)':>12} {'décompr. (µs)':>14}"
+          f" {'gain lien (µs)':>15}")
+    for label, frame in _frames().items():
+        for level in LEVELS:
+            compressed = zlib.compress(frame, level)
+            assert zlib.decompress(compressed) == frame
+            # Moins de répétitions pour les grandes trames.
+            number = max(args.repeat * 1024 // max(len(frame), 1024), 1)
+            compress = timeit.timeit(lambda: zlib.compress(frame, level),
+                                     number=number) / number * 1e6
+            decompress = timeit.timeit(lambda: zlib.decompress(compressed),
+                                       number=number) / number * 1e6
+            saved_us = (len(frame) - len(compressed)) / bytes_per_us
+            print(f"{label:>15} {level:>6} {len(frame):>9} {len(compressed):>10}"
+                  f" {len(compressed) / len(frame):>6.2f} {compress:>12.1f}"
+                  f" {decompress:>14.1f} {saved_us:>15.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,170 @@
+"""\
+Test de charge des livraisons concurrentes dans les boîtes de courriels.
+
+Des expéditeurs répartis sur `--processes` processus de `--senders` fils
+livrent chacun `--emails` courriels dans `--mailboxes` boîtes tirées au
+hasard, comme le feraient les fils et processus du serveur. Un courriel
+sur `--body-every` est reçu par morceaux (`open_body`). Le dossier est
+ensuite relu à froid : chaque courriel doit être présent exactement une
+fois, avec un contenu intact, et chaque boîte doit contenir autant de
+courriels que ses expéditeurs lui en ont livré, numérotés de 1 à N sans
+trou ni doublon, avec des compteurs exacts. Le banc sort avec le code 1
+à la moindre anomalie.
+
+Utilisation : python bench_delivery.py [-p 4] [-s 16] [-n 200] [-m 4]
+"""
+
+import argparse
+import multiprocessing
+import pathlib
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import glomailbox
+
+
+def _content(tag: str, size: int) -> str:
+    # Contenu propre à chaque courriel : une écriture mélangée ou tronquée
+    # ne peut pas passer la vérification.
+    return (tag + "|") * (size // (len(tag) + 1) + 1)
+
+
+def _targets(process: int, index: int, args: argparse.Namespace) -> "list[int]":
+    """Boîtes (dans l'ordre) auxquelles livre l'expéditeur `index` de `process`."""
+    rng = random.Random(process * 1000 + index)
+    return [rng.randrange(args.mailboxes) for _ in range(args.emails)]
+
+
+def _deliver(root: str, process: int, args: argparse.Namespace) -> None:
+    """Livraisons d'un processus : `args.senders` fils en parallèle."""
+    store = glomailbox.MailStore(pathlib.Path(root), shared=args.processes > 1)
+
+    def sender(index: int) -> None:
+        for seq, target in enumerate(_targets(process, index, args)):
+            tag = f"{process}-{index}-{seq}"
+            mailbox = store.get(f"boite{target}")
+            email = {"sender": f"{tag}@glo2000.ca", "destination": "x",
+                     "subject": tag, "date": "now"}
+            content = _content(tag, args.size)
+            if args.body_every and seq % args.body_every == 0:
+                body = mailbox.open_body()
+                for start in range(0, len(content), 1000):
+                    body.write(content[start:start + 1000])
+                mailbox.deliver(email, body)
+            else:
+                mailbox.deliver(dict(email, content=content))
+
+    threads = [threading.Thread(target=sender, args=(i,))
+               for i in range(args.senders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.close()
+
+
+def _verify(root: pathlib.Path, args: argparse.Namespace) -> int:
+    """Relit toutes les boîtes et retourne le nombre d'anomalies."""
+    expected = {f"{p}-{s}-{n}" for p in range(args.processes)
+                for s in range(args.senders) for n in range(args.emails)}
+    counts = [0] * args.mailboxes
+    for process in range(args.processes):
+        for index in range(args.senders):
+            for target in _targets(process, index, args):
+                counts[target] += 1
+    seen = set()
+    errors = 0
+    for index in range(args.mailboxes):
+        path = root / f"boite{index}"
+        mailbox = glomailbox.Mailbox(path)
+        entries = mailbox.entries()
+        if len(entries) != counts[index]:
+            print(f"{path.name} : {len(entries)} courriels,"
+                  f" attendu {counts[index]}")
+            errors += 1
+        # Rien n'est supprimé : les numéros doivent aller de 1 à N.
+        numbers = [entry["number"] for entry in entries]
+        if numbers != list(range(1, len(entries) + 1)):
+            print(f"{path.name} : numéros manquants, en double ou désordonnés")
+            errors += 1
+        size = 0
+        for number in range(1, len(entries) + 1):
+            try:
+                email = mailbox.read(number)
+            except (OSError, ValueError, KeyError):
+                print(f"{path.name} : courriel {number} illisible")
+                errors += 1
+                continue
+            tag = email["subject"]
+            if tag in seen:
+                print(f"{path.name} : {tag} livré deux fois")
+                errors += 1
+            seen.add(tag)
+            if email["content"] != _content(tag, args.size):
+                print(f"{path.name} : contenu de {tag} corrompu")
+                errors += 1
+            size += glomailbox.email_size(entries[number - 1])
+        if mailbox.stats() != (len(entries), size):
+            print(f"{path.name} : compteurs {mailbox.stats()},"
+                  f" attendu {(len(entries), size)}")
+            errors += 1
+        mailbox.close()
+    lost = expected - seen
+    if lost:
+        print(f"{len(lost)} courriels perdus, par exemple {sorted(lost)[:5]}")
+        errors += len(lost)
+    return errors
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--processes", type=int, default=4,
+                        help="Nombre de processus (boîtes partagées si > 1).")
+    parser.add_argument("-s", "--senders", type=int, default=16,
+                        help="Nombre de fils expéditeurs par processus.")
+    parser.add_argument("-n", "--emails", type=int, default=200,
+                        help="Nombre de courriels par expéditeur.")
+    parser.add_argument("-m", "--mailboxes", type=int, default=4,
+                        help="Nombre de boîtes destinataires.")
+    parser.add_argument("--size", type=int, default=2000,
+                        help="Taille du contenu de chaque courriel.")
+    parser.add_argument("--body-every", type=int, default=10,
+                        help="Un courriel sur N est reçu par morceaux "
+                             "(0 pour jamais).")
+    args = parser.parse_args(sys.argv[1:])
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = pathlib.Path(directory)
+        for index in range(args.mailboxes):
+            (root / f"boite{index}").mkdir()
+        (root / glomailbox.STORE_FORMAT_FILENAME).write_text(
+            glomailbox.STORE_FORMAT)
+
+        start = time.perf_counter()
+        processes = [multiprocessing.Process(target=_deliver,
+                                             args=(directory, i, args))
+                     for i in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        total = args.processes * args.senders * args.emails
+        print(f"{total} livraisons en {elapsed:.2f} s"
+              f" ({total / elapsed:.0f}/s), {args.processes} processus"
+              f" x {args.senders} fils, {args.mailboxes} boîtes")
+        if any(process.exitcode != 0 for process in processes):
+            print("Un processus expéditeur a échoué.")
+            return 1
+        errors = _verify(root, args)
+    print("Aucun courriel perdu ni corrompu." if not errors
+          else f"{errors} anomalies.")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
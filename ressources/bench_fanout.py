@@ -0,0 +1,71 @@
+"""\
+Banc d'essai de l'envoi d'un courriel à plusieurs destinataires.
+
+Crée `--users` comptes, puis leur envoie le même courriel de `--size`
+caractères deux fois : par une requête EMAIL_SENDING par destinataire,
+puis par une seule requête dont `destination` les nomme tous. Affiche
+la durée de chaque envoi et vérifie que chaque destinataire l'a reçu.
+
+Utilisation (serveur déjà lancé) :
+    python bench_fanout.py -d 127.0.0.1 [-u 200] [-s 100000]
+"""
+
+import argparse
+import sys
+import time
+import uuid
+
+import gloutils
+from bench_batch import PASSWORD, _Connection
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--destination", action="store",
+                        dest="dest", required=True,
+                        help="Adresse IP/URL du serveur.")
+    parser.add_argument("-u", "--users", type=int, default=200,
+                        help="Nombre de destinataires.")
+    parser.add_argument("-s", "--size", type=int, default=100_000,
+                        help="Taille du corps du courriel.")
+    parser.add_argument("-c", "--codec", default="glo-binary",
+                        help="Format de sérialisation à négocier.")
+    args = parser.parse_args(sys.argv[1:])
+
+    prefix = f"diffusion{uuid.uuid4().hex[:6]}"
+    addresses = []
+    for i in range(args.users):
+        connection = _Connection(args.dest, args.codec)
+        connection.exchange(gloutils.Headers.AUTH_REGISTER,
+                            gloutils.AuthPayload(username=f"{prefix}{i}",
+                                                 password=PASSWORD))
+        addresses.append(f"{prefix}{i}@{gloutils.SERVER_DOMAIN}")
+    # La dernière connexion reste ouverte pour les envois.
+    email = gloutils.EmailContentPayload(
+        sender=addresses[0], destination="", subject="Annonce",
+        date=gloutils.get_current_utc_time(), content="x" * args.size)
+
+    start = time.perf_counter()
+    for address in addresses:
+        connection.exchange(gloutils.Headers.EMAIL_SENDING,
+                            dict(email, destination=address))
+    one_by_one = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reply = connection.exchange(gloutils.Headers.EMAIL_SENDING,
+                                dict(email, destination=", ".join(addresses)))
+    fan_out = time.perf_counter() - start
+    connection.close()
+
+    print(f"{'un par un':>12} : {one_by_one * 1000:8.1f} ms")
+    print(f"{'diffusion':>12} : {fan_out * 1000:8.1f} ms"
+          f" (x{one_by_one / fan_out:.1f})")
+    statuses = [recipient["status"] for recipient in reply["payload"]["recipients"]]
+    if statuses != [gloutils.RECIPIENT_DELIVERED] * args.users:
+        print(f"Livraisons incomplètes : {statuses}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
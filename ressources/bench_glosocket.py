@@ -0,0 +1,77 @@
+"""\
+Micro-banc d'essai du chemin de réception de glosocket.
+
+Compare recv_data (tampon préalloué rempli avec recv_into) à
+l'ancienne implémentation qui concaténait des morceaux de 4096
+octets, pour des trames de 1 Ko, 1 Mo et 50 Mo. La copie quadratique
+de l'ancienne version prend plusieurs minutes à 50 Mo : elle n'est
+mesurée qu'une fois par taille.
+
+Utilisation : python bench_glosocket.py [-r 5]
+"""
+
+import argparse
+import socket
+import struct
+import sys
+import threading
+import time
+
+import glosocket
+
+SIZES = {"1 Ko": 1024, "1 Mo": 1024 * 1024, "50 Mo": 50 * 1024 * 1024}
+
+
+def _legacy_recvall(source: socket.socket, size: int) -> bytes:
+    """Ancienne version de glosocket._recvall, pour comparaison."""
+    msg = b""
+    while size > 0:
+        buffer = source.recv(min(size, 4096))
+        if not buffer:
+            raise glosocket.GLOSocketError("The other socket is closed.")
+        msg += buffer
+        size -= len(buffer)
+    return msg
+
+
+def _legacy_recv_data(source: socket.socket) -> bytes:
+    length, = struct.unpack("!I", _legacy_recvall(source, 4))
+    return _legacy_recvall(source, length)
+
+
+def _time_receive(receive, size: int, repeat: int) -> float:
+    """Retourne le meilleur temps (s) de réception d'une trame de `size` octets."""
+    frame = struct.pack("!I", size) + b"x" * size
+    best = float("inf")
+    for _ in range(repeat):
+        sender, receiver = socket.socketpair()
+        thread = threading.Thread(target=sender.sendall, args=(frame,))
+        start = time.perf_counter()
+        thread.start()
+        data = receive(receiver)
+        elapsed = time.perf_counter() - start
+        thread.join()
+        sender.close()
+        receiver.close()
+        assert len(data) == size
+        best = min(best, elapsed)
+    return best
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="Nombre de mesures par taille.")
+    args = parser.parse_args(sys.argv[1:])
+
+    print(f"{'trame':>8} {'ancien (ms)':>12} {'recv_into (ms)':>15} {'gain':>7}")
+    for label, size in SIZES.items():
+        legacy = _time_receive(_legacy_recv_data, size, 1)
+        current = _time_receive(glosocket.recv_data, size, args.repeat)
+        print(f"{label:>8} {legacy * 1000:>12.3f} {current * 1000:>15.3f}"
+              f" {legacy / current:>6.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,113 @@
+"""\
+Banc d'essai du registre des utilisateurs.
+
+Mesure la latence de AUTH_LOGIN et d'une livraison interne
+(EMAIL_SENDING) pour des serveurs comptant de plus en plus de comptes.
+La latence doit rester stable quel que soit le nombre de comptes.
+Les comptes sont hachés avec un PBKDF2 peu coûteux, que le serveur
+lancé utilise aussi : le banc mesure le registre, pas la dérivation.
+
+Utilisation : python bench_registry.py [-n 100 1000 10000 100000]
+"""
+
+import argparse
+import json
+import pathlib
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import glopassword
+import glosocket
+import gloutils
+
+PASSWORD = "Benchmark123"
+KDF = "pbkdf2"
+KDF_COST = 1
+SERVER_SCRIPT = pathlib.Path(__file__).resolve().parent / "TP4_server.py"
+
+
+def _populate(root: pathlib.Path, count: int) -> None:
+    """Crée `count` comptes directement sur le disque."""
+    # Une seule empreinte pour tous les comptes : seul le coût importe ici.
+    digest = glopassword.PasswordHasher(KDF, KDF_COST).hash(PASSWORD)
+    data_dir = root / gloutils.SERVER_DATA_DIR
+    for i in range(count):
+        user_dir = data_dir / f"user{i}"
+        user_dir.mkdir(parents=True)
+        (user_dir / gloutils.PASSWORD_FILENAME).write_text(digest)
+
+
+def _exchange(soc: socket.socket, message: gloutils.GloMessage
+              ) -> gloutils.GloMessage:
+    glosocket.send_msg(soc, json.dumps(message))
+    return json.loads(glosocket.recv_msg(soc))
+
+
+def _connect() -> socket.socket:
+    for _ in range(100):
+        try:
+            return socket.create_connection(("127.0.0.1", gloutils.APP_PORT))
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Le serveur ne répond pas.")
+
+
+def _measure(count: int, repeat: int) -> "tuple[float, float]":
+    """Retourne les latences médianes (ms) de connexion et de livraison."""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        _populate(root, count)
+        server = subprocess.Popen([sys.executable, str(SERVER_SCRIPT),
+                                   "--kdf", KDF, "--kdf-cost", str(KDF_COST)],
+                                  cwd=root)
+        try:
+            soc = _connect()
+            login_times = []
+            send_times = []
+            for i in range(repeat):
+                username = f"user{i % count}"
+                auth = gloutils.AuthPayload(username=username, password=PASSWORD)
+                start = time.perf_counter()
+                _exchange(soc, gloutils.GloMessage(
+                    header=gloutils.Headers.AUTH_LOGIN, payload=auth))
+                login_times.append(time.perf_counter() - start)
+
+                email = gloutils.EmailContentPayload(
+                    sender=f"{username}@{gloutils.SERVER_DOMAIN}",
+                    destination=f"user{(i * 7919) % count}@{gloutils.SERVER_DOMAIN}",
+                    subject="Banc d'essai", date=gloutils.get_current_utc_time(),
+                    content="Bonjour")
+                start = time.perf_counter()
+                _exchange(soc, gloutils.GloMessage(
+                    header=gloutils.Headers.EMAIL_SENDING, payload=email))
+                send_times.append(time.perf_counter() - start)
+            soc.close()
+        finally:
+            server.terminate()
+            server.wait()
+    return (statistics.median(login_times) * 1000,
+            statistics.median(send_times) * 1000)
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--accounts", type=int, nargs="+",
+                        default=[100, 1000, 10000, 100000],
+                        help="Nombres de comptes à tester.")
+    parser.add_argument("-r", "--repeat", type=int, default=200,
+                        help="Nombre de requêtes par mesure.")
+    args = parser.parse_args(sys.argv[1:])
+
+    print(f"{'comptes':>10} {'login (ms)':>12} {'livraison (ms)':>15}")
+    for count in args.accounts:
+        login, send = _measure(count, args.repeat)
+        print(f"{count:>10} {login:>12.3f} {send:>15.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,113 @@
+"""\
+Banc d'essai de la recherche dans une boîte de courriels.
+
+Remplit une boîte temporaire de `--emails` courriels au vocabulaire
+réaliste (mots fréquents et rares), en alimentant l'index comme le
+serveur à chaque livraison, puis mesure le chargement de l'index à
+partir du fichier des termes, sa reconstruction à partir des courriels,
+et la durée de requêtes typiques. Pour comparaison, la première requête
+est aussi faite en relisant tous les courriels.
+
+Utilisation : python bench_search.py [-n 100000] [-r 200]
+"""
+
+import argparse
+import datetime
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+import glomailbox
+import glosearch
+import gloutils
+
+VOCABULARY = 20_000
+SENDERS = 500
+WORDS_PER_EMAIL = 80
+
+
+def _word(rng: random.Random) -> str:
+    # Distribution de Zipf approximative : quelques mots très fréquents,
+    # beaucoup de mots rares.
+    return f"mot{int(VOCABULARY ** rng.random()) - 1}"
+
+
+def _fill(mailbox: glomailbox.Mailbox, search: glosearch.MailboxSearch,
+          count: int) -> None:
+    rng = random.Random(2000)
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(count):
+        date = start + datetime.timedelta(minutes=5 * i)
+        email = {"sender": f"user{rng.randrange(SENDERS)}@glo2000.ca",
+                 "destination": "bench@glo2000.ca",
+                 "subject": " ".join(_word(rng) for _ in range(5)),
+                 "date": date.strftime("%a, %d %b %Y %H:%M:%S %z"),
+                 "content": " ".join(_word(rng) for _ in range(WORDS_PER_EMAIL))}
+        search.add(mailbox.deliver(email), email["content"])
+
+
+def _time(function, repeat: int) -> "tuple[float, int]":
+    """Durée moyenne d'un appel en ms, et nombre de résultats."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat * 1000, len(result)
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--emails", type=int, default=100_000,
+                        help="Nombre de courriels dans la boîte.")
+    parser.add_argument("-r", "--repeat", type=int, default=200,
+                        help="Nombre d'exécutions de chaque requête.")
+    args = parser.parse_args(sys.argv[1:])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = pathlib.Path(directory)
+        mailbox = glomailbox.Mailbox(path)
+        start = time.perf_counter()
+        _fill(mailbox, glosearch.MailboxSearch(mailbox, path), args.emails)
+        print(f"{args.emails} courriels livrés et indexés en"
+              f" {time.perf_counter() - start:.1f} s")
+
+        search = glosearch.MailboxSearch(mailbox, path)
+        start = time.perf_counter()
+        search.search(text="mot0")
+        print(f"Index chargé du fichier des termes en"
+              f" {time.perf_counter() - start:.2f} s")
+        (path / gloutils.MAILBOX_SEARCH_FILENAME).unlink()
+        search = glosearch.MailboxSearch(mailbox, path)
+        start = time.perf_counter()
+        search.search(text="mot0")
+        print(f"Index reconstruit à partir des courriels en"
+              f" {time.perf_counter() - start:.2f} s")
+
+        since = glosearch.parse_query_date("2024-02-01")
+        until = glosearch.parse_query_date("2024-02-08")
+        queries = {
+            "mot rare": dict(text="mot15000"),
+            "mot fréquent": dict(text="mot1"),
+            "deux mots": dict(text="mot3 mot40"),
+            "expéditeur": dict(sender="user42"),
+            "expéditeur + corps": dict(sender="user42", text="mot2"),
+            "sujet + semaine": dict(subject="mot5", since=since, until=until),
+            "semaine seule": dict(since=since, until=until),
+        }
+        print(f"{'requête':>20} {'résultats':>9} {'durée (ms)':>11}")
+        for label, query in queries.items():
+            elapsed, count = _time(lambda: search.search(**query), args.repeat)
+            print(f"{label:>20} {count:>9} {elapsed:>11.3f}")
+
+        def scan() -> "list[int]":
+            return [entry["number"] for entry, _, body in mailbox.scan()
+                    if "mot15000" in glosearch.tokenize(body.read())]
+        elapsed, count = _time(scan, 1)
+        print(f"{'sans index':>20} {count:>9} {elapsed:>11.3f}")
+        mailbox.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,124 @@
+"""\
+Module fournissant le cache des courriels lus et des listes affichées.
+
+Un utilisateur liste typiquement sa boîte, puis ouvre et rouvre quelques
+courriels récents : le serveur garde en mémoire les courriels décodés et
+les pages de la liste déjà construites, jusqu'à un nombre d'octets fixé.
+Les entrées les moins récemment utilisées sont évincées en premier.
+"""
+import collections
+import sys
+import threading
+from typing import Any, Hashable
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Une entrée plus grande que cette fraction du cache n'y est pas gardée :
+# elle évincerait à elle seule une grande partie des autres.
+MAX_ENTRY_FRACTION = 8
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Estime la mémoire (en octets) occupée par `value` et par les chaînes,
+    listes, tuples et dictionnaires qu'elle contient.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(key) + estimate_size(item)
+                    for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class LRUCache:
+    """
+    Cache LRU borné en octets, dont les entrées appartiennent chacune à
+    un propriétaire (un utilisateur).
+
+    Les clés sont des tuples dont le premier élément est le type de
+    l'entrée (par exemple "email" ou "page") : `invalidate` retire
+    toutes les entrées d'un propriétaire, ou seulement celles d'un type.
+    Les compteurs de `stats` permettent de dimensionner `max_bytes` ;
+    un cache de taille nulle ne garde rien.
+
+    Les méthodes peuvent être appelées depuis plusieurs fils.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self._max_bytes = max(max_bytes, 0)
+        self._entries: "collections.OrderedDict[tuple, tuple[Any, int]]" = \
+            collections.OrderedDict()
+        # Clés des entrées de chaque propriétaire, pour `invalidate`.
+        self._owners: "dict[str, set[tuple]]" = {}
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    def get(self, owner: str, key: "tuple[Hashable, ...]") -> Any:
+        """Retourne la valeur en cache, ou None, et la marque comme récente."""
+        with self._lock:
+            found = self._entries.get((owner, key))
+            if found is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end((owner, key))
+            self._hits += 1
+            return found[0]
+
+    def put(self, owner: str, key: "tuple[Hashable, ...]", value: Any,
+            size: "int | None" = None) -> None:
+        """
+        Garde `value`, dont la taille est estimée par `estimate_size` si
+        `size` n'est pas donnée, en évinçant les entrées les plus
+        anciennes au besoin.
+        """
+        if size is None:
+            size = estimate_size(value)
+        if size * MAX_ENTRY_FRACTION > self._max_bytes:
+            return
+        with self._lock:
+            self._remove((owner, key))
+            self._entries[(owner, key)] = (value, size)
+            self._owners.setdefault(owner, set()).add(key)
+            self._size += size
+            while self._size > self._max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def invalidate(self, owner: str, kind: "Hashable | None" = None) -> None:
+        """Retire les entrées de `owner`, ou seulement celles du type `kind`."""
+        with self._lock:
+            keys = self._owners.get(owner)
+            if not keys:
+                return
+            for key in [key for key in keys if kind is None or key[0] == kind]:
+                self._remove((owner, key))
+                self._invalidations += 1
+
+    def _remove(self, full_key: tuple) -> None:
+        found = self._entries.pop(full_key, None)
+        if found is None:
+            return
+        self._size -= found[1]
+        owner, key = full_key
+        keys = self._owners[owner]
+        keys.discard(key)
+        if not keys:
+            del self._owners[owner]
+
+    def stats(self) -> "dict[str, int]":
+        """Compteurs du cache : succès, échecs, évictions, taille, etc."""
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses,
+                    "evictions": self._evictions,
+                    "invalidations": self._invalidations,
+                    "entries": len(self._entries), "bytes": self._size,
+                    "max_bytes": self._max_bytes}
+
+    def __len__(self) -> int:
+        return len(self._entries)
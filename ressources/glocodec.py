@@ -0,0 +1,266 @@
+"""\
+Module fournissant les formats de sérialisation des GloMessage.
+
+Le format JSON est toujours disponible et sert de repli. Le format
+binaire `glo-binary` est un encodage compact construit avec struct,
+et `msgpack` est offert si la bibliothèque optionnelle est installée.
+Le client et le serveur choisissent le format avec l'entête HELLO.
+"""
+import itertools
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:  # dépendance optionnelle
+    msgpack = None
+
+import gloutils
+
+# Clés de dictionnaire encodées sur un octet par glo-binary. L'ordre fait
+# partie du protocole : on ne fait qu'ajouter de nouvelles clés à la fin.
+INTERNED_KEYS = ("header", "payload", "error_message", "username",
+                 "password", "sender", "destination", "subject", "date",
+                 "content", "email_list", "choice", "count", "size",
+                 "offset", "limit", "total", "codecs", "codec",
+                 "request_id", "metrics", "token", "data", "compression",
+                 "text", "since", "until", "choices", "first", "last",
+                 "emails", "cursor", "wait", "cc", "bcc", "recipients",
+                 "address", "status")
+_KEY_IDS = {key: i for i, key in enumerate(INTERNED_KEYS)}
+
+_NONE, _FALSE, _TRUE = 0, 1, 2
+_INT8, _INT32, _INT64, _FLOAT = 3, 4, 5, 6
+_STR8, _STR32, _LIST, _DICT, _KEY = 7, 8, 9, 10, 11
+_STR_LIST = 12
+
+_B = struct.Struct("!B")
+_BB = struct.Struct("!BB")
+_BI = struct.Struct("!BI")
+_Bb = struct.Struct("!Bb")
+_Bi = struct.Struct("!Bi")
+_Bq = struct.Struct("!Bq")
+_Bd = struct.Struct("!Bd")
+_I = struct.Struct("!I")
+
+
+class CodecError(ValueError):
+    """Erreur levée quand une trame ne peut être encodée ou décodée."""
+
+
+def _checked(message) -> gloutils.GloMessage:
+    """
+    Retourne `message` s'il a la forme d'un GloMessage : un dictionnaire
+    dont l'entête est un entier. Lève une CodecError sinon.
+    """
+    if not isinstance(message, dict) or not isinstance(message.get("header"), int):
+        raise CodecError("Frame is not a message.")
+    return message
+
+
+class JsonCodec:
+    """Format JSON d'origine, toujours disponible."""
+    name = "json"
+
+    @staticmethod
+    def encode(message: gloutils.GloMessage) -> bytes:
+        return json.dumps(message).encode('utf-8')
+
+    @staticmethod
+    def decode(data: bytes) -> gloutils.GloMessage:
+        try:
+            message = json.loads(data)
+        except (json.JSONDecodeError, UnicodeDecodeError, RecursionError) as ex:
+            raise CodecError("Invalid JSON frame.") from ex
+        return _checked(message)
+
+
+class BinaryCodec:
+    """
+    Format binaire `glo-binary`.
+
+    Chaque valeur est précédée d'une étiquette d'un octet. Les chaînes
+    ne sont jamais échappées, les entiers (dont l'entête Headers) tiennent
+    souvent sur un octet et les clés connues (INTERNED_KEYS) sont
+    remplacées par leur indice. Les listes de chaînes (listes de sujets)
+    sont écrites d'un bloc : les longueurs, puis les chaînes concaténées.
+    """
+    name = "glo-binary"
+
+    @classmethod
+    def encode(cls, message: gloutils.GloMessage) -> bytes:
+        out = bytearray()
+        cls._encode_value(message, out)
+        return bytes(out)
+
+    @classmethod
+    def decode(cls, data: bytes) -> gloutils.GloMessage:
+        try:
+            value, end = cls._decode_value(memoryview(data), 0)
+        except (struct.error, IndexError, UnicodeDecodeError, TypeError,
+                RecursionError) as ex:
+            # TypeError : clé de dictionnaire non hachable (une liste).
+            raise CodecError("Invalid glo-binary frame.") from ex
+        if end != len(data):
+            raise CodecError("Trailing data in glo-binary frame.")
+        return _checked(value)
+
+    @classmethod
+    def _encode_value(cls, value, out: bytearray) -> None:
+        if value is None:
+            out += _B.pack(_NONE)
+        elif value is True:
+            out += _B.pack(_TRUE)
+        elif value is False:
+            out += _B.pack(_FALSE)
+        elif isinstance(value, int):
+            if -128 <= value < 128:
+                out += _Bb.pack(_INT8, value)
+            elif -2**31 <= value < 2**31:
+                out += _Bi.pack(_INT32, value)
+            elif -2**63 <= value < 2**63:
+                out += _Bq.pack(_INT64, value)
+            else:
+                raise CodecError(f"Integer out of range: {value}")
+        elif isinstance(value, float):
+            out += _Bd.pack(_FLOAT, value)
+        elif isinstance(value, str):
+            cls._encode_str(value, out)
+        elif isinstance(value, (list, tuple)):
+            if value and all(type(item) is str for item in value):
+                cls._encode_str_list(value, out)
+                return
+            out += _BI.pack(_LIST, len(value))
+            for item in value:
+                cls._encode_value(item, out)
+        elif isinstance(value, dict):
+            out += _BI.pack(_DICT, len(value))
+            for key, item in value.items():
+                key_id = _KEY_IDS.get(key)
+                if key_id is not None:
+                    out += _BB.pack(_KEY, key_id)
+                elif isinstance(key, str):
+                    cls._encode_str(key, out)
+                else:
+                    raise CodecError(f"Unsupported key type: {type(key)}")
+                cls._encode_value(item, out)
+        else:
+            raise CodecError(f"Unsupported type: {type(value)}")
+
+    @staticmethod
+    def _encode_str(value: str, out: bytearray) -> None:
+        data = value.encode('utf-8')
+        if len(data) < 256:
+            out += _BB.pack(_STR8, len(data))
+        else:
+            out += _BI.pack(_STR32, len(data))
+        out += data
+
+    @staticmethod
+    def _encode_str_list(value: "list[str]", out: bytearray) -> None:
+        encoded = [item.encode('utf-8') for item in value]
+        out += _BI.pack(_STR_LIST, len(encoded))
+        out += struct.pack(f"!{len(encoded)}I", *map(len, encoded))
+        out += b"".join(encoded)
+
+    @staticmethod
+    def _decode_str_list(data: memoryview, pos: int):
+        count, = _I.unpack_from(data, pos)
+        pos += 4
+        lengths = struct.unpack_from(f"!{count}I", data, pos)
+        pos += 4 * count
+        bounds = list(itertools.accumulate(lengths, initial=0))
+        blob = bytes(data[pos:pos + bounds[-1]])
+        text = blob.decode('utf-8')
+        if len(text) != len(blob):
+            # Caractères multi-octets : les bornes ne valent que pour les octets.
+            text = None
+        result = [text[start:end] if text is not None
+                  else blob[start:end].decode('utf-8')
+                  for start, end in zip(bounds, bounds[1:])]
+        return result, pos + bounds[-1]
+
+    @classmethod
+    def _decode_value(cls, data: memoryview, pos: int):
+        tag = data[pos]
+        pos += 1
+        if tag == _STR8:
+            end = pos + 1 + data[pos]
+            return str(data[pos + 1:end], 'utf-8'), end
+        if tag == _STR32:
+            length, = _I.unpack_from(data, pos)
+            end = pos + 4 + length
+            return str(data[pos + 4:end], 'utf-8'), end
+        if tag == _INT8:
+            return _Bb.unpack_from(data, pos - 1)[1], pos + 1
+        if tag == _DICT:
+            count, = _I.unpack_from(data, pos)
+            pos += 4
+            result = {}
+            for _ in range(count):
+                if data[pos] == _KEY:
+                    key = INTERNED_KEYS[data[pos + 1]]
+                    pos += 2
+                else:
+                    key, pos = cls._decode_value(data, pos)
+                result[key], pos = cls._decode_value(data, pos)
+            return result, pos
+        if tag == _LIST:
+            count, = _I.unpack_from(data, pos)
+            pos += 4
+            result = []
+            for _ in range(count):
+                item, pos = cls._decode_value(data, pos)
+                result.append(item)
+            return result, pos
+        if tag == _STR_LIST:
+            return cls._decode_str_list(data, pos)
+        if tag == _NONE:
+            return None, pos
+        if tag == _TRUE:
+            return True, pos
+        if tag == _FALSE:
+            return False, pos
+        if tag == _INT32:
+            return _Bi.unpack_from(data, pos - 1)[1], pos + 4
+        if tag == _INT64:
+            return _Bq.unpack_from(data, pos - 1)[1], pos + 8
+        if tag == _FLOAT:
+            return _Bd.unpack_from(data, pos - 1)[1], pos + 8
+        raise CodecError(f"Unknown tag: {tag}")
+
+
+class MsgpackCodec:
+    """Format msgpack, disponible si la bibliothèque est installée."""
+    name = "msgpack"
+
+    @staticmethod
+    def encode(message: gloutils.GloMessage) -> bytes:
+        return msgpack.packb(message)
+
+    @staticmethod
+    def decode(data: bytes) -> gloutils.GloMessage:
+        try:
+            message = msgpack.unpackb(data)
+        except (ValueError, TypeError, RecursionError, msgpack.ExtraData) as ex:
+            raise CodecError("Invalid msgpack frame.") from ex
+        return _checked(message)
+
+
+DEFAULT_CODEC = JsonCodec
+
+# Formats disponibles, du plus préféré au moins préféré.
+CODECS = {codec.name: codec
+          for codec in (MsgpackCodec, BinaryCodec, JsonCodec)
+          if codec is not MsgpackCodec or msgpack is not None}
+
+
+def choose(offered: "list[str]"):
+    """
+    Retourne le premier format de la liste `offered` qui est disponible,
+    ou DEFAULT_CODEC si aucun ne l'est.
+    """
+    for name in offered:
+        if name in CODECS:
+            return CODECS[name]
+    return DEFAULT_CODEC
@@ -0,0 +1,1004 @@
+"""\
+Module fournissant le moteur de stockage des boîtes de courriels.
+
+Chaque boîte est composée de fichiers segments (`*.seg`) auxquels les
+courriels sont ajoutés à la suite, et d'un index persistant qui donne
+pour chaque courriel son segment, sa position et sa taille. Le corps
+d'un courriel reçu par morceaux est gardé dans son propre fichier du
+sous-dossier `BODY_DIRNAME`.
+
+Plusieurs processus serveurs peuvent partager le même dossier (option
+`shared`) : chaque boîte est alors protégée par un verrou de fichier
+(`LOCK_FILENAME`), et chaque processus rattrape dans l'index les
+écritures des autres.
+"""
+import bisect
+import collections
+import contextlib
+import io
+import json
+import os
+import pathlib
+import shutil
+import threading
+import time
+import uuid
+from typing import Container, NotRequired, TypedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows : un seul processus, verrous de fils seulement
+    fcntl = None
+
+try:
+    import resource
+except ImportError:  # Windows : pas de limite de descripteurs à consulter
+    resource = None
+
+import gloutils
+
+SEGMENT_SUFFIX = ".seg"
+SEGMENT_MAX_SIZE = 16 * 1024 * 1024
+SYNC_INTERVAL = 0.05
+COMPACTION_INTERVAL = 5.0
+COMPACTION_RATIO = 0.5
+RECONCILE_INTERVAL = 60.0
+# Nombre maximal de boîtes dont les fichiers restent ouverts et l'index
+# chargé ; au-delà, les moins récemment utilisées sont libérées
+# (`Mailbox.release`). Voir `default_max_open`.
+MAX_OPEN_MAILBOXES = 256
+STORE_FORMAT_FILENAME = "FORMAT"
+STORE_FORMAT = "segments-1"
+BODY_DIRNAME = "bodies"
+INCOMING_PREFIX = ".incoming-"
+LOCK_FILENAME = ".lock"
+
+
+class IndexEntry(TypedDict, total=True):
+    """
+    Entrée de l'index d'une boîte de courriels.
+
+    `number` est attribué à la livraison et n'est jamais réutilisé.
+    `body_size` n'est présent que si le courriel a un corps séparé.
+    """
+    number: int
+    sender: str
+    subject: str
+    date: str
+    filename: str
+    offset: int
+    size: int
+    body_size: NotRequired[int]
+
+
+def email_size(entry: IndexEntry) -> int:
+    """Taille d'un courriel : enregistrement et corps séparé."""
+    return entry["size"] + entry.get("body_size", 0)
+
+
+@contextlib.contextmanager
+def file_lock(path: pathlib.Path):
+    """Verrou exclusif partagé entre processus, sur le fichier `path`."""
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def default_max_open() -> int:
+    """
+    Nombre de boîtes à garder ouvertes : MAX_OPEN_MAILBOXES, sans
+    dépasser le huitième de la limite de descripteurs du processus. Une
+    boîte en garde jusqu'à trois ouverts (segment, index, verrou) : le
+    reste est laissé aux connexions.
+    """
+    if resource is None:
+        return MAX_OPEN_MAILBOXES
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if limit == resource.RLIM_INFINITY:
+        return MAX_OPEN_MAILBOXES
+    return max(min(MAX_OPEN_MAILBOXES, limit // 8), 1)
+
+
+def link_body(source: pathlib.Path, target: pathlib.Path) -> None:
+    """
+    Donne au corps `source` le nom supplémentaire `target` : un lien
+    physique, qui partage le même fichier sur disque, ou une copie si le
+    système de fichiers ne les permet pas.
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def remove_incoming(directory: pathlib.Path) -> None:
+    """
+    Supprime les corps reçus en partie dans `directory` (arrêt brutal),
+    sauf ceux qu'un `BodyWriter` d'un autre processus écrit encore.
+    """
+    for path in directory.glob(f"{INCOMING_PREFIX}*"):
+        try:
+            with open(path, 'rb') as incoming:
+                if fcntl is not None:
+                    fcntl.flock(incoming, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                path.unlink()
+        except OSError:  # verrou déjà pris ou fichier déjà renommé
+            pass
+
+
+class BodyWriter:
+    """
+    Corps de courriel reçu par morceaux, écrit au fur et à mesure dans un
+    fichier temporaire de `directory`. Le fichier est ensuite renommé par
+    `Mailbox.deliver` (ou `RelayQueue.enqueue`), ou supprimé par `abort`.
+    Il reste verrouillé tant qu'il est ouvert, pour que `remove_incoming`
+    ne le supprime pas depuis un autre processus.
+    """
+
+    def __init__(self, directory: pathlib.Path) -> None:
+        directory.mkdir(exist_ok=True)
+        self.path = directory / f"{INCOMING_PREFIX}{uuid.uuid4().hex}"
+        self._file = open(self.path, 'wb')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        self.size = 0
+
+    def write(self, text: str) -> None:
+        data = text.encode('utf-8')
+        self._file.write(data)
+        self.size += len(data)
+
+    def close(self) -> None:
+        """Écrit le corps sur disque ; il peut ensuite être renommé."""
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def abort(self) -> None:
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+
+class Mailbox:
+    """
+    Boîte de courriels d'un utilisateur.
+
+    Une livraison ajoute un enregistrement JSON (une ligne) au segment
+    actif et une ligne à l'index (`MAILBOX_INDEX_FILENAME`). Une
+    suppression ajoute une pierre tombale à l'index ; l'espace est
+    récupéré par `compact`. Les écritures sont vidées vers le système
+    à chaque livraison, mais `fsync` n'est appelé que par `sync`, par
+    lots.
+
+    Le nombre de courriels et leur taille totale sont tenus à jour à
+    chaque livraison et suppression, et écrits par `sync` dans le fichier
+    `MAILBOX_STATS_FILENAME` avec la taille de l'index correspondante :
+    `stats` peut ainsi répondre sans charger l'index tant que celui-ci
+    n'a pas changé depuis. `reconcile` corrige une éventuelle dérive.
+
+    Un courriel livré avec un `BodyWriter` n'a pas de `content` dans son
+    enregistrement, mais un fichier `BODY_DIRNAME/<number>` : `open_email`
+    permet alors de le relire par morceaux. Un corps livré à plusieurs
+    boîtes est un seul fichier, lié dans chacune : il n'est libéré
+    qu'avec son dernier lien.
+
+    L'index est chargé une seule fois en mémoire. Les enregistrements
+    présents dans les segments mais absents de l'index (arrêt brutal
+    entre les deux écritures) sont récupérés au chargement, et l'index
+    est reconstruit à partir des segments s'il est absent.
+
+    Les méthodes peuvent être appelées depuis plusieurs fils : elles
+    sont protégées par `_locked`. Si `shared` est vrai, d'autres
+    processus peuvent aussi utiliser la boîte : `_locked` prend alors
+    en plus un verrou de fichier, puis applique à l'index en mémoire les
+    lignes ajoutées à l'index par les autres processus (`_follow`), ou
+    le recharge s'il a été réécrit.
+
+    Si `on_open` est donné, il est appelé avec la boîte chaque fois
+    qu'elle charge son index ou ouvre un fichier qu'elle garde ouvert
+    (segment actif, index, verrou), sous son verrou : `MailStore` s'en
+    sert pour savoir quelles boîtes entretenir et libérer.
+    """
+
+    def __init__(self, path: pathlib.Path, shared: bool = False,
+                 on_open=None) -> None:
+        self._on_open = on_open
+        self._lock = threading.RLock()
+        self._shared = shared and fcntl is not None
+        self._lock_file = None
+        self._lock_depth = 0
+        self._index_inode = None
+        self._index_offset = 0
+        self._stats_index_size = None
+        self._path = path
+        self._index_path = path / gloutils.MAILBOX_INDEX_FILENAME
+        self._stats_path = path / gloutils.MAILBOX_STATS_FILENAME
+        self._entries: "list[IndexEntry] | None" = None
+        self._count: "int | None" = None
+        self._size: "int | None" = None
+        self._stats_dirty = False
+        self._next_number = 1
+        self._segment_sizes = {}
+        self._dead_bytes = {}
+        self._segment_name = None
+        self._segment_file = None
+        self._index_file = None
+        self._dirty = False
+
+    @property
+    def name(self) -> str:
+        """Nom du dossier de la boîte (celui de son utilisateur)."""
+        return self._path.name
+
+    def _locked(self):
+        """
+        Retourne le verrou à prendre pour toute opération : `_lock` seul,
+        ou aussi le verrou de fichier pour une boîte partagée.
+        """
+        return self._file_locked() if self._shared else self._lock
+
+    @contextlib.contextmanager
+    def _file_locked(self):
+        """
+        Prend `_lock` et, au premier niveau d'imbrication, le verrou de
+        fichier de la boîte, puis rattrape les écritures des autres
+        processus.
+        """
+        with self._lock:
+            if self._lock_depth == 0:
+                if self._lock_file is None:
+                    self._lock_file = open(self._path / LOCK_FILENAME, 'a')
+                    self._opened()
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1 and self._entries is not None:
+                    self._follow()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _opened(self) -> None:
+        if self._on_open is not None:
+            self._on_open(self)
+
+    def _segment_names(self) -> "list[str]":
+        return sorted(f.name for f in self._path.iterdir()
+                      if f.name.endswith(SEGMENT_SUFFIX))
+
+    def _read_index(self, start: int = 0) -> "list[dict]":
+        """
+        Lit les lignes complètes de l'index à partir de l'octet `start`,
+        et retient l'inode du fichier et la position atteinte pour `_follow`.
+        """
+        records = []
+        self._index_inode, self._index_offset = None, 0
+        try:
+            with open(self._index_path, 'rb') as index_file:
+                self._index_inode = os.fstat(index_file.fileno()).st_ino
+                index_file.seek(start)
+                offset = start
+                for line in index_file:
+                    if not line.endswith(b"\n"):
+                        break  # ligne incomplète après un arrêt brutal
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                    offset += len(line)
+                self._index_offset = offset
+        except FileNotFoundError:
+            pass
+        return records
+
+    def _follow(self) -> None:
+        """
+        Applique les livraisons et suppressions ajoutées à l'index par un
+        autre processus depuis la dernière lecture, ou recharge l'index
+        s'il a été remplacé (compactage).
+        """
+        try:
+            stat = self._index_path.stat()
+        except FileNotFoundError:
+            stat = None
+        if stat is None or stat.st_ino != self._index_inode:
+            self._load()
+            return
+        if stat.st_size == self._index_offset:
+            return
+        for record in self._read_index(self._index_offset):
+            if "deleted" in record:
+                self._remove_entry(record["deleted"])
+            elif "number" in record:
+                self._add_entry(record)
+
+    def _add_entry(self, entry: IndexEntry) -> None:
+        """Ajoute à l'index en mémoire un courriel écrit dans un segment."""
+        name = entry["filename"]
+        end = entry["offset"] + entry["size"]
+        self._entries.append(entry)
+        self._segment_sizes[name] = max(self._segment_sizes.get(name, 0), end)
+        self._dead_bytes.setdefault(name, 0)
+        self._next_number = max(self._next_number, entry["number"] + 1)
+        self._count += 1
+        self._size += email_size(entry)
+
+    def _remove_entry(self, number: int) -> None:
+        """Retire de l'index en mémoire le courriel dont le numéro est `number`."""
+        position = bisect.bisect_left(self._entries, number,
+                                      key=lambda entry: entry["number"])
+        if (position == len(self._entries)
+                or self._entries[position]["number"] != number):
+            return
+        entry = self._entries.pop(position)
+        self._dead_bytes[entry["filename"]] = (
+            self._dead_bytes.get(entry["filename"], 0) + entry["size"])
+        self._count -= 1
+        self._size -= email_size(entry)
+
+    @staticmethod
+    def _make_entry(number: int, email: gloutils.EmailContentPayload,
+                    filename: str, offset: int, size: int) -> IndexEntry:
+        return IndexEntry(number=number, sender=email["sender"],
+                          subject=email["subject"], date=email["date"],
+                          filename=filename, offset=offset, size=size)
+
+    def _scan_segment(self, name: str, start: int) -> "list[IndexEntry]":
+        """
+        Relit les enregistrements d'un segment à partir de `start` et
+        tronque un éventuel enregistrement incomplet en fin de fichier.
+        """
+        entries = []
+        path = self._path / name
+        with open(path, 'rb') as segment:
+            segment.seek(start)
+            offset = start
+            for line in segment:
+                try:
+                    record = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                entry = self._make_entry(record["number"], record["email"],
+                                         name, offset, len(line))
+                if record["email"].get("body"):
+                    body_path = self._body_path(record["number"])
+                    entry["body_size"] = (body_path.stat().st_size
+                                          if body_path.exists() else 0)
+                entries.append(entry)
+                offset += len(line)
+        if offset < path.stat().st_size:
+            os.truncate(path, offset)
+        return entries
+
+    def _load(self) -> None:
+        """Charge l'index et récupère les enregistrements non indexés."""
+        if self._index_file is not None:
+            # L'index a pu être remplacé par un autre processus.
+            self._index_file.close()
+            self._index_file = None
+        entries = {}
+        ends = {}
+        deleted = set()
+        next_number = 1
+        records = self._read_index()
+        if (self._index_inode is not None
+                and self._index_path.stat().st_size > self._index_offset):
+            # Ligne incomplète après un arrêt brutal : on la retire pour
+            # que les lignes suivantes ne s'ajoutent pas à sa suite.
+            os.truncate(self._index_path, self._index_offset)
+        for record in records:
+            if "next_number" in record:
+                next_number = record["next_number"]
+                ends.update(record["segments"])
+                continue
+            if "deleted" in record:
+                deleted.add(record["deleted"])
+                continue
+            entries[record["number"]] = record
+            end = record["offset"] + record["size"]
+            ends[record["filename"]] = max(ends.get(record["filename"], 0), end)
+
+        recovered = []
+        for name in self._segment_names():
+            size = (self._path / name).stat().st_size
+            if size > ends.get(name, 0):
+                recovered += self._scan_segment(name, ends.get(name, 0))
+            elif size < ends.get(name, 0):
+                # Segment tronqué : les entrées au-delà sont perdues.
+                entries = {number: entry for number, entry in entries.items()
+                           if entry["filename"] != name
+                           or entry["offset"] + entry["size"] <= size}
+        for entry in recovered:
+            entries[entry["number"]] = entry
+
+        self._segment_sizes = {name: (self._path / name).stat().st_size
+                               for name in self._segment_names()}
+        self._dead_bytes = dict.fromkeys(self._segment_sizes, 0)
+        for number in deleted:
+            entry = entries.pop(number, None)
+            if entry is not None and entry["filename"] in self._dead_bytes:
+                self._dead_bytes[entry["filename"]] += entry["size"]
+
+        self._entries = sorted((entry for entry in entries.values()
+                                if entry["filename"] in self._segment_sizes),
+                               key=lambda entry: entry["number"])
+        all_numbers = list(entries) + list(deleted)
+        self._next_number = max(max(all_numbers, default=0) + 1, next_number)
+
+        if recovered or not self._index_path.exists():
+            self._rewrite_index()
+        self._remove_orphan_bodies()
+        self.reconcile()
+        self._opened()
+
+    def _body_path(self, number: int) -> pathlib.Path:
+        return self._path / BODY_DIRNAME / str(number)
+
+    def _remove_orphan_bodies(self) -> None:
+        """
+        Supprime les corps reçus en partie qui ne sont plus en cours
+        d'écriture, et ceux dont le courriel n'a jamais été indexé ou a
+        été supprimé (arrêt brutal). Un numéro resté libre après un échec
+        de livraison peut avoir été réattribué à un courriel sans corps
+        séparé : seuls les corps référencés par l'index sont gardés.
+        """
+        directory = self._path / BODY_DIRNAME
+        try:
+            names = [f.name for f in directory.iterdir()
+                     if not f.name.startswith(INCOMING_PREFIX)]
+        except FileNotFoundError:
+            return
+        remove_incoming(directory)
+        live = {str(entry["number"]) for entry in self._entries
+                if "body_size" in entry}
+        for name in names:
+            if name not in live:
+                (self._path / BODY_DIRNAME / name).unlink(missing_ok=True)
+
+    def _rewrite_index(self) -> None:
+        """
+        Réécrit l'index (sans pierres tombales) de façon atomique. La
+        première ligne conserve le prochain numéro à attribuer et la taille
+        des segments, pour ne pas confondre les courriels supprimés avec
+        des enregistrements à récupérer.
+        """
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        tmp_path = self._index_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as index_file:
+            header = {"next_number": self._next_number,
+                      "segments": self._segment_sizes}
+            index_file.write(json.dumps(header) + "\n")
+            for entry in self._entries:
+                index_file.write(json.dumps(entry) + "\n")
+            index_file.flush()
+            os.fsync(index_file.fileno())
+            stat = os.fstat(index_file.fileno())
+        tmp_path.replace(self._index_path)
+        self._index_inode, self._index_offset = stat.st_ino, stat.st_size
+        self._stats_dirty = True
+
+    def _read_stats(self) -> bool:
+        """
+        Charge les compteurs persistés s'ils correspondent encore à l'index,
+        qu'un autre processus a pu modifier depuis la dernière lecture.
+        """
+        try:
+            index_size = self._index_path.stat().st_size
+            if index_size == self._stats_index_size:
+                return True
+            stats = json.loads(self._stats_path.read_text())
+            if stats["index_size"] != index_size:
+                return False
+            self._count, self._size = stats["count"], stats["size"]
+            self._stats_index_size = index_size
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def stats(self) -> "tuple[int, int]":
+        """Retourne le nombre de courriels et leur taille totale en octets."""
+        with self._locked():
+            if self._entries is None and not self._read_stats():
+                self.entries()
+            return self._count, self._size
+
+    def reconcile(self) -> bool:
+        """
+        Recalcule les compteurs à partir de l'index chargé et les corrige
+        s'ils ont dérivé. Retourne True si une correction a été faite.
+        """
+        with self._locked():
+            if self._entries is None:
+                return False
+            count = len(self._entries)
+            size = sum(email_size(entry) for entry in self._entries)
+            if (count, size) == (self._count, self._size):
+                return False
+            self._count, self._size = count, size
+            self._stats_dirty = True
+            return True
+
+    def entries(self) -> "list[IndexEntry]":
+        """Retourne les entrées de l'index, de la plus ancienne à la plus récente."""
+        with self._locked():
+            if self._entries is None:
+                self._load()
+            return self._entries
+
+    def __len__(self) -> int:
+        return len(self.entries())
+
+    def newest(self, offset: int, limit: int) -> "list[IndexEntry]":
+        """
+        Retourne au plus `limit` entrées, de la plus récente à la plus
+        ancienne, en sautant les `offset` plus récentes.
+        """
+        with self._locked():
+            entries = self.entries()
+            stop = max(len(entries) - offset, 0)
+            start = max(stop - limit, 0)
+            return entries[start:stop][::-1]
+
+    def _active_segment(self, record_size: int):
+        """Retourne le segment ouvert en ajout, en changeant de segment au besoin."""
+        names = list(self._segment_sizes)
+        name = max(names) if names else None
+        if name is None or (self._segment_sizes[name] > 0 and
+                            self._segment_sizes[name] + record_size > SEGMENT_MAX_SIZE):
+            number = int(name.removesuffix(SEGMENT_SUFFIX)) + 1 if name else 1
+            name = f"{number:08d}{SEGMENT_SUFFIX}"
+            self._segment_sizes[name] = 0
+            self._dead_bytes[name] = 0
+        if self._segment_name != name:
+            if self._segment_file is not None:
+                self._segment_file.flush()
+                os.fsync(self._segment_file.fileno())
+                self._segment_file.close()
+            self._segment_file = open(self._path / name, 'ab')
+            self._opened()
+            self._segment_name = name
+        return name, self._segment_file
+
+    def open_body(self) -> BodyWriter:
+        """Prépare la réception par morceaux d'un corps de courriel."""
+        return BodyWriter(self._path / BODY_DIRNAME)
+
+    def deliver(self, email: gloutils.EmailContentPayload,
+                body: "BodyWriter | None" = None,
+                shared_body: bool = False) -> IndexEntry:
+        """
+        Ajoute le courriel au segment actif et à l'index.
+
+        Si `body` est donné, `email` n'a pas de `content` : le corps reçu
+        par morceaux est gardé dans son propre fichier. Si `shared_body`
+        est vrai, ce fichier est lié (`link_body`) plutôt que renommé, pour
+        que le même corps soit livré à d'autres boîtes ; l'appelant le
+        supprime ensuite avec `BodyWriter.abort`.
+        """
+        if body is not None:
+            email = dict(email, body=True)
+        with self._locked():
+            self.entries()
+            number = self._next_number
+            if body is not None:
+                # Fermé et renommé sous le verrou, avant l'écriture de
+                # l'enregistrement : un corps sans enregistrement est
+                # supprimé au prochain chargement.
+                body.close()
+                # Le corps a pu être reçu ailleurs (file de relais).
+                self._body_path(number).parent.mkdir(exist_ok=True)
+                if shared_body:
+                    link_body(body.path, self._body_path(number))
+                else:
+                    os.replace(body.path, self._body_path(number))
+            record = json.dumps({"number": number, "email": email}).encode('utf-8') + b"\n"
+
+            try:
+                name, segment = self._active_segment(len(record))
+            except OSError:
+                if body is not None:
+                    self._body_path(number).unlink(missing_ok=True)
+                raise
+            offset = self._segment_sizes[name]
+            if self._shared:
+                # Taille réelle : un autre processus a pu y laisser un
+                # enregistrement non indexé (arrêt brutal).
+                offset = os.fstat(segment.fileno()).st_size
+            entry = self._make_entry(number, email, name, offset, len(record))
+            if body is not None:
+                entry["body_size"] = body.size
+            try:
+                segment.write(record)
+                segment.flush()
+                self._append_index(entry)
+            except OSError:
+                # Disque plein, etc. : ni enregistrement à moitié écrit, ni
+                # enregistrement sans ligne d'index dont le numéro serait
+                # réattribué. Le numéro reste libre.
+                self._segment_name = self._segment_file = None
+                self._discard_tail(segment, self._path / name, offset)
+                if body is not None:
+                    self._body_path(number).unlink(missing_ok=True)
+                raise
+            self._segment_sizes[name] = offset + len(record)
+            self._add_entry(entry)
+            return entry
+
+    @staticmethod
+    def _discard_tail(handle, path: pathlib.Path, size: int) -> None:
+        """
+        Ferme `handle` après un échec d'écriture et ramène le fichier
+        `path` à `size` octets, sa taille avant l'écriture.
+        """
+        try:
+            handle.close()
+        except OSError:
+            pass  # le tampon non écrit est abandonné
+        os.truncate(path, size)
+
+    def _append_index(self, record: dict) -> None:
+        """
+        Ajoute une ligne à l'index. En cas d'échec, l'index est ramené à
+        sa taille précédente : il ne garde jamais de ligne à moitié écrite.
+        """
+        if self._index_file is None:
+            self._index_file = open(self._index_path, 'ab')
+            self._opened()
+        line = json.dumps(record).encode('utf-8') + b"\n"
+        size = self._index_offset  # l'index a été lu ou écrit jusqu'au bout
+        try:
+            self._index_file.write(line)
+            self._index_file.flush()
+        except OSError:
+            index_file, self._index_file = self._index_file, None
+            self._discard_tail(index_file, self._index_path, size)
+            raise
+        # Rien d'autre n'a pu être ajouté : l'index était verrouillé.
+        self._index_offset = size + len(line)
+        self._dirty = True
+        self._stats_dirty = True
+
+    def delete(self, number: int) -> None:
+        """
+        Supprime le courriel numéro `number` (1 étant le plus ancien).
+
+        Lève une IndexError si le courriel n'existe pas.
+        """
+        with self._locked():
+            if number < 1:
+                raise IndexError(number)
+            entries = self.entries()
+            entry = entries[number - 1]
+            self._append_index({"deleted": entry["number"]})
+            del entries[number - 1]
+            self._dead_bytes[entry["filename"]] += entry["size"]
+            self._count -= 1
+            self._size -= email_size(entry)
+            if "body_size" in entry:
+                self._body_path(entry["number"]).unlink(missing_ok=True)
+
+    def read(self, number: int) -> gloutils.EmailContentPayload:
+        """
+        Lit le courriel numéro `number` (1 étant le plus ancien), corps
+        compris.
+
+        Lève une IndexError si le courriel n'existe pas.
+        """
+        email, body = self.open_email(number)
+        with body:
+            email["content"] = body.read()
+        return email
+
+    def open_email(self, number: int) -> "tuple[dict, io.TextIOBase]":
+        """
+        Lit l'en-tête du courriel numéro `number` (1 étant le plus ancien)
+        et ouvre son corps en lecture, pour le transmettre par morceaux.
+        Le corps doit être fermé par l'appelant.
+
+        Lève une IndexError si le courriel n'existe pas.
+        """
+        with self._locked():
+            if number < 1:
+                raise IndexError(number)
+            entry = self.entries()[number - 1]
+            # Les fichiers ouverts restent lisibles même si un compactage
+            # ou une suppression les retire.
+            segment = open(self._path / entry["filename"], 'rb')
+            body = None
+            if "body_size" in entry:
+                body = open(self._body_path(entry["number"]), 'r', encoding='utf-8')
+        with segment:
+            segment.seek(entry["offset"])
+            email = json.loads(segment.read(entry["size"]))["email"]
+        if body is None:
+            body = io.StringIO(email.pop("content"))
+        email.pop("body", None)
+        return email, body
+
+    def scan(self, after: int = 0, numbers: "Container[int] | None" = None):
+        """
+        Parcourt les courriels dont le numéro est supérieur à `after` (et
+        parmi `numbers` s'il est donné), du plus ancien au plus récent,
+        et produit pour chacun son entrée, son en-tête (comme
+        `open_email`) et son corps ouvert en lecture (fermé au courriel
+        suivant).
+
+        Chaque segment n'est ouvert qu'une fois et lu dans l'ordre, sans
+        garder le verrou de la boîte ; un courriel supprimé pendant le
+        parcours peut être sauté.
+        """
+        with contextlib.ExitStack() as stack:
+            with self._locked():
+                entries = self.entries()
+                start = bisect.bisect_right(entries, after,
+                                            key=lambda entry: entry["number"])
+                # Copies : un compactage modifie les entrées en place.
+                entries = [dict(entry) for entry in entries[start:]
+                           if numbers is None or entry["number"] in numbers]
+                segments = {}
+                for entry in entries:
+                    if entry["filename"] not in segments:
+                        segments[entry["filename"]] = stack.enter_context(
+                            open(self._path / entry["filename"], 'rb'))
+            for entry in entries:
+                segment = segments[entry["filename"]]
+                segment.seek(entry["offset"])
+                email = json.loads(segment.read(entry["size"]))["email"]
+                if "body_size" in entry:
+                    try:
+                        body = open(self._body_path(entry["number"]), 'r',
+                                    encoding='utf-8')
+                    except FileNotFoundError:
+                        continue
+                else:
+                    body = io.StringIO(email.pop("content"))
+                email.pop("body", None)
+                with body:
+                    yield entry, email, body
+
+    def sync(self) -> None:
+        """
+        Force l'écriture sur disque des livraisons et suppressions récentes,
+        puis des compteurs.
+        """
+        with self._locked():
+            if self._dirty:
+                for handle in (self._segment_file, self._index_file):
+                    if handle is not None:
+                        os.fsync(handle.fileno())
+                self._dirty = False
+            if self._stats_dirty and self._count is not None:
+                stats = {"count": self._count, "size": self._size,
+                         "index_size": self._index_path.stat().st_size}
+                tmp_path = self._stats_path.with_suffix(".tmp")
+                tmp_path.write_text(json.dumps(stats))
+                tmp_path.replace(self._stats_path)
+                self._stats_dirty = False
+
+    def compact(self) -> None:
+        """
+        Réécrit les segments dont au moins `COMPACTION_RATIO` des octets
+        appartiennent à des courriels supprimés, puis réécrit l'index.
+        """
+        with self._locked():
+            if self._entries is None:
+                return
+            active = max(self._segment_sizes, default=None)
+            victims = [name for name, dead in self._dead_bytes.items()
+                       if name != active and dead
+                       and dead >= COMPACTION_RATIO * self._segment_sizes[name]]
+            if not victims:
+                return
+
+            self.sync()
+            for name in victims:
+                moved = [entry for entry in self._entries if entry["filename"] == name]
+                with open(self._path / name, 'rb') as old_segment:
+                    records = []
+                    for entry in moved:
+                        old_segment.seek(entry["offset"])
+                        records.append(old_segment.read(entry["size"]))
+                for entry, record in zip(moved, records):
+                    new_name, segment = self._active_segment(len(record))
+                    entry["offset"] = self._segment_sizes[new_name]
+                    entry["filename"] = new_name
+                    segment.write(record)
+                    self._segment_sizes[new_name] += len(record)
+                if self._segment_file is not None:
+                    self._segment_file.flush()
+                    os.fsync(self._segment_file.fileno())
+
+            self._rewrite_index()
+            for name in victims:
+                (self._path / name).unlink()
+                del self._segment_sizes[name]
+                del self._dead_bytes[name]
+
+    def close(self) -> None:
+        """Écrit les données en attente et ferme les fichiers ouverts."""
+        with self._lock:
+            self.sync()
+            for handle in (self._segment_file, self._index_file, self._lock_file):
+                if handle is not None:
+                    handle.close()
+            self._segment_name = None
+            self._segment_file = None
+            self._index_file = None
+            self._lock_file = None
+
+    def release(self) -> None:
+        """
+        Comme `close`, et oublie en plus l'index en mémoire. La boîte reste
+        utilisable : ses fichiers sont rouverts et son index rechargé au
+        besoin.
+        """
+        with self._lock:
+            # `close` peut encore prendre le verrou de fichier : ce n'est
+            # pas une réouverture à signaler.
+            on_open, self._on_open = self._on_open, None
+            try:
+                self.close()
+            except OSError:
+                self._on_open = on_open
+                self._opened()  # encore ouverte : à libérer plus tard
+                raise
+            self._on_open = on_open
+            self._entries = None
+
+    def migrate_legacy(self) -> None:
+        """
+        Importe l'ancien format (un fichier numéroté par courriel) dans
+        les segments, puis supprime les anciens fichiers.
+        """
+        files = [f for f in self._path.iterdir() if f.name.isdigit()]
+        if not files:
+            return
+        files.sort(key=lambda f: int(f.name))
+        with self._locked():
+            self._index_path.unlink(missing_ok=True)
+            self._entries = None
+            for file in files:
+                self.deliver(json.loads(file.read_bytes()))
+            self.sync()
+            for file in files:
+                file.unlink()
+
+
+class MailStore:
+    """
+    Ensemble des boîtes de courriels du dossier `root`, partagé avec
+    d'autres processus si `shared` est vrai (voir `Mailbox`).
+
+    Un fil d'arrière-plan appelle `sync` sur les boîtes ouvertes toutes
+    les `SYNC_INTERVAL` secondes (fsync par lots) et `compact` toutes les
+    `COMPACTION_INTERVAL` secondes, et `reconcile` toutes les
+    `RECONCILE_INTERVAL` secondes. Les dossiers à l'ancien format sont
+    convertis au premier démarrage.
+
+    Seules les `max_open` boîtes (`default_max_open()` par défaut) les
+    plus récemment utilisées gardent leurs fichiers ouverts et leur index
+    en mémoire (`_open`) : le même fil libère les autres
+    (`Mailbox.release`). Le nombre de descripteurs et le coût de
+    l'entretien ne croissent donc pas avec le nombre de boîtes utilisées
+    depuis le démarrage.
+
+    Si `observe` est donné, il est appelé avec le nom de l'opération
+    d'entretien ("sync", "compact", "reconcile") et sa durée en secondes
+    pour l'ensemble des boîtes. Si `on_release` est donné, il est appelé
+    avec le nom de chaque boîte libérée, pour que l'appelant oublie aussi
+    ce qu'il garde en mémoire pour elle.
+    """
+
+    def __init__(self, root: pathlib.Path,
+                 reserved: "tuple[str, ...]" = (gloutils.SERVER_OUTBOX_DIR,
+                                                gloutils.SERVER_SESSIONS_DIR),
+                 observe=None, shared: bool = False,
+                 max_open: "int | None" = None, on_release=None) -> None:
+        self._root = root
+        self._observe = observe
+        self._on_release = on_release
+        self._shared = shared
+        self._max_open = max(max_open or default_max_open(), 1)
+        self._lock = threading.Lock()
+        self._mailboxes = {}
+        # Boîtes aux fichiers ouverts, de la moins à la plus récemment utilisée.
+        self._open: "collections.OrderedDict[Mailbox, None]" = \
+            collections.OrderedDict()
+        self._migrate(reserved)
+
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._maintain, daemon=True,
+                                        name="glo-store")
+        self._thread.start()
+
+    def _migrate(self, reserved: "tuple[str, ...]") -> None:
+        format_path = self._root / STORE_FORMAT_FILENAME
+        if format_path.exists():
+            return
+        # Un seul des processus qui démarrent ensemble fait la conversion.
+        with file_lock(self._root / LOCK_FILENAME):
+            if format_path.exists():
+                return
+            for path in self._root.iterdir():
+                if path.is_dir() and path.name not in reserved:
+                    Mailbox(path).migrate_legacy()
+            format_path.write_text(STORE_FORMAT)
+
+    def get(self, name: str) -> Mailbox:
+        """Retourne la boîte `name`, créée une seule fois."""
+        with self._lock:
+            if name not in self._mailboxes:
+                self._mailboxes[name] = Mailbox(self._root / name, self._shared,
+                                                on_open=self._track)
+            mailbox = self._mailboxes[name]
+            if mailbox in self._open:
+                self._open.move_to_end(mailbox)
+            return mailbox
+
+    def _track(self, mailbox: Mailbox) -> None:
+        """Appelé quand `mailbox` ouvre un fichier : à entretenir et libérer."""
+        with self._lock:
+            self._open[mailbox] = None
+            self._open.move_to_end(mailbox)
+
+    def _maintain(self) -> None:
+        ticks_per_compaction = max(int(COMPACTION_INTERVAL / SYNC_INTERVAL), 1)
+        ticks_per_reconcile = max(int(RECONCILE_INTERVAL / SYNC_INTERVAL), 1)
+        tick = 0
+        while not self._closed.wait(SYNC_INTERVAL):
+            tick += 1
+            with self._lock:
+                mailboxes = list(self._open)
+                idle = []
+                while len(self._open) > self._max_open:
+                    idle.append(self._open.popitem(last=False)[0])
+            if tick % ticks_per_reconcile == 0:
+                self._run_all("reconcile", mailboxes)
+            if tick % ticks_per_compaction == 0:
+                self._run_all("compact", mailboxes)
+            self._run_all("sync", mailboxes)
+            # Une boîte libérée puis réutilisée revient dans `_open` à la
+            # réouverture de ses fichiers.
+            self._run_all("release", idle)
+            if self._on_release is not None:
+                for mailbox in idle:
+                    self._on_release(mailbox.name)
+
+    def _run_all(self, operation: str, mailboxes: "list[Mailbox]") -> None:
+        """
+        Appelle `operation` sur chaque boîte et mesure la durée totale.
+        Une erreur sur une boîte (disque plein, trop de fichiers ouverts)
+        n'interrompt pas l'entretien : l'opération sera refaite plus tard.
+        """
+        start = time.perf_counter()
+        for mailbox in mailboxes:
+            try:
+                getattr(mailbox, operation)()
+            except OSError:
+                pass
+        if self._observe is not None and mailboxes:
+            self._observe(operation, time.perf_counter() - start)
+
+    def __len__(self) -> int:
+        """Nombre de boîtes ouvertes, chargées en mémoire."""
+        with self._lock:
+            return len(self._open)
+
+    def close(self) -> None:
+        """Arrête le fil d'arrière-plan et ferme toutes les boîtes."""
+        self._closed.set()
+        self._thread.join()
+        # Hors du verrou : une boîte libérée rouvre ses fichiers pour se
+        # fermer, ce qui appelle `_track`.
+        with self._lock:
+            mailboxes = list(self._mailboxes.values())
+        for mailbox in mailboxes:
+            mailbox.close()
@@ -0,0 +1,147 @@
+"""\
+Module fournissant les métriques du serveur : compteurs, jauges et
+histogrammes de latence, exportés au format texte de Prometheus.
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+# Bornes supérieures (secondes) des seaux des histogrammes de latence.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Histogramme à seaux fixes, non cumulés en interne."""
+
+    def __init__(self, buckets: "tuple[float, ...]" = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Registre des métriques du serveur.
+
+    Chaque série est identifiée par un nom et une valeur d'étiquette
+    optionnelle (par exemple l'entête de la requête), dont le nom est
+    donné par `describe`. Les mises à jour ne coûtent qu'une prise de
+    verrou et quelques opérations sur des dictionnaires, ce qui permet
+    de les laisser actives en production.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name: str, kind: str, text: str,
+                 label: str = "label") -> None:
+        """
+        Déclare le type (counter, gauge, histogram), l'aide et le nom
+        d'étiquette d'une série.
+        """
+        self._help[name] = (kind, text, label)
+
+    def inc(self, name: str, label: "str | None" = None, value: float = 1) -> None:
+        key = (name, label)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, label: "str | None" = None) -> None:
+        with self._lock:
+            self._gauges[(name, label)] = value
+
+    def add(self, name: str, value: float, label: "str | None" = None) -> None:
+        key = (name, label)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def observe(self, name: str, value: float, label: "str | None" = None) -> None:
+        key = (name, label)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def time(self, name: str, label: "str | None" = None):
+        """Mesure la durée du bloc dans l'histogramme `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, label)
+
+    def add_collector(self, collector) -> None:
+        """
+        Ajoute une fonction appelée à chaque export, pour mettre à jour
+        des jauges calculées ailleurs (profondeur d'une file, etc.).
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Retourne toutes les séries au format texte de Prometheus."""
+        for collector in self._collectors:
+            collector(self)
+
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: (list(h.counts), h.total, h.count, h.buckets)
+                          for key, h in self._histograms.items()}
+
+        lines = []
+        described = set()
+
+        def header(name: str, default_kind: str) -> None:
+            if name in described:
+                return
+            described.add(name)
+            kind, text, _ = self._help.get(name, (default_kind, name, None))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def labels(name: str, label: "str | None", extra: str = "") -> str:
+            label_name = self._help.get(name, (None, None, "label"))[2]
+            parts = [f'{label_name}="{label}"'] if label is not None else []
+            if extra:
+                parts.append(extra)
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        for (name, label), value in sorted(counters.items(), key=_sort_key):
+            header(name, "counter")
+            lines.append(f"{name}{labels(name, label)} {value}")
+        for (name, label), value in sorted(gauges.items(), key=_sort_key):
+            header(name, "gauge")
+            lines.append(f"{name}{labels(name, label)} {value}")
+        for (name, label), (counts, total, count, buckets) in sorted(
+                histograms.items(), key=_sort_key):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                bucket = labels(name, label, 'le="%s"' % bound)
+                lines.append(f"{name}_bucket{bucket} {cumulative}")
+            bucket = labels(name, label, 'le="+Inf"')
+            lines.append(f"{name}_bucket{bucket} {count}")
+            lines.append(f"{name}_sum{labels(name, label)} {total}")
+            lines.append(f"{name}_count{labels(name, label)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _sort_key(item) -> "tuple[str, str]":
+    (name, label), _ = item
+    return name, label or ""
@@ -0,0 +1,123 @@
+"""\
+Module fournissant le hachage des mots de passe des comptes.
+
+Les empreintes sont salées et dérivées avec scrypt ou PBKDF2, dont le
+coût est réglable. Elles sont stockées sous la forme
+`algorithme$coût$sel$empreinte` (hexadécimal). Les anciennes empreintes
+SHA3-512 sans sel sont encore acceptées, puis remplacées à la connexion
+suivante (voir `needs_rehash`).
+"""
+import collections
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+SALT_SIZE = 16
+# Coût par défaut : log2(N) pour scrypt, nombre d'itérations pour PBKDF2.
+DEFAULT_COSTS = {"scrypt": 14, "pbkdf2": 600_000}
+ALGORITHMS = tuple(DEFAULT_COSTS)
+
+# Paramètres fixes de scrypt (taille de bloc et parallélisme).
+_SCRYPT_R = 8
+_SCRYPT_P = 1
+
+
+class PasswordHasher:
+    """
+    Dérive et vérifie les empreintes de mots de passe avec `algorithm`
+    ("scrypt" ou "pbkdf2") et le coût `cost` (par défaut DEFAULT_COSTS).
+    """
+
+    def __init__(self, algorithm: str = "scrypt",
+                 cost: "int | None" = None) -> None:
+        if algorithm not in DEFAULT_COSTS:
+            raise ValueError(f"Algorithme inconnu : {algorithm}")
+        self.algorithm = algorithm
+        self.cost = cost if cost is not None else DEFAULT_COSTS[algorithm]
+
+    @staticmethod
+    def _derive(algorithm: str, cost: int, password: str, salt: bytes) -> bytes:
+        secret = password.encode("utf-8")
+        if algorithm == "scrypt":
+            n = 1 << cost
+            return hashlib.scrypt(secret, salt=salt, n=n, r=_SCRYPT_R,
+                                  p=_SCRYPT_P, maxmem=256 * n * _SCRYPT_R,
+                                  dklen=32)
+        if algorithm == "pbkdf2":
+            return hashlib.pbkdf2_hmac("sha256", secret, salt, cost)
+        raise ValueError(f"Algorithme inconnu : {algorithm}")
+
+    def hash(self, password: str) -> str:
+        """Retourne l'empreinte salée de `password`, prête à être stockée."""
+        salt = os.urandom(SALT_SIZE)
+        digest = self._derive(self.algorithm, self.cost, password, salt)
+        return f"{self.algorithm}${self.cost}${salt.hex()}${digest.hex()}"
+
+    def verify(self, password: str, stored: str) -> bool:
+        """Vérifie `password` contre une empreinte, nouvelle ou ancienne."""
+        if "$" not in stored:
+            digest = hashlib.sha3_512(password.encode("utf-8")).hexdigest()
+            return hmac.compare_digest(digest, stored)
+        try:
+            algorithm, cost, salt, expected = stored.split("$")
+            digest = self._derive(algorithm, int(cost), password,
+                                  bytes.fromhex(salt))
+        except ValueError:
+            return False
+        return hmac.compare_digest(digest.hex(), expected)
+
+    def needs_rehash(self, stored: str) -> bool:
+        """Indique si l'empreinte n'utilise pas l'algorithme et le coût actuels."""
+        return not stored.startswith(f"{self.algorithm}${self.cost}$")
+
+
+class CredentialCache:
+    """
+    Mémoire des identifiants vérifiés récemment.
+
+    Une connexion qui présente le même mot de passe qu'une connexion
+    réussie il y a moins de `ttl` secondes, pour la même empreinte
+    stockée, est acceptée sans refaire la dérivation. Le cache ne garde
+    qu'un HMAC des identifiants, avec une clé propre au processus, et au
+    plus `max_size` comptes (les plus anciens sont évincés).
+    """
+
+    def __init__(self, ttl: float = 300.0, max_size: int = 4096) -> None:
+        self._ttl = ttl
+        self._max_size = max_size
+        self._key = os.urandom(32)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tag(self, password: str, stored: str) -> bytes:
+        return hmac.new(self._key, f"{stored}\0{password}".encode("utf-8"),
+                        hashlib.sha256).digest()
+
+    def check(self, username: str, password: str, stored: str) -> bool:
+        """Indique si ces identifiants ont été vérifiés récemment."""
+        with self._lock:
+            entry = self._entries.get(username)
+        if entry is None:
+            return False
+        tag, expiry = entry
+        if time.monotonic() > expiry:
+            self.forget(username)
+            return False
+        return hmac.compare_digest(tag, self._tag(password, stored))
+
+    def remember(self, username: str, password: str, stored: str) -> None:
+        """Retient des identifiants qui viennent d'être vérifiés."""
+        if self._ttl <= 0:
+            return
+        entry = (self._tag(password, stored), time.monotonic() + self._ttl)
+        with self._lock:
+            self._entries[username] = entry
+            self._entries.move_to_end(username)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def forget(self, username: str) -> None:
+        with self._lock:
+            self._entries.pop(username, None)
@@ -0,0 +1,288 @@
+"""\
+Module fournissant la file d'envoi des courriels externes.
+
+Les courriels sont d'abord écrits dans le dossier `SERVER_OUTBOX_DIR`,
+puis relayés en arrière-plan au serveur SMTP par des fils dédiés qui
+réutilisent leur connexion et réessaient les envois échoués.
+"""
+from email.message import EmailMessage
+import heapq
+import io
+import json
+import os
+import pathlib
+import smtplib
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows : un seul processus serveur
+    fcntl = None
+
+import glomailbox
+import gloutils
+
+
+class RelayQueue:
+    """
+    File persistante de courriels à relayer au serveur SMTP.
+
+    Chaque courriel en attente est un fichier JSON du dossier de la file,
+    ce qui permet de reprendre les envois après un redémarrage. Les
+    courriels abandonnés après `max_attempts` essais, ou qui ne peuvent
+    pas être convertis en message SMTP, sont déplacés dans le
+    sous-dossier `failed`. Un corps reçu par morceaux est gardé à côté,
+    dans le sous-dossier `glomailbox.BODY_DIRNAME`, et n'est lu qu'au
+    moment de l'envoi.
+
+    Plusieurs processus serveurs peuvent partager le dossier de la file :
+    chacun reprend au démarrage les courriels restés en attente, et un
+    verrou sur le fichier du courriel garantit qu'un seul l'envoie.
+    """
+
+    def __init__(self, path: pathlib.Path,
+                 host: str = gloutils.SMTP_SERVER,
+                 port: int = gloutils.SMTP_PORT,
+                 workers: int = 2, batch_size: int = 20,
+                 max_attempts: int = 5, backoff: float = 2.0,
+                 idle_timeout: float = 30.0) -> None:
+        self._path = path
+        self._failed_path = path / "failed"
+        self._failed_path.mkdir(parents=True, exist_ok=True)
+        self._body_path = path / glomailbox.BODY_DIRNAME
+        self._body_path.mkdir(exist_ok=True)
+        glomailbox.remove_incoming(self._body_path)
+        self._host = host
+        self._port = port
+        self._batch_size = batch_size
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._idle_timeout = idle_timeout
+
+        self._condition = threading.Condition()
+        self._ready = []  # tas de (moment d'envoi, identifiant)
+        self._closed = False
+
+        self._sent = 0
+        self._failed = 0
+        self._retried = 0
+        self._latency_total = 0.0
+        self._last_latency = 0.0
+
+        for item_path in sorted(path.glob("*.json")):
+            self._schedule(item_path.stem, time.time())
+
+        self._threads = [threading.Thread(target=self._work, daemon=True,
+                                          name=f"glo-relay-{i}")
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def open_body(self) -> glomailbox.BodyWriter:
+        """Prépare la réception par morceaux d'un corps de courriel."""
+        return glomailbox.BodyWriter(self._body_path)
+
+    def enqueue(self, email: gloutils.EmailContentPayload,
+                body: "glomailbox.BodyWriter | None" = None,
+                recipients: "list[str] | None" = None) -> None:
+        """
+        Écrit le courriel dans la file ; l'envoi se fera en arrière-plan.
+
+        Si `body` est donné, `email` n'a pas de `content` : le corps reçu
+        par morceaux est gardé dans son propre fichier.
+
+        Si `recipients` est donné, le courriel est envoyé à ces adresses
+        (destinataires `bcc` compris) en une seule transaction SMTP ;
+        sinon, aux adresses de ses en-têtes.
+        """
+        item_id = uuid.uuid4().hex
+        if body is not None:
+            # Renommé avant d'être fermé (et déverrouillé), pour que
+            # `remove_incoming` ne le supprime jamais.
+            body.path.replace(self._body_path / item_id)
+            body.close()
+            email = dict(email, body=True)
+        item = {"email": email, "attempts": 0, "queued_at": time.time()}
+        if recipients is not None:
+            item["recipients"] = recipients
+        self._write_item(item_id, item)
+        self._schedule(item_id, time.time())
+
+    def depth(self) -> int:
+        """Nombre de courriels en attente d'envoi."""
+        with self._condition:
+            return len(self._ready)
+
+    def stats(self) -> dict:
+        """Retourne la profondeur de la file et les compteurs de relais."""
+        with self._condition:
+            average = self._latency_total / self._sent if self._sent else 0.0
+            return {"depth": len(self._ready), "sent": self._sent,
+                    "failed": self._failed, "retried": self._retried,
+                    "last_latency": self._last_latency,
+                    "average_latency": average}
+
+    def close(self) -> None:
+        """Arrête les fils d'envoi. Les courriels restants restent sur disque."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _item_path(self, item_id: str) -> pathlib.Path:
+        return self._path / f"{item_id}.json"
+
+    def _write_item(self, item_id: str, item: dict) -> None:
+        tmp_path = self._path / f"{item_id}.tmp"
+        tmp_path.write_text(json.dumps(item))
+        tmp_path.replace(self._item_path(item_id))
+
+    def _schedule(self, item_id: str, when: float) -> None:
+        with self._condition:
+            heapq.heappush(self._ready, (when, item_id))
+            self._condition.notify()
+
+    def _next_batch(self) -> "list[str]":
+        """Attend qu'au moins un courriel soit prêt et retourne un lot."""
+        with self._condition:
+            while not self._closed:
+                now = time.time()
+                if self._ready and self._ready[0][0] <= now:
+                    batch = []
+                    while (self._ready and self._ready[0][0] <= now
+                           and len(batch) < self._batch_size):
+                        batch.append(heapq.heappop(self._ready)[1])
+                    return batch
+                timeout = self._ready[0][0] - now if self._ready else None
+                self._condition.wait(timeout)
+            return []
+
+    def _work(self) -> None:
+        connection = None
+        last_used = 0.0
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                break
+            if (connection is not None
+                    and time.monotonic() - last_used > self._idle_timeout):
+                connection = self._disconnect(connection)
+            for item_id in batch:
+                connection = self._relay(item_id, connection)
+            last_used = time.monotonic()
+        self._disconnect(connection)
+
+    def _claim(self, item_id: str) -> "io.BufferedReader | None":
+        """
+        Ouvre le fichier d'un courriel en attente et le verrouille, pour
+        qu'un seul processus l'envoie. Retourne None si un autre processus
+        l'envoie déjà, ou l'a déjà envoyé.
+        """
+        path = self._item_path(item_id)
+        try:
+            item_file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            if fcntl is not None:
+                fcntl.flock(item_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Le fichier a pu être envoyé et supprimé, ou remplacé, avant
+            # que le verrou soit pris.
+            if os.fstat(item_file.fileno()).st_ino == path.stat().st_ino:
+                return item_file
+        except OSError:
+            pass
+        item_file.close()
+        return None
+
+    def _relay(self, item_id: str, connection: "smtplib.SMTP | None"
+               ) -> "smtplib.SMTP | None":
+        """
+        Envoie un courriel de la file sur la connexion donnée (ouverte au
+        besoin) et retourne la connexion à réutiliser pour la suite du lot.
+        """
+        item_file = self._claim(item_id)
+        if item_file is None:
+            return connection
+        with item_file:
+            try:
+                return self._send_item(item_id, item_file, connection)
+            except Exception:
+                # Courriel malformé : il ne doit ni arrêter ce fil (et le
+                # reste de son lot), ni revenir à chaque redémarrage.
+                self._fail(item_id)
+                return self._disconnect(connection)
+
+    def _send_item(self, item_id: str, item_file: io.BufferedReader,
+                   connection: "smtplib.SMTP | None") -> "smtplib.SMTP | None":
+        try:
+            item = json.loads(item_file.read())
+        except ValueError:
+            return connection
+
+        try:
+            if connection is None:
+                connection = smtplib.SMTP(host=self._host, port=self._port,
+                                          timeout=10)
+            email = item["email"]
+            if email.get("body"):
+                email = dict(email, content=(self._body_path / item_id).read_text(
+                    encoding='utf-8'))
+            connection.send_message(self._make_message(email),
+                                    to_addrs=item.get("recipients"))
+        except (OSError, smtplib.SMTPException):
+            connection = self._disconnect(connection)
+            self._retry(item_id, item)
+            return connection
+
+        self._item_path(item_id).unlink(missing_ok=True)
+        (self._body_path / item_id).unlink(missing_ok=True)
+        latency = time.time() - item["queued_at"]
+        with self._condition:
+            self._sent += 1
+            self._latency_total += latency
+            self._last_latency = latency
+        return connection
+
+    def _retry(self, item_id: str, item: dict) -> None:
+        item["attempts"] += 1
+        if item["attempts"] >= self._max_attempts:
+            self._fail(item_id)
+            return
+
+        self._write_item(item_id, item)
+        with self._condition:
+            self._retried += 1
+        delay = self._backoff * 2 ** (item["attempts"] - 1)
+        self._schedule(item_id, time.time() + delay)
+
+    def _fail(self, item_id: str) -> None:
+        """Abandonne un courriel : il est déplacé dans `failed` avec son corps."""
+        self._item_path(item_id).replace(self._failed_path / f"{item_id}.json")
+        try:
+            (self._body_path / item_id).replace(self._failed_path / item_id)
+        except FileNotFoundError:
+            pass
+        with self._condition:
+            self._failed += 1
+
+    @staticmethod
+    def _disconnect(connection: "smtplib.SMTP | None") -> None:
+        if connection is not None:
+            try:
+                connection.quit()
+            except (OSError, smtplib.SMTPException):
+                connection.close()
+        return None
+
+    @staticmethod
+    def _make_message(email: gloutils.EmailContentPayload) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = email["sender"]
+        message["To"] = email["destination"]
+        if email.get("cc"):
+            message["Cc"] = email["cc"]
+        message["Subject"] = email["subject"]
+        message.set_content(email["content"])
+        return message
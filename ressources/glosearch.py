@@ -0,0 +1,348 @@
+"""\
+Module fournissant la recherche dans les boîtes de courriels.
+
+Chaque boîte a un index inversé en mémoire : pour chaque terme, la liste
+croissante des numéros des courriels qui le contiennent. Les termes de
+l'expéditeur et du sujet sont préfixés (`from:`, `subject:`) pour être
+distingués de ceux du corps. Une recherche intersecte les listes des
+termes demandés, de la plus courte à la plus longue, puis filtre par
+date : elle ne lit aucun fichier de courriel.
+
+L'index est tenu à jour de façon incrémentale : le serveur lui donne
+chaque courriel à la livraison (`MailboxSearch.add`), qui en ajoute les
+termes et la date au fichier `MAILBOX_SEARCH_FILENAME` de la boîte.
+L'index est reconstruit à partir de ce fichier à la première recherche,
+sans relire les courriels ; ceux qui n'y sont pas (corps reçu par
+morceaux) sont lus une seule fois.
+"""
+import array
+import bisect
+import collections
+import datetime
+import email.utils
+import os
+import pathlib
+import re
+import threading
+from typing import Iterable
+
+import glomailbox
+import gloutils
+
+MAX_TERM_LENGTH = 64
+_TERM = re.compile(rf"(?<!\w)\w{{1,{MAX_TERM_LENGTH}}}(?!\w)")
+# Seul le début d'un corps est indexé.
+MAX_INDEXED_BODY = 1024 * 1024
+# Nombre de lignes ajoutées d'un coup au fichier des termes au rattrapage.
+APPEND_BATCH = 1000
+
+
+def tokenize(text: str) -> "set[str]":
+    """
+    Retourne les termes distincts de `text`, en minuscules. Les termes
+    de plus de `MAX_TERM_LENGTH` caractères sont ignorés.
+    """
+    return set(_TERM.findall(text.casefold()))
+
+
+def parse_email_date(text: str) -> "float | None":
+    """Horodatage d'une date au format de `get_current_utc_time`, ou None."""
+    try:
+        return email.utils.parsedate_to_datetime(text).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_query_date(text: str) -> float:
+    """
+    Horodatage d'une date ISO 8601 (`2024-03-01` ou
+    `2024-03-01T12:00:00+00:00`), en UTC si le fuseau est absent.
+
+    Lève une ValueError si la date est invalide.
+    """
+    date = datetime.datetime.fromisoformat(text)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+
+def email_terms(sender: str, subject: str, content: str) -> "set[str]":
+    """Termes indexés d'un courriel : ceux du corps et, préfixés, les autres."""
+    terms = tokenize(content)
+    terms.update("from:" + term for term in tokenize(sender))
+    terms.update("subject:" + term for term in tokenize(subject))
+    return terms
+
+
+class InvertedIndex:
+    """
+    Index inversé des courriels d'une boîte, ajoutés par numéros
+    croissants.
+
+    Les listes de numéros sont des `array` d'entiers : quatre octets
+    par occurrence d'un terme. Les dates sont gardées triées à part,
+    pour trouver par dichotomie les courriels d'un intervalle.
+    """
+
+    def __init__(self) -> None:
+        self._postings: "dict[str, array.array]" = collections.defaultdict(
+            lambda: array.array('I'))
+        self._numbers = array.array('I')
+        self._dates: "dict[int, float]" = {}
+        self._by_date: "list[tuple[float, int]]" = []
+
+    @property
+    def last_number(self) -> int:
+        """Numéro du dernier courriel indexé (0 si aucun)."""
+        return self._numbers[-1] if self._numbers else 0
+
+    def add(self, number: int, terms: "Iterable[str]",
+            timestamp: "float | None") -> None:
+        """Indexe le courriel `number`, qui doit suivre le dernier indexé."""
+        if number <= self.last_number:
+            raise ValueError(f"Courriel {number} déjà indexé")
+        postings = self._postings
+        for term in terms:
+            postings[term].append(number)
+        self._numbers.append(number)
+        if timestamp is not None:
+            self._dates[number] = timestamp
+            if self._by_date and timestamp < self._by_date[-1][0]:
+                bisect.insort(self._by_date, (timestamp, number))
+            else:
+                self._by_date.append((timestamp, number))
+
+    def search(self, terms: "list[str]", since: "float | None" = None,
+               until: "float | None" = None) -> "list[int]":
+        """
+        Retourne, par ordre croissant, les numéros des courriels qui
+        contiennent tous les `terms` et dont la date est dans
+        [`since`, `until`[. Sans terme, tous les courriels de
+        l'intervalle.
+        """
+        postings = []
+        for term in set(terms):
+            found = self._postings.get(term)
+            if found is None:
+                return []
+            postings.append(found)
+        postings.sort(key=len)
+
+        dated = since is not None or until is not None
+        if dated:
+            start = 0 if since is None else bisect.bisect_left(
+                self._by_date, (since,))
+            stop = len(self._by_date) if until is None else bisect.bisect_left(
+                self._by_date, (until,))
+            if not postings or stop - start < len(postings[0]):
+                # L'intervalle est plus sélectif que le terme le plus rare :
+                # il sert de point de départ à l'intersection.
+                postings.insert(0, array.array('I', sorted(
+                    number for _, number in self._by_date[start:stop])))
+                dated = False
+        elif not postings:
+            return self._numbers.tolist()
+
+        numbers = postings[0].tolist()
+        for other in postings[1:]:
+            if not numbers:
+                break
+            numbers = self._intersect(numbers, other)
+
+        if dated:
+            low = float("-inf") if since is None else since
+            high = float("inf") if until is None else until
+            dates = self._dates
+            numbers = [number for number in numbers
+                       if low <= dates.get(number, float("nan")) < high]
+        return numbers
+
+    @staticmethod
+    def _intersect(numbers: "list[int]", other: array.array) -> "list[int]":
+        """
+        Garde les `numbers` présents dans `other`, plus longue : par
+        recherche dichotomique si `numbers` est bien plus courte, sinon
+        par un parcours de `other`.
+        """
+        if len(numbers) * 16 < len(other):
+            kept = []
+            for number in numbers:
+                position = bisect.bisect_left(other, number)
+                if position < len(other) and other[position] == number:
+                    kept.append(number)
+            return kept
+        wanted = set(numbers)
+        return [number for number in other if number in wanted]
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+
+class MailboxSearch:
+    """
+    Recherche dans une boîte de courriels, avec son index inversé.
+
+    `add` ajoute les termes de chaque courriel livré au fichier
+    `MAILBOX_SEARCH_FILENAME`, et à l'index s'il est chargé. L'index est
+    construit au premier appel de `search` à partir de ce fichier ; les
+    courriels qui n'y sont pas (corps reçu par morceaux, arrêt brutal)
+    sont alors lus une seule fois. Les méthodes peuvent être appelées
+    depuis plusieurs fils, et plusieurs processus peuvent ajouter au même
+    fichier : une ligne en double est ignorée au chargement.
+    """
+
+    def __init__(self, mailbox: glomailbox.Mailbox, path: pathlib.Path) -> None:
+        self._mailbox = mailbox
+        self._path = path / gloutils.MAILBOX_SEARCH_FILENAME
+        self._index: "InvertedIndex | None" = None
+        # Courriels lus mais pas encore indexés : numéro -> (termes, date).
+        self._pending: "dict[int, tuple[Iterable[str], float | None]]" = {}
+        self._lock = threading.Lock()
+
+    def add(self, entry: glomailbox.IndexEntry, content: str,
+            terms: "set[str] | None" = None) -> None:
+        """
+        Enregistre les termes d'un courriel qui vient d'être livré. Les
+        `terms` déjà calculés par `email_terms` peuvent être donnés, pour
+        ne pas relire le corps d'un courriel livré à plusieurs boîtes.
+        """
+        number = entry["number"]
+        record = self._record(entry, content, terms)
+        line = self._line(number, record)
+        with self._lock:
+            if self._index is not None:
+                if number <= self._index.last_number:
+                    return  # déjà lu par `_catch_up`
+                if number == self._index.last_number + 1:
+                    self._index.add(number, *record)
+                else:
+                    # Un courriel précédent n'est pas encore enregistré.
+                    self._pending[number] = record
+            self._append([line])
+
+    def search(self, sender: str = "", subject: str = "", text: str = "",
+               since: "float | None" = None,
+               until: "float | None" = None) -> "list[int]":
+        """
+        Retourne, par ordre croissant, les positions dans la boîte (1
+        étant le plus ancien) des courriels dont l'expéditeur, le sujet
+        et le corps contiennent tous les termes donnés, et dont la date
+        est dans [`since`, `until`[. Un critère sans aucun terme (« @@ »)
+        ne correspond à aucun courriel.
+        """
+        terms = []
+        for prefix, criterion in (("from:", sender), ("subject:", subject),
+                                  ("", text)):
+            criterion_terms = tokenize(criterion)
+            if criterion and not criterion_terms:
+                return []
+            terms += [prefix + term for term in criterion_terms]
+        with self._lock:
+            if self._index is None:
+                self._load()
+            self._catch_up()
+            numbers = self._index.search(terms, since, until)
+        return self._positions(numbers)
+
+    def _positions(self, numbers: "list[int]") -> "list[int]":
+        """Positions des courriels `numbers` encore dans la boîte."""
+        entries = self._mailbox.entries()
+        if entries and entries[-1]["number"] == len(entries):
+            # Aucune suppression : le numéro est la position.
+            if numbers and numbers[-1] > len(entries):
+                numbers = [number for number in numbers if number <= len(entries)]
+            return numbers
+        positions = []
+        for number in numbers:
+            position = bisect.bisect_left(entries, number,
+                                          key=lambda entry: entry["number"])
+            if position < len(entries) and entries[position]["number"] == number:
+                positions.append(position + 1)
+        return positions
+
+    def _load(self) -> None:
+        """Lit le fichier des termes ; `_catch_up` construit ensuite l'index."""
+        self._index = InvertedIndex()
+        try:
+            with open(self._path, 'rb') as search_file:
+                for line in search_file:
+                    fields = line.decode("utf-8", "replace").split()
+                    if not line.endswith(b"\n") or len(fields) < 2:
+                        continue  # ligne incomplète après un arrêt brutal
+                    try:
+                        number = int(fields[0])
+                        timestamp = None if fields[1] == "-" else float(fields[1])
+                    except ValueError:
+                        continue
+                    self._pending[number] = (fields[2:], timestamp)
+        except FileNotFoundError:
+            pass
+
+    def _catch_up(self) -> None:
+        """
+        Indexe dans l'ordre les courriels livrés depuis le dernier indexé,
+        en lisant ceux dont les termes ne sont pas encore connus.
+        """
+        last = self._index.last_number
+        entries = self._mailbox.entries()
+        start = bisect.bisect_right(entries, last,
+                                    key=lambda entry: entry["number"])
+        numbers = [entry["number"] for entry in entries[start:]]
+        missing = {number for number in numbers if number not in self._pending}
+        if missing:
+            lines = []
+            for entry, _, body in self._mailbox.scan(last, missing):
+                record = self._record(entry, body.read(MAX_INDEXED_BODY))
+                self._pending[entry["number"]] = record
+                lines.append(self._line(entry["number"], record))
+                if len(lines) == APPEND_BATCH:
+                    self._append(lines)
+                    lines = []
+            self._append(lines)
+        for number in numbers:
+            record = self._pending.pop(number, None)
+            if record is not None:  # sinon supprimé pendant la lecture
+                self._index.add(number, *record)
+        if self._pending:
+            last = self._index.last_number
+            self._pending = {number: record for number, record
+                             in self._pending.items() if number > last}
+
+    @staticmethod
+    def _record(entry: glomailbox.IndexEntry, content: str,
+                terms: "set[str] | None" = None
+                ) -> "tuple[set[str], float | None]":
+        """Termes et date d'un courriel, tels que donnés à `InvertedIndex.add`."""
+        if terms is None:
+            terms = email_terms(entry["sender"], entry["subject"],
+                                content[:MAX_INDEXED_BODY])
+        return terms, parse_email_date(entry["date"])
+
+    @staticmethod
+    def _line(number: int, record: "tuple[set[str], float | None]") -> bytes:
+        """
+        Ligne du fichier des termes : numéro, horodatage (`-` si la date
+        est illisible) et termes, séparés par des espaces.
+        """
+        terms, timestamp = record
+        date = "-" if timestamp is None else repr(timestamp)
+        return f"{number} {date} {' '.join(terms)}\n".encode("utf-8")
+
+    def _append(self, lines: "list[bytes]") -> None:
+        """
+        Ajoute des lignes au fichier des termes, en une seule écriture
+        pour qu'elles ne se mélangent pas à celles d'un autre processus.
+        Un échec n'empêche pas la recherche : les courriels concernés
+        seront relus au prochain chargement.
+        """
+        if not lines:
+            return
+        try:
+            fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o644)
+            try:
+                os.write(fd, b"".join(lines))
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
@@ -0,0 +1,172 @@
+"""\
+Module fournissant les sessions des utilisateurs connectés.
+
+Une session est identifiée par un jeton aléatoire remis au client à la
+connexion. Le client peut le présenter sur une nouvelle connexion
+(entête AUTH_RESUME) pour retrouver sa session sans redonner son mot de
+passe.
+
+`SessionStore` garde les sessions en mémoire ; `FileSessionStore` les
+garde sur disque, pour que plusieurs processus serveurs se les partagent.
+"""
+import collections
+import hashlib
+import os
+import pathlib
+import secrets
+import threading
+import time
+
+SESSION_TTL = 3600.0
+MAX_SESSIONS = 100_000
+
+
+class SessionStore:
+    """
+    Sessions en mémoire, expirées après `ttl` secondes d'inactivité.
+
+    Les sessions sont gardées de la moins récemment utilisée à la plus
+    récente : les sessions expirées sont retirées en tête à chaque
+    création, et la plus ancienne est évincée au-delà de `max_size`.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL,
+                 max_size: int = MAX_SESSIONS) -> None:
+        self._ttl = ttl
+        self._max_size = max_size
+        self._sessions = collections.OrderedDict()  # jeton -> (nom, dernier accès)
+        self._lock = threading.Lock()
+
+    def create(self, username: str) -> str:
+        """Ouvre une session pour `username` et retourne son jeton."""
+        token = secrets.token_urlsafe(32)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._sessions[token] = (username, now)
+            while len(self._sessions) > self._max_size:
+                self._sessions.popitem(last=False)
+        return token
+
+    def resume(self, token: str) -> "str | None":
+        """
+        Retourne l'utilisateur de la session `token` et prolonge celle-ci,
+        ou None si elle n'existe pas ou a expiré.
+        """
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            username, last_seen = session
+            if now - last_seen > self._ttl:
+                del self._sessions[token]
+                return None
+            self._sessions[token] = (username, now)
+            self._sessions.move_to_end(token)
+        return username
+
+    def touch(self, token: str) -> None:
+        """Prolonge la session `token` si elle existe encore."""
+        self.resume(token)
+
+    def revoke(self, token: str) -> None:
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def _expire(self, now: float) -> None:
+        while self._sessions:
+            token, (_, last_seen) = next(iter(self._sessions.items()))
+            if now - last_seen <= self._ttl:
+                break
+            del self._sessions[token]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+
+class FileSessionStore:
+    """
+    Sessions partagées entre processus, même interface que `SessionStore`.
+
+    Chaque session est un fichier de `path` qui contient le nom de
+    l'utilisateur ; sa date de modification est celle du dernier accès.
+    Le nom du fichier est une empreinte du jeton, pour que le dossier ne
+    donne pas accès aux sessions. Les sessions expirées sont retirées au
+    plus une fois par `sweep_interval` secondes, lors d'une création, et
+    les plus anciennes au-delà de `max_size`.
+    """
+
+    def __init__(self, path: pathlib.Path, ttl: float = SESSION_TTL,
+                 max_size: int = MAX_SESSIONS,
+                 sweep_interval: float = 60.0) -> None:
+        self._path = path
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._ttl = ttl
+        self._max_size = max_size
+        self._sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def _session_path(self, token: str) -> pathlib.Path:
+        return self._path / hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def create(self, username: str) -> str:
+        """Ouvre une session pour `username` et retourne son jeton."""
+        token = secrets.token_urlsafe(32)
+        path = self._session_path(token)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(username, encoding="utf-8")
+        tmp_path.replace(path)
+        self._sweep()
+        return token
+
+    def resume(self, token: str) -> "str | None":
+        """
+        Retourne l'utilisateur de la session `token` et prolonge celle-ci,
+        ou None si elle n'existe pas ou a expiré.
+        """
+        path = self._session_path(token)
+        try:
+            if time.time() - path.stat().st_mtime > self._ttl:
+                path.unlink(missing_ok=True)
+                return None
+            username = path.read_text(encoding="utf-8")
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return username
+
+    def touch(self, token: str) -> None:
+        """Prolonge la session `token` si elle existe encore."""
+        self.resume(token)
+
+    def revoke(self, token: str) -> None:
+        self._session_path(token).unlink(missing_ok=True)
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + self._sweep_interval
+        sessions = []
+        for entry in os.scandir(self._path):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                sessions.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+        sessions.sort()
+        expired = time.time() - self._ttl
+        excess = len(sessions) - self._max_size
+        for i, (last_seen, path) in enumerate(sessions):
+            if last_seen > expired and i >= excess:
+                break
+            pathlib.Path(path).unlink(missing_ok=True)
+
+    def __len__(self) -> int:
+        return sum(1 for entry in os.scandir(self._path)
+                   if not entry.name.endswith(".tmp"))
@@ -1,9 +1,27 @@
 """\
 Module fournissant les fonctions d'envoi et de réception
 de messages de taille arbitraire pour les sockets Python.
+
+Chaque trame est précédée de sa longueur sur 4 octets. Si le bit de
+poids fort de la longueur (`COMPRESSED_FLAG`) est à 1, la trame est
+compressée avec zlib. La réception accepte toujours les deux formes ;
+l'envoi ne compresse que si `compress_threshold` est donné, c'est-à-dire
+si l'autre extrémité a annoncé qu'elle comprenait la compression.
 """
+import asyncio
 import socket
 import struct
+import zlib
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# Taille de l'entier qui préfixe chaque trame avec sa longueur.
+LENGTH_SIZE = 4
+COMPRESSED_FLAG = 0x80000000
+# Nom de la compression annoncé lors de la négociation.
+COMPRESSION = "zlib"
+# En deçà, le gain ne vaut pas le temps de compression (voir bench_compression.py).
+COMPRESSION_THRESHOLD = 512
+COMPRESSION_LEVEL = 1
 
 
 class GLOSocketError(Exception):
@@ -13,55 +31,229 @@ class GLOSocketError(Exception):
     """
 
 
-def _recvall(source: socket.socket, size: int) -> bytes:
+class GLOSocketTimeout(GLOSocketError):
+    """
+    Erreur levée quand l'autre extrémité ne lit plus ce qui lui est
+    envoyé (voir `async_drain`).
+    """
+
+
+def _recvall(source: socket.socket, size: int) -> bytearray:
     """
     Fonction utilitaire pour recv_msg.
 
-    Applique socket.recv en boucle pour jusqu'à la
-    réception d'un message de la taille voulue.
+    Préalloue un tampon de la taille voulue et le remplit
+    en place avec socket.recv_into, sans recopier les
+    morceaux déjà reçus.
     """
-    msg = b""
-    while size > 0:
-        chunk_size = min(size, 4096)
+    msg = bytearray(size)
+    view = memoryview(msg)
+    received = 0
+    while received < size:
         try:
-            buffer = source.recv(chunk_size)
+            count = source.recv_into(view[received:])
         except OSError as ex:
             raise GLOSocketError("The source socket is closed.") from ex
-        if not buffer:
+        if not count:
             raise GLOSocketError("The other socket is closed.")
-        msg += buffer
-        size -= len(buffer)
+        received += count
     return msg
 
 
-def send_msg(dest_soc: socket.socket, message: str) -> None:
+def _unpack_length(data_length: bytes, max_size: int) -> "tuple[int, bool]":
+    """Retourne la longueur de la trame et si elle est compressée."""
+    try:
+        length, = struct.unpack("!I", data_length)
+    except struct.error as ex:
+        raise GLOSocketError("The received data was"
+                             " not the message's length") from ex
+    compressed = bool(length & COMPRESSED_FLAG)
+    length &= ~COMPRESSED_FLAG
+    if length > max_size:
+        raise GLOSocketError(f"The message is too large ({length} bytes).")
+    return length, compressed
+
+
+def _pack(data: bytes, compress_threshold: "int | None") -> "tuple[bytes, bytes]":
     """
-    Encode le message puis le transmet à la destination.
+    Retourne la longueur encodée et les données à envoyer, compressées
+    si la trame atteint `compress_threshold` octets et que la compression
+    la raccourcit.
+    """
+    if compress_threshold is not None and len(data) >= compress_threshold:
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        if len(compressed) < len(data):
+            return (struct.pack("!I", len(compressed) | COMPRESSED_FLAG),
+                    compressed)
+    return struct.pack("!I", len(data)), data
+
+
+def _decompress(data: bytes, max_size: int) -> bytes:
+    """
+    Décompresse une trame, sans jamais produire plus de `max_size`
+    octets.
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        result = decompressor.decompress(data, max_size)
+    except zlib.error as ex:
+        raise GLOSocketError("The compressed message is invalid.") from ex
+    if decompressor.unconsumed_tail:
+        raise GLOSocketError("The decompressed message is too large.")
+    if not decompressor.eof:
+        raise GLOSocketError("The compressed message is truncated.")
+    return result
+
+
+def send_data(dest_soc: socket.socket, data: bytes,
+              compress_threshold: "int | None" = None) -> int:
+    """
+    Transmet un message déjà encodé à la destination et retourne le
+    nombre d'octets écrits sur le socket.
 
     Lève une exception GLOSocketError en cas de problème
     de communication.
     """
-    data = message.encode(encoding='utf-8')
-    data_length = struct.pack("!I", len(data))
+    data_length, data = _pack(data, compress_threshold)
     try:
         dest_soc.sendall(data_length + data)
     except OSError as ex:
         raise GLOSocketError("Cannot send data with socket") from ex
+    return LENGTH_SIZE + len(data)
+
+
+def send_msg(dest_soc: socket.socket, message: str,
+             compress_threshold: "int | None" = None) -> int:
+    """
+    Encode le message puis le transmet à la destination.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    return send_data(dest_soc, message.encode(encoding='utf-8'),
+                     compress_threshold)
 
 
-def recv_msg(source_soc: socket.socket) -> str:
+def recv_data(source_soc: socket.socket,
+              max_size: int = MAX_FRAME_SIZE) -> bytearray:
+    """
+    Récupère un message de la source sans le décoder.
+
+    Le résultat peut être passé directement à json.loads.
+    Lève une exception GLOSocketError en cas de problème
+    de communication ou si le message dépasse `max_size` octets.
+    """
+    length, compressed = _unpack_length(_recvall(source_soc, LENGTH_SIZE), max_size)
+    data = _recvall(source_soc, length)
+    if compressed:
+        return _decompress(data, max_size)
+    return data
+
+
+def recv_msg(source_soc: socket.socket,
+             max_size: int = MAX_FRAME_SIZE) -> str:
     """
     Récupère un message de la source et le décode.
 
+    Lève une exception GLOSocketError en cas de problème
+    de communication ou si le message dépasse `max_size` octets.
+    """
+    return recv_data(source_soc, max_size).decode('utf-8')
+
+
+async def async_send_msg(writer: asyncio.StreamWriter, message: str,
+                         compress_threshold: "int | None" = None) -> int:
+    """
+    Version asynchrone de send_msg pour les flux asyncio.
+
     Lève une exception GLOSocketError en cas de problème
     de communication.
     """
-    data_length = _recvall(source_soc, 4)
+    return await async_send_data(writer, message.encode(encoding='utf-8'),
+                                 compress_threshold)
+
+
+async def async_drain(writer: asyncio.StreamWriter,
+                      timeout: "float | None" = None) -> None:
+    """
+    Attend que le tampon d'écriture du flux redescende sous son seuil
+    bas (voir `asyncio.WriteTransport.set_write_buffer_limits`).
+
+    Si `timeout` est donné, lève une exception GLOSocketTimeout quand le
+    tampon n'a pas diminué pendant `timeout` secondes : un lecteur lent
+    mais qui progresse n'est pas pénalisé.
+    """
     try:
-        length, = struct.unpack("!I", data_length)
-    except struct.error as ex:
-        raise GLOSocketError("The received data was"
-                             " not the message's length") from ex
+        if timeout is None:
+            await writer.drain()
+            return
+        while True:
+            before = writer.transport.get_write_buffer_size()
+            try:
+                await asyncio.wait_for(writer.drain(), timeout)
+                return
+            except asyncio.TimeoutError:
+                if writer.transport.get_write_buffer_size() >= before:
+                    raise GLOSocketTimeout("The other socket is not reading.")
+    except OSError as ex:
+        raise GLOSocketError("Cannot send data with socket") from ex
 
-    data = _recvall(source_soc, length)
+
+async def async_send_data(writer: asyncio.StreamWriter, data: bytes,
+                          compress_threshold: "int | None" = None,
+                          timeout: "float | None" = None) -> int:
+    """
+    Version asynchrone de send_data pour les flux asyncio.
+
+    La trame est confiée au tampon d'écriture du flux, puis la coroutine
+    attend que celui-ci se vide (voir `async_drain` pour `timeout`).
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication.
+    """
+    data_length, data = _pack(data, compress_threshold)
+    if writer.is_closing():
+        raise GLOSocketError("Cannot send data with a closed socket")
+    try:
+        writer.write(data_length)
+        writer.write(data)
+    except OSError as ex:
+        raise GLOSocketError("Cannot send data with socket") from ex
+    await async_drain(writer, timeout)
+    return LENGTH_SIZE + len(data)
+
+
+async def async_recv_data(reader: asyncio.StreamReader,
+                          max_size: int = MAX_FRAME_SIZE) -> bytes:
+    """
+    Version asynchrone de recv_data pour les flux asyncio.
+
+    La trame est lue de façon incrémentale : un client qui n'envoie
+    qu'une partie de son message ne bloque que sa propre coroutine.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication ou si le message dépasse `max_size` octets.
+    """
+    try:
+        length, compressed = _unpack_length(
+            await reader.readexactly(LENGTH_SIZE), max_size)
+        data = await reader.readexactly(length)
+    except asyncio.IncompleteReadError as ex:
+        raise GLOSocketError("The other socket is closed.") from ex
+    except OSError as ex:
+        raise GLOSocketError("The source socket is closed.") from ex
+    if compressed:
+        return _decompress(data, max_size)
+    return data
+
+
+async def async_recv_msg(reader: asyncio.StreamReader,
+                         max_size: int = MAX_FRAME_SIZE) -> str:
+    """
+    Version asynchrone de recv_msg pour les flux asyncio.
+
+    Lève une exception GLOSocketError en cas de problème
+    de communication ou si le message dépasse `max_size` octets.
+    """
+    data = await async_recv_data(reader, max_size)
     return data.decode('utf-8')
@@ -3,15 +3,21 @@ Module fournissant les constantes, énumérations,
 protocoles et gabarits à utiliser pour le TP4.
 """
 import enum
-from typing import TypedDict, Union
+from typing import NotRequired, TypedDict, Union
 import datetime
 
 APP_PORT = 5321
 SERVER_DATA_DIR = "glo_server_data"
 SERVER_LOST_DIR = "LOST"
+SERVER_OUTBOX_DIR = "OUTBOX"
+SERVER_SESSIONS_DIR = "SESSIONS"
 SERVER_DOMAIN = "glo2000.ca"
 SMTP_SERVER = "smtp.ulaval.ca"
+SMTP_PORT = 25
 PASSWORD_FILENAME = "pass"  # nosec:B105
+MAILBOX_INDEX_FILENAME = "index"
+MAILBOX_STATS_FILENAME = "stats"
+MAILBOX_SEARCH_FILENAME = "search"
 
 CLIENT_AUTH_CHOICE = """Menu de connexion
 1. Créer un compte
@@ -21,9 +27,22 @@ CLIENT_USE_CHOICE = """Menu principal
 1. Consultation de courriels
 2. Envoi de courriels
 3. Statistiques
-4. Se déconnecter"""
+4. Se déconnecter
+5. Recherche de courriels"""
 
 SUBJECT_DISPLAY = "#{number} {sender} - {subject} {date}"
+INBOX_PAGE_SIZE = 10
+INBOX_MAX_PAGE_SIZE = 100
+# Nombre de caractères du corps par trame EMAIL_BODY_CHUNK.
+BODY_CHUNK_SIZE = 64 * 1024
+# Nombre maximal d'adresses (destination, cc et bcc) d'un même envoi.
+MAX_RECIPIENTS = 1000
+
+# État de la livraison à chaque destinataire d'un envoi.
+RECIPIENT_DELIVERED = "delivered"  # dans la boîte d'un utilisateur
+RECIPIENT_QUEUED = "queued"  # dans la file de relais SMTP
+RECIPIENT_UNKNOWN = "unknown"  # utilisateur inexistant, copie dans LOST
+RECIPIENT_FAILED = "failed"  # erreur du stockage ou de la file
 
 EMAIL_DISPLAY = """De : {sender}
 À : {to}
@@ -56,6 +75,26 @@ class Headers(enum.IntEnum):
 
     STATS_REQUEST = enum.auto()
 
+    INBOX_PAGE_REQUEST = enum.auto()
+
+    HELLO = enum.auto()
+
+    METRICS_REQUEST = enum.auto()
+
+    AUTH_RESUME = enum.auto()
+
+    EMAIL_BODY_BEGIN = enum.auto()
+    EMAIL_BODY_CHUNK = enum.auto()
+    EMAIL_BODY_END = enum.auto()
+    INBOX_READING_STREAM = enum.auto()
+
+    INBOX_SEARCH = enum.auto()
+
+    INBOX_READING_BATCH = enum.auto()
+    EMAIL_BATCH = enum.auto()
+
+    INBOX_CHANGES = enum.auto()
+
 
 class ErrorPayload(TypedDict, total=True):
     """Payload pour les messages d'erreurs."""
@@ -68,13 +107,68 @@ class AuthPayload(TypedDict, total=True):
     password: str
 
 
+class SessionPayload(TypedDict, total=True):
+    """
+    Payload de la réponse à LOGIN/REGISTER et de la requête AUTH_RESUME :
+    jeton qui permet de reprendre la session sur une nouvelle connexion.
+    """
+    token: str
+
+
 class EmailContentPayload(TypedDict, total=True):
-    """Payload pour les transferts de courriels."""
+    """
+    Payload pour les transferts de courriels.
+
+    `destination`, `cc` et `bcc` contiennent chacun une ou plusieurs
+    adresses séparées par des virgules. Les destinataires de `bcc`
+    reçoivent le courriel sans que leur adresse y figure.
+    """
     sender: str
     destination: str
     subject: str
     date: str
     content: str
+    cc: NotRequired[str]
+    bcc: NotRequired[str]
+
+
+class EmailHeaderPayload(TypedDict, total=True):
+    """
+    Payload de EMAIL_BODY_BEGIN : courriel dont le corps suit en trames
+    EMAIL_BODY_CHUNK, terminées par EMAIL_BODY_END.
+
+    Le client l'envoie pour un envoi par morceaux (seul EMAIL_BODY_END
+    reçoit une réponse) ; le serveur l'envoie en réponse à
+    INBOX_READING_STREAM, et à INBOX_READING_BATCH avec le choix du
+    courriel (`choice`).
+    """
+    sender: str
+    destination: str
+    subject: str
+    date: str
+    cc: NotRequired[str]
+    bcc: NotRequired[str]
+    choice: NotRequired[int]
+
+
+class EmailChunkPayload(TypedDict, total=True):
+    """Payload de EMAIL_BODY_CHUNK : morceau du corps d'un courriel."""
+    data: str
+
+
+class RecipientStatusPayload(TypedDict, total=True):
+    """État de la livraison à un destinataire (`RECIPIENT_*`)."""
+    address: str
+    status: str
+
+
+class EmailDeliveryPayload(TypedDict, total=True):
+    """
+    Payload de la réponse OK à un envoi à plusieurs destinataires : état
+    de la livraison à chacun, dans l'ordre de `destination`, `cc` puis
+    `bcc`, chaque adresse une seule fois.
+    """
+    recipients: "list[RecipientStatusPayload]"
 
 
 class EmailListPayload(TypedDict, total=True):
@@ -82,27 +176,155 @@ class EmailListPayload(TypedDict, total=True):
     email_list: "list[str]"
 
 
+class EmailPageRequestPayload(TypedDict, total=True):
+    """
+    Payload pour la demande d'une page de la liste des courriels.
+
+    `offset` est compté à partir du courriel le plus récent.
+    """
+    offset: int
+    limit: int
+
+
+class EmailPagePayload(TypedDict, total=True):
+    """Payload pour une page de la liste des courriels."""
+    email_list: "list[str]"
+    total: int
+
+
 class EmailChoicePayload(TypedDict, total=True):
     """Payload pour le choix du courriel à consulter."""
     choice: int
 
 
+class EmailSearchPayload(TypedDict, total=False):
+    """
+    Payload pour une recherche dans la boîte : tous les critères donnés
+    doivent être satisfaits. `sender`, `subject` et `text` (corps) sont
+    des mots, sans égard à la casse ni à l'ordre ; `since` (inclus) et
+    `until` (exclu) sont des dates ISO 8601. `offset` et `limit`
+    découpent les résultats en pages, du plus récent au plus ancien.
+    """
+    sender: str
+    subject: str
+    text: str
+    since: str
+    until: str
+    offset: int
+    limit: int
+
+
+class EmailSearchResultPayload(TypedDict, total=True):
+    """
+    Payload pour une page de résultats de recherche : sujets au gabarit
+    SUBJECT_DISPLAY, choix à donner à INBOX_READING_CHOICE ou
+    INBOX_READING_STREAM pour les lire, et nombre total de résultats.
+    """
+    email_list: "list[str]"
+    choices: "list[int]"
+    total: int
+
+
+class EmailBatchRequestPayload(TypedDict, total=False):
+    """
+    Payload pour la lecture de plusieurs courriels en une requête :
+    les choix `choices`, ou tous ceux de `first` à `last` inclus (1
+    étant le plus récent).
+    """
+    choices: "list[int]"
+    first: int
+    last: int
+
+
+class EmailBatchPayload(TypedDict, total=True):
+    """
+    Payload de EMAIL_BATCH : courriels complets, et leurs choix dans le
+    même ordre.
+    """
+    emails: "list[EmailContentPayload]"
+    choices: "list[int]"
+
+
+class EmailChangesRequestPayload(TypedDict, total=False):
+    """
+    Payload pour la demande des courriels livrés après le curseur
+    `cursor` (0 pour tous) : au plus `limit`, en attendant au plus
+    `wait` secondes qu'il y en ait un s'il n'y en a pas encore.
+    """
+    cursor: int
+    limit: int
+    wait: float
+
+
+class EmailChangesPayload(TypedDict, total=True):
+    """
+    Payload pour les courriels livrés après le curseur, du plus ancien
+    au plus récent : sujets au gabarit SUBJECT_DISPLAY, choix pour les
+    lire, nouveau curseur à donner à la demande suivante, et nombre de
+    courriels après l'ancien curseur (plus que la liste si `limit` l'a
+    tronquée).
+    """
+    email_list: "list[str]"
+    choices: "list[int]"
+    cursor: int
+    total: int
+
+
 class StatsPayload(TypedDict, total=True):
     """Payload pour les statistiques."""
     count: int
     size: int
 
 
+class HelloPayload(TypedDict, total=True):
+    """
+    Payload pour la négociation HELLO : formats de sérialisation
+    proposés par le client, du plus préféré au moins préféré, et
+    compressions de trames qu'il sait décoder (optionnel).
+    """
+    codecs: "list[str]"
+    compression: NotRequired["list[str]"]
+
+
+class HelloReplyPayload(TypedDict, total=True):
+    """
+    Payload pour la réponse à HELLO : format retenu par le serveur et
+    compression qu'il utilisera (None s'il ne compresse pas).
+    """
+    codec: str
+    compression: NotRequired["str | None"]
+
+
+class MetricsPayload(TypedDict, total=True):
+    """
+    Payload pour la réponse à METRICS_REQUEST : métriques du serveur
+    au format texte de Prometheus.
+    """
+    metrics: str
+
+
 class GloMessage(TypedDict, total=False):
     """
     Classe à utiliser pour générer des messages.
 
     Les classes *Payload correspondent à des entêtes spécifiques
     certaines entêtes n'ont pas besoin de payload.
+
+    `request_id` est optionnel : une requête qui en porte un peut être
+    traitée en parallèle des autres et sa réponse, qui reprend le même
+    `request_id`, peut arriver dans le désordre.
     """
     header: Headers
-    payload: Union[ErrorPayload, AuthPayload, EmailContentPayload,
-                   EmailListPayload, EmailChoicePayload, StatsPayload]
+    request_id: int
+    payload: Union[ErrorPayload, AuthPayload, SessionPayload,
+                   EmailContentPayload, EmailHeaderPayload, EmailChunkPayload,
+                   EmailDeliveryPayload,
+                   EmailListPayload, EmailPageRequestPayload,
+                   EmailPagePayload, EmailChoicePayload, EmailSearchPayload,
+                   EmailSearchResultPayload, EmailBatchRequestPayload,
+                   EmailBatchPayload, EmailChangesRequestPayload,
+                   EmailChangesPayload, StatsPayload, HelloPayload,
+                   HelloReplyPayload, MetricsPayload]
 
 
 def get_current_utc_time() -> str: